@@ -1,34 +1,58 @@
+import asyncio
+import csv
 import datetime
+import io
 import os
+import re
 import aiomysql
 from decimal import Decimal
 import discord
-from discord.ext import commands
-from typing import Union
-from utils.bank_util import openbank, savebank, switch_token_emoji
-from views.views import GuildMemberEventParticipant
+from discord import app_commands
+from discord.ext import commands, tasks
+from typing import List, Optional, Union
+from utils.bank_util import switch_token_emoji
+from utils.bank_store import GUILD_ID, get_bank_store
+from utils.token_assets import token_assets
+from utils.dm_dispatcher import BLOCKED, FAILED, SENT
+from utils.payout import payout_previews, simulate_payout, to_gold, to_minor_units
+from utils.role_index import role_index
+from utils.token_registry import token_registry
 import logging
 
 logging.basicConfig(level=logging.INFO)
-photos_folder = os.path.join(os.getcwd(), "photos")
+journal_retention_days = int(os.getenv("TOKEN_JOURNAL_RETENTION_DAYS", "90"))
+journal_compaction_hours = float(os.getenv("TOKEN_JOURNAL_COMPACTION_HOURS", "24"))
 company_roles = {
     "settler": 1040383506481692693,
     "officer": 1040383501188468886,
     "consul": 1040383486856540181,
     "governor": 1040383340320149554
 }
-token_types = [
-
-    "Event Token",
-    "Leadership Token",
-    "Competitive Token",
-    "War Token"
-    ]
-payout_event_tokens = [
-    "War Token", 
-    "Leadership Token", 
-    "Competitive Token"
-    ]
+payout_export_page_size = 500
+payout_lock = asyncio.Lock()  # One payout delivery at a time, so a resume and a rerun can't DM the same member twice
+member_id_pattern = re.compile(r"<@!?(\d+)>|(\d{15,20})")  # A member mention or a bare member id, nothing else
+
+async def token_type_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    return [app_commands.Choice(name=token_type.name, value=token_type.name) for token_type in token_registry.search(current)]
+
+async def resolve_token_type(ctx, tokentype):
+    # Maps a name, id or alias in any case to the token type's name; tells the user and returns None when there is none
+    token_type = token_registry.resolve(tokentype)
+    if token_type is None:
+        await ctx.send(f"{tokentype} is not a recognized token type. Use one of the following: {', '.join(token_registry.names)}", ephemeral=True)
+        return None
+    return token_type.name
+
+def parse_member_ids(members):
+    # Splits mentions and ids apart even when they are written back to back; returns the member ids and the parts that are neither
+    member_ids, invalid = [], []
+    for part in re.findall(r"<[^>]*>|[^\s,<]+", members):
+        match = member_id_pattern.fullmatch(part)
+        if match:
+            member_ids.append(int(match.group(1) or match.group(2)))
+        else:
+            invalid.append(part)
+    return member_ids, invalid
 
 async def paginate_pm_messages(member, messages, max_messages_per_page=5):
     pages = [messages[i:i + max_messages_per_page] for i in range(0, len(messages), max_messages_per_page)]
@@ -83,6 +107,83 @@ def create_payout_file(pm_sent, payouts, breakdown, construct_date):
     except Exception as e:
         logging.error(f"General error when creating payout file '{filename}': {e}")
 
+async def deliver_payout(guild, store, run, emojis):
+    # DMs every member still pending and records each delivery as soon as it's sent, so a restart never notifies anyone twice.
+    # Returns how many members are still pending.
+    payouts = {}
+    payout_breakdown = {f"{token_type} Payout": Decimal('0.00') for token_type in token_registry.payout_names}
+    payout_pm_sent = True
+    pending = 0
+    for member_id, member in run["members"].items():
+        discord_member = guild.get_member(member_id)  # Get the Discord member object
+        if not discord_member:
+            if member["status"] == "pending":
+                await store.set_payout_delivery(run["run_id"], member_id, FAILED)  # Left the server since
+            continue
+        amounts = {token_type: to_gold(member["amounts"].get(token_type, 0)) for token_type in token_registry.payout_names}
+        total_payout = sum(amounts.values(), Decimal('0.00'))
+        payouts[discord_member.display_name] = total_payout
+        for token_type, amount in amounts.items():
+            payout_breakdown[f"{token_type} Payout"] += amount
+        if member["status"] != "pending":
+            continue
+        messages = [{"name": f"{emojis[token_type]} {token_type}s", "value": f"{amount:.2f} gold"} for token_type, amount in amounts.items()]
+        messages.append({"name": "Overall Total", "value": f"{total_payout:.2f} gold"})
+        try:
+            delivered = await paginate_pm_messages(discord_member, messages)
+        except discord.HTTPException as e:
+            logging.error(f"Failed to send the payout of {discord_member.display_name}, it will be retried: {e}")
+            payout_pm_sent = False
+            pending += 1
+            continue
+        if not delivered:
+            payout_pm_sent = False
+        await store.set_payout_delivery(run["run_id"], member_id, SENT if delivered else BLOCKED)
+    # Sort payouts alphabetically by member name
+    create_payout_file(payout_pm_sent, dict(sorted(payouts.items())), payout_breakdown, run["payout_key"])
+    return pending
+
+async def simulate_weekly_payout(guild, store, income):
+    # Simulates the payout of the company roles' current members, reusing the last simulation while the bank and roles are unchanged.
+    # Returns the preview and whether it came from the cache.
+    role_index.ensure(guild, company_roles.values())
+    members_by_role = {role_name: sorted(role_index.member_ids(role_id)) for role_name, role_id in company_roles.items()}
+    # Previews are only ever cached under the version of the bank they were computed from, so a hit on the current version is current
+    preview = payout_previews.get(await store.get_version(), income, members_by_role)
+    if preview is not None:
+        return preview, True
+    version, bank = await store.load_versioned_bank()
+    preview = simulate_payout(bank, members_by_role, income)
+    payout_previews.put(version, income, members_by_role, preview)
+    return preview, False
+
+def payout_preview_embed(guild, preview, construct_date, emojis, cached, top=10):
+    plan = preview.plan
+    embed = discord.Embed(
+        title=f"Payout preview for {construct_date}",
+        description=f"{to_gold(plan.pool):.2f} gold to {int((plan.totals > 0).sum())} member(s){' (cached)' if cached else ''}. Nothing was sent or saved.",
+        color=discord.Color.green(),
+    )
+    for token_type, amount in plan.breakdown.items():
+        embed.add_field(name=f"{emojis[token_type]} {token_type}s", value=f"{int(plan.tokens[:, plan.token_types.index(token_type)].sum())} token(s), {to_gold(amount):.2f} gold")
+    lines = []
+    for index in plan.totals.argsort(kind="stable")[::-1][:top].tolist():
+        member = guild.get_member(int(plan.member_ids[index]))
+        name = member.display_name if member else str(int(plan.member_ids[index]))
+        lines.append(f"{name}: {to_gold(plan.totals[index]):.2f} gold")
+    embed.add_field(name=f"Top {len(lines)} payout(s)", value="\n".join(lines) or "-", inline=False)
+    return embed
+
+async def resume_payout(guild, store, payout_key, emojis):
+    # Delivers what is left of a payout run and completes it once nobody is pending. Returns False if there was nothing to deliver.
+    async with payout_lock:
+        run = await store.get_payout_run(payout_key)
+        if run is None or run["completed_at"] is not None:
+            return False
+        if not await deliver_payout(guild, store, run, emojis):
+            await store.complete_payout_run(run["run_id"])
+        return True
+
 
 class BankCog(commands.Cog):
     """"
@@ -90,16 +191,76 @@ class BankCog(commands.Cog):
 
     Commands:
     - /addtokens*: Adds tokens to a user's balance.
+    - /approvetokens*: Grants the tokens waiting on VOD reviews for a list of members and/or an event.
     - /removetokens*: Removes tokens from a user's balance.
     - /balance [@user]*: Shows a user's current balance.
     - /ledger*: Lists all member's balances.
     - /payout*: Pays out gold income to all members of a role based on tokens.
+    - /payouthistory [@user] [weeks] [page]*: Shows a member's payouts week by week.
+    - /payoutexport [week]*: Exports a week's payouts as a CSV file.
 
     * Requires administrator permissions to use.
+
+    Tasks:
+    - compact_journal: Folds token journal entries older than TOKEN_JOURNAL_RETENTION_DAYS into a snapshot.
+
+    Listeners:
+    - on_ready, on_member_join, on_member_update, on_member_remove: Keep the company role index current.
+    - on_ready: Also resumes the payouts a restart interrupted.
     """
     def __init__(self, bot: commands.Bot, pool) -> None:
         self.bot: commands.Bot = bot
         self.pool = pool
+        self.store = get_bank_store(pool)
+
+    async def cog_load(self) -> None:
+        self.compact_journal.start()
+
+    async def cog_unload(self) -> None:
+        self.compact_journal.cancel()
+
+    @tasks.loop(hours=journal_compaction_hours)
+    async def compact_journal(self) -> None:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=journal_retention_days)
+        try:
+            await self.store.compact_journal(cutoff)
+        except Exception as e:
+            logging.error(f"Error compacting the token journal: {e}")
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        guild = self.bot.get_guild(GUILD_ID)
+        if guild:
+            indexed = role_index.build(guild, company_roles.values())
+            logging.info(f"Indexed {indexed} company role membership(s)")
+            try:
+                resumed = await self.resume_payouts(guild)
+                if resumed:
+                    logging.info(f"Resumed {resumed} interrupted payout(s)")
+            except Exception as e:
+                logging.error(f"Error resuming interrupted payouts: {e}")
+
+    async def resume_payouts(self, guild) -> int:
+        """Finish delivering the payouts a restart interrupted. Returns how many were resumed."""
+        emojis = {token_type: await switch_token_emoji(self.bot, token_type) for token_type in token_registry.payout_names}
+        resumed = 0
+        for payout_key in await self.store.get_incomplete_payout_runs():
+            if await resume_payout(guild, self.store, payout_key, emojis):
+                resumed += 1
+        return resumed
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member) -> None:
+        role_index.update(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
+        if before.roles != after.roles:
+            role_index.update(after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member) -> None:
+        role_index.remove(member.id)
 
     @commands.hybrid_command(name="payout", description="Allows you to pay out gold income to all members of a role based on tokens.")
     async def payout(self, ctx: commands.Context, income: float, dry_run: bool = False) -> None:
@@ -107,111 +268,45 @@ class BankCog(commands.Cog):
             await ctx.reply("You do not have permission to use this command.")
             return
         
-        guild_members_participated = {}
-        bank = await openbank(self.pool)  # Bank data
-        weekly_company_income = Decimal(str(income))  # Income for the week
-        weekly_company_payout = Decimal('0.6') * weekly_company_income  # Total payout for the week
-        war_token_ratio = Decimal('3.0')
-        leadership_token_ratio = Decimal('2.0')
-        competitive_token_ratio = Decimal('1.0')
-        weekly_company_payout_ratio = weekly_company_payout / (war_token_ratio + leadership_token_ratio + competitive_token_ratio)  
-        weekly_wartoken_payout = war_token_ratio * weekly_company_payout_ratio  # 76.36% for war tokens
-        weekly_leadershiptoken_payout = leadership_token_ratio * weekly_company_payout_ratio  # 10.92% for leadership tokens
-        weekly_competitivetoken_payout = competitive_token_ratio * weekly_company_payout_ratio  # 12.72% for competitive tokens
-        total_wartokens_earned = Decimal('0.0')
-        total_leadershiptokens_earned = Decimal('0.0')
-        total_competitivetokens_earned = Decimal('0.0')
-        war_emoji = await switch_token_emoji(self.bot, "War Token")
-        leadership_emoji = await switch_token_emoji(self.bot, "Leadership Token")
-        competitive_emoji = await switch_token_emoji(self.bot, "Competitive Token")
-
-        for role_name, role_id in company_roles.items():
-            for member in ctx.guild.members:
-                if role_id in [role.id for role in member.roles]:
-                    guild_member = GuildMemberEventParticipant(member.id)
-                    guild_member.update_tokens_from_bank(bank, role_name)
-                    guild_members_participated[str(member.id)] = guild_member
-                    total_wartokens_earned += Decimal(guild_member.war_tokens)
-                    total_leadershiptokens_earned += Decimal(guild_member.leadership_tokens)
-                    total_competitivetokens_earned += Decimal(guild_member.competitive_tokens)
-                    for tokentype in payout_event_tokens:
-                        bank[role_name].setdefault(str(member.id), {})  # Ensure the member_id key exists
-                        if tokentype in bank[role_name][str(member.id)]:
-                            bank[role_name][str(member.id)][tokentype] = 0  # Reset the tokens for the next week
-
-        total_tokens_earned = (
-            total_wartokens_earned + total_leadershiptokens_earned + total_competitivetokens_earned
-        )
-        if total_tokens_earned == 0:
-            await ctx.send("No tokens have been earned this week. No payout necessary.")
-            return
-
-        gold_per_wartoken = weekly_wartoken_payout / total_wartokens_earned  # Gold per war token
-        gold_per_leadershiptoken = weekly_leadershiptoken_payout / total_leadershiptokens_earned  # Gold per leadership token
-        gold_per_competitivetoken = weekly_competitivetoken_payout / total_competitivetokens_earned  # Gold per competitive token
-
         monday = datetime.datetime.today() - datetime.timedelta(days=datetime.datetime.today().weekday())
         construct_date = monday.strftime("%m/%d/%Y")
+        emojis = {token_type: await switch_token_emoji(self.bot, token_type) for token_type in token_registry.payout_names}
 
-        # Prepare payouts and breakdown
-        payouts = {}
-        payout_breakdown = {
-            "War Token Payout": Decimal('0.00'),
-            "Leadership Token Payout": Decimal('0.00'),
-            "Competitive Token Payout": Decimal('0.00')
-        }
-        payout_pm_sent = True
-        for member_id, guild_member in guild_members_participated.items():
-            discord_member = await ctx.guild.get_member(int(member_id))  # Get the Discord member object
-            if discord_member:
-                war_token_payout = guild_member.war_token_payout(gold_per_wartoken)  # Get the war token payout for the member
-                leadership_token_payout = guild_member.leadership_token_payout(gold_per_leadershiptoken)
-                competitive_token_payout = guild_member.competitive_token_payout(gold_per_competitivetoken)
-                total_payout = war_token_payout + leadership_token_payout + competitive_token_payout
-                payouts[discord_member.display_name] = total_payout
-                # Update the breakdown
-                payout_breakdown["War Token Payout"] += war_token_payout
-                payout_breakdown["Leadership Token Payout"] += leadership_token_payout
-                payout_breakdown["Competitive Token Payout"] += competitive_token_payout
-                messages = [
-                    {"name": f"{war_emoji} War Tokens", "value": f"{war_token_payout:.2f} gold"},
-                    {"name": f"{leadership_emoji} Leadership Tokens", "value": f"{leadership_token_payout:.2f} gold"},
-                    {"name": f"{competitive_emoji} Competitive Tokens", "value": f"{competitive_token_payout:.2f} gold"},
-                    {"name": "Overall Total", "value": f"{total_payout:.2f} gold"}
-                ]
-                if not dry_run:
-                    if not await paginate_pm_messages(discord_member, messages):
-                        payout_pm_sent = False
-                if dry_run and discord_member.id == 342142929533403136:
-                    if not await paginate_pm_messages(discord_member, messages):
-                        payout_pm_sent = False
-
-        # Sort payouts alphabetically by member name
-        sorted_payouts = dict(sorted(payouts.items()))
-
-        if not dry_run:
-            await savebank(bank, self.pool)  # Only save if not a dry run
-
-        # Create an overall payout file
-        create_payout_file(payout_pm_sent, sorted_payouts, payout_breakdown, construct_date)
+        # A payout is a job keyed by its week: once created, rerunning /payout resumes it instead of paying again
+        run = None if dry_run else await self.store.get_payout_run(construct_date)  # A dry run only simulates
+        if run is not None:
+            if run["completed_at"] is not None:
+                await ctx.send(f"The payout of {construct_date} has already been delivered.", ephemeral=True)
+                return
+            await ctx.send(f"Resuming the payout of {construct_date}; members who were already paid are skipped.", ephemeral=True)
+        else:
+            preview, cached = await simulate_weekly_payout(ctx.guild, self.store, income)
+            if not preview.plan.tokens.any():
+                await ctx.send("No tokens have been earned this week. No payout necessary.")
+                return
+            if dry_run:
+                await ctx.send(embed=payout_preview_embed(ctx.guild, preview, construct_date, emojis, cached), ephemeral=True)
+                return
+            # The tokens paid for are reset in the same transaction that freezes the payout
+            await self.store.create_payout_run(construct_date, monday.date(), to_minor_units(income), preview.plan.pool, preview.plan.lines(),
+                                               preview.resets, str(ctx.author.id))
+        await resume_payout(ctx.guild, self.store, construct_date, emojis)
 
     @commands.hybrid_command(name="balance", description="Show's your current Event Balance.")
     async def balance(self, ctx: commands.Context, target: Union[discord.Member, discord.Role] = None) -> None:
         try:
             if target is None:
                 target = ctx.author
-            bank = await openbank(self.pool)
 
             if isinstance(target, discord.Member):
                 if target != ctx.author and not (ctx.author.guild_permissions and ctx.author.guild_permissions.manage_events):
                     await ctx.send("You don't have the required permissions to view other members' balances.", ephemeral=True)
                     return
-                member_id = str(target.id)
+                member_balances = await self.store.get_member_balances(target.id)
                 total_balances = {}
                 for role_name in company_roles:
-                    role_data = bank.get(role_name, {})
-                    member_data = role_data.get(member_id, {})
-                    for tokentype in token_types:
+                    member_data = member_balances.get(role_name, {})
+                    for tokentype in token_registry.names:
                         total_balances[tokentype] = total_balances.get(tokentype, 0) + member_data.get(tokentype, 0)
                 # Check if all balances are 0
                 if all(balance == 0 for balance in total_balances.values()):
@@ -224,14 +319,10 @@ class BankCog(commands.Cog):
                     embed.add_field(name=f"{token_emoji} {tokentype} Balance:", value=f"{balance} Token(s)")
                 await ctx.send(embed=embed, ephemeral=True)
             elif isinstance(target, discord.Role) and target.name.lower() in [role.lower() for role in company_roles]:
-                total_balances_for_role = {tokentype: 0 for tokentype in token_types}
-                for member in ctx.guild.members:
-                    if target in member.roles:
-                        member_id = str(member.id)
-                        role_data = bank.get(target.name.lower(), {})
-                        member_data = role_data.get(member_id, {})
-                        for tokentype in token_types:
-                            total_balances_for_role[tokentype] += member_data.get(tokentype, 0)
+                role_index.ensure(ctx.guild, company_roles.values())
+                member_ids = list(role_index.member_ids(target.id))
+                role_totals = await self.store.get_totals(target.name.lower(), member_ids)
+                total_balances_for_role = {tokentype: role_totals.get(tokentype, 0) for tokentype in token_registry.names}
                 if all(balance == 0 for balance in total_balances_for_role.values()):
                     await ctx.send(f"No members have any tokens in the bank for the {target.name} role.", ephemeral=True)
                     return
@@ -247,18 +338,14 @@ class BankCog(commands.Cog):
 
 
     @commands.hybrid_command(name="removetokens", description="Allows you to remove tokens from a player's Token Balance.")
+    @app_commands.autocomplete(tokentype=token_type_autocomplete)
     async def removetokens(self, ctx: commands.Context, user: discord.Member, tokentype: str, tokens: int) -> None:
         try:
             if ctx.author.guild_permissions.administrator:
-                bank = await openbank(self.pool)
                 company_role = None
-                for token in token_types:
-                    if tokentype.lower().strip() == token.lower().strip():
-                        tokentype = token
-                        break
-                    else:
-                        await ctx.send(f"{tokentype} is not a recognized token type. use one of the following: {', '.join(token_types)}", ephemeral=True)
-                        return
+                tokentype = await resolve_token_type(ctx, tokentype)
+                if tokentype is None:
+                    return
                 for role_name, role_id in company_roles.items():
                     role = discord.utils.get(user.roles, id=role_id)
                     if role:
@@ -267,24 +354,21 @@ class BankCog(commands.Cog):
                 if company_role is None:
                     await ctx.send("The user doesn't have a recognized company role.", ephemeral=True)
                     return
-                user_id = str(user.id)
-                if company_role not in bank or user_id not in bank[company_role]:
+                member_tokens = (await self.store.get_member_balances(user.id, company_role)).get(company_role)
+                if not member_tokens:
                     await ctx.send(f"{user.display_name if user.display_name else user.name} does not have a balance in the bank for {company_role}.", ephemeral=True)
                     return
                 if tokens >= 0:
-                    if tokentype in bank[company_role][user_id]:
-                        # Ensure the balance doesn't go below 0
-                        bank[company_role][user_id][tokentype] = max(0, bank[company_role][user_id][tokentype] - tokens)
-                    else:
+                    if tokentype not in member_tokens:
                         await ctx.send(f"{user.display_name} does not have any {tokentype} to remove", ephemeral=True)
                         return
                 else:
                     await ctx.send("You can't remove a negative amount of tokens.", ephemeral=True)
                     return
-                await savebank(bank, self.pool)
+                new_balance = await self.store.increment(user.id, company_role, tokentype, -tokens, source="removetokens", source_id=str(ctx.author.id))  # Floors the balance at 0
                 await ctx.send(embed=discord.Embed(
                     title=f"Removed {tokens} token(s) from {user.display_name if user.display_name else user.name}'s {tokentype} Balance.",
-                    description=f"New {tokentype} balance: {bank[company_role][user_id][tokentype]}",
+                    description=f"New {tokentype} balance: {new_balance}",
                     color=discord.Color.blue()
                 ), ephemeral=True)
             else:
@@ -294,15 +378,14 @@ class BankCog(commands.Cog):
             await ctx.send("An error occurred while processing your request.", ephemeral=True)
 
     @commands.hybrid_command(name="addtokens", description="Allows you to add tokens to a player's Token Balance.")
+    @app_commands.autocomplete(tokentype=token_type_autocomplete)
     async def addtokens(self, ctx: commands.Context, user: discord.Member, tokentype: str, tokens: int) -> None:
         logging.info("Add tokens command started")
         if ctx.author.guild_permissions.administrator:
             try:
-                for token in token_types:
-                    if tokentype.lower().strip() == token.lower().strip(): 
-                        tokentype = token
-                        break
-                bank = await openbank(self.pool)
+                tokentype = await resolve_token_type(ctx, tokentype)
+                if tokentype is None:
+                    return
                 company_role = None
                 for role_name, role_id in company_roles.items():
                     role = discord.utils.get(user.roles, id=role_id)
@@ -312,38 +395,129 @@ class BankCog(commands.Cog):
                 if company_role is None:
                     await ctx.send("The user doesn't have a recognized company role.", ephemeral=True)
                     return
-                member_id = str(user.id)
-                bank.setdefault(company_role, {}).setdefault(member_id, {}).setdefault(tokentype, 0)
-                bank[company_role][member_id][tokentype] += tokens # Add the tokens to the user's balance
-                await savebank(bank, self.pool)
+                new_balance = await self.store.increment(user.id, company_role, tokentype, tokens, source="addtokens", source_id=str(ctx.author.id)) # Add the tokens to the user's balance
                 await ctx.send(embed=discord.Embed(
                 title=f"Added {tokens} {tokentype}(s) to {user.display_name if user.display_name else user.name}'s {company_role} balance.",
-                description=f"New balance: {bank[company_role][member_id][tokentype]} {tokentype}(s)",
+                description=f"New balance: {new_balance} {tokentype}(s)",
                 color=discord.Color.blue()), ephemeral=True)
-                file = discord.File(os.path.join(photos_folder, f"{tokentype}.png"), filename=f"token.png")  # Create a file object              
-                embed = discord.Embed(title=f"Added {tokens} token(s) to your {company_role} {tokentype} Token Balance.", description=f"New balance: {bank[company_role][member_id][tokentype]} Token(s)", color=discord.Color.blue())
-                embed.set_image(url=f"attachment://token.png")
-                await user.send(file=file, embed=embed)
+                embed = discord.Embed(title=f"Added {tokens} token(s) to your {company_role} {tokentype} Token Balance.", description=f"New balance: {new_balance} Token(s)", color=discord.Color.blue())
+                await user.send(**token_assets.embed(embed, tokentype))
             except Exception as e:
                 logging.error(f"Error in addTokens: {e}")
                 await ctx.send("An error occurred while processing your request.", ephemeral=True)
         else:
             await ctx.send("You don't have permissions to add Tokens.", ephemeral=True)
 
+    @commands.hybrid_command(name="approvetokens", description="Grants the pending VOD review tokens of members and/or an event.")
+    async def approvetokens(self, ctx: commands.Context, members: Optional[str] = None, event_id: Optional[str] = None) -> None:
+        if not ctx.author.guild_permissions.administrator:
+            await ctx.send("You don't have permissions to approve tokens.", ephemeral=True)
+            return
+        member_ids = None
+        if members:
+            # Role and channel mentions or typos must not be approved as if they were member ids
+            member_ids, invalid = parse_member_ids(members)
+            if invalid or not member_ids:
+                await ctx.send(f"{', '.join(invalid) or members} is not a member mention or id.", ephemeral=True)
+                return
+        if not member_ids and not event_id:
+            await ctx.send("Mention the members to approve, give an event id, or both.", ephemeral=True)
+            return
+        try:
+            changes = await self.store.approve_pending_tokens(member_ids, int(event_id) if event_id else None, str(ctx.author.id))
+        except ValueError:
+            await ctx.send(f"{event_id} is not a valid event id.", ephemeral=True)
+            return
+        except Exception as e:
+            logging.error(f"Error in approvetokens: {e}")
+            await ctx.send("An error occurred while processing your request.", ephemeral=True)
+            return
+        if not changes:
+            await ctx.send("There are no pending tokens to approve.", ephemeral=True)
+            return
+        embed = discord.Embed(title=f"Approved pending tokens for {len(changes)} balance(s)", color=discord.Color.blue())
+        lines = [f"<@{member_id}>: {token_type} {start} -> {end}" for (_, member_id, token_type), (start, end) in changes.items()]
+        embed.description = "\n".join(lines)[:4000]
+        await ctx.send(embed=embed, ephemeral=True)
+
+    @commands.hybrid_command(name="payouthistory", description="Shows a member's payouts week by week.")
+    async def payouthistory(self, ctx: commands.Context, member: discord.Member = None, weeks: int = 10, page: int = 1) -> None:
+        member = member or ctx.author
+        if member != ctx.author and not ctx.author.guild_permissions.manage_events:
+            await ctx.send("You don't have the required permissions to view other members' payouts.", ephemeral=True)
+            return
+        weeks = max(1, min(weeks, 25))  # One embed field per week
+        today = datetime.date.today()
+        before = today - datetime.timedelta(days=today.weekday()) + datetime.timedelta(weeks=1 - weeks * (max(page, 1) - 1))
+        since = before - datetime.timedelta(weeks=weeks)
+        try:
+            rows = await self.store.get_payout_history(member.id, since, before)
+        except Exception as e:
+            logging.error(f"Error in payouthistory: {e}")
+            await ctx.send("An error occurred while processing your request.", ephemeral=True)
+            return
+        if not rows:
+            await ctx.send(f"{member.display_name} has no payouts between {since:%m/%d/%Y} and {before:%m/%d/%Y}.", ephemeral=True)
+            return
+        history = {}
+        for row in rows:
+            history.setdefault(row["week"], []).append(row)
+        embed = discord.Embed(title=f"{member.display_name}'s payouts", color=discord.Color.green())
+        for week, week_rows in history.items():
+            lines = [f"{row['token_type']}: {row['tokens']} token(s), {to_gold(row['amount']):.2f} gold" for row in week_rows]
+            total = to_gold(sum(row["amount"] for row in week_rows))
+            embed.add_field(name=f"Week of {week:%m/%d/%Y}: {total:.2f} gold", value="\n".join(lines), inline=False)
+        embed.set_footer(text=f"Page {max(page, 1)}: {since:%m/%d/%Y} - {before:%m/%d/%Y}")
+        await ctx.send(embed=embed, ephemeral=True)
+
+    @commands.hybrid_command(name="payoutexport", description="Exports a week's payouts as a CSV file.")
+    async def payoutexport(self, ctx: commands.Context, week: Optional[str] = None) -> None:
+        if not ctx.author.guild_permissions.administrator:
+            await ctx.send("You don't have permissions to export payouts.", ephemeral=True)
+            return
+        try:
+            day = datetime.datetime.strptime(week, "%m/%d/%Y").date() if week else datetime.date.today()
+        except ValueError:
+            await ctx.send(f"{week} is not a valid date, use MM/DD/YYYY.", ephemeral=True)
+            return
+        monday = day - datetime.timedelta(days=day.weekday())
+        file = io.StringIO()
+        writer = csv.writer(file)
+        writer.writerow(["week", "member_id", "member_name", "token_type", "tokens", "gold"])
+        rows = 0
+        try:
+            after = None
+            while True:
+                page = await self.store.get_payout_lines(monday, after, payout_export_page_size)
+                for line in page:
+                    discord_member = ctx.guild.get_member(line["member_id"])
+                    writer.writerow([monday.isoformat(), line["member_id"], discord_member.display_name if discord_member else "",
+                                     line["token_type"], line["tokens"], f"{to_gold(line['amount']):.2f}"])
+                rows += len(page)
+                if len(page) < payout_export_page_size:
+                    break
+                after = (page[-1]["member_id"], page[-1]["token_type"])
+        except Exception as e:
+            logging.error(f"Error in payoutexport: {e}")
+            await ctx.send("An error occurred while processing your request.", ephemeral=True)
+            return
+        if not rows:
+            await ctx.send(f"There is no payout for the week of {monday:%m/%d/%Y}.", ephemeral=True)
+            return
+        await ctx.send(f"{rows} payout line(s) for the week of {monday:%m/%d/%Y}.",
+                       file=discord.File(io.BytesIO(file.getvalue().encode("utf-8")), filename=f"payout_{monday.isoformat()}.csv"), ephemeral=True)
+
     @commands.hybrid_command(name="ledger", description="Lists all member's balances")
+    @app_commands.autocomplete(tokentype=token_type_autocomplete)
     async def ledger(self, ctx: commands.Context, tokentype: str) -> None:
         message = await ctx.defer(ephemeral=True)
         if ctx.author.guild_permissions.manage_events:
             # Validate the token type
-            for token in token_types:
-                if tokentype.lower().strip() == token.lower().strip():
-                    tokentype = token
-                    break
-            else:
-                await ctx.send(f"{tokentype} is not a recognized token type. Use one of the following: {', '.join(token_types)}", ephemeral=True)
+            tokentype = await resolve_token_type(ctx, tokentype)
+            if tokentype is None:
                 return
 
-            bank = await openbank(self.pool)
+            ledger_balances = await self.store.get_token_balances(tokentype)
             emb = discord.Embed(title="Good Company Ledger", color=discord.Color.blue())
             no_tokens_found = True  # Assume no tokens are found initially
 
@@ -353,10 +527,9 @@ class BankCog(commands.Cog):
                     header = f"**{role_name.capitalize()} Balances**"
                     names = []
 
-                    for member_id, tokens in bank.get(role_name, {}).items():
+                    for member_id, balance in ledger_balances.get(role_name, {}).items():
                         try:
-                            member = await ctx.guild.fetch_member(int(member_id))
-                            balance = tokens.get(tokentype, 0)  # Get the balance for the specified token type
+                            member = await ctx.guild.fetch_member(member_id)
                             if balance > 0:
                                 no_tokens_found = False  # Tokens found, so set flag to False
                                 nickname = member.display_name if member.display_name else member.name
@@ -1,9 +1,27 @@
 import logging
+import os
+import time
 import discord
-from discord.ext import commands  
-from utils.db import openbank, savebank
+from discord.ext import commands, tasks
+from typing import List, NamedTuple, Optional
+from utils.attendance import ATTENDANCE_FLUSH_SECONDS, AttendanceLog
+from utils.bank_store import get_bank_store
+from utils.event_registry import EventRegistry
+from utils.token_assets import TOKEN_ASSET_CHANNEL, TOKEN_ASSET_REFRESH_HOURS, token_assets
+from utils.token_registry import token_registry
 import asyncio
-from views.views import EventParticipant, Event
+from views.views import Event
+
+VOICE_QUEUE_SIZE = int(os.getenv("VOICE_QUEUE_SIZE", "10000"))
+VOICE_BATCH_SIZE = int(os.getenv("VOICE_BATCH_SIZE", "500"))
+RECONCILE_SECONDS = float(os.getenv("ATTENDANCE_RECONCILE_SECONDS", "10"))
+
+
+class VoiceUpdate(NamedTuple):
+    member_id: int
+    left_channel_id: Optional[int]
+    joined_channel_id: Optional[int]
+    at: float  # time.monotonic() when the update arrived
 
 
 class EventCog(commands.Cog):
@@ -16,11 +34,14 @@ class EventCog(commands.Cog):
         leave_channel (int): The channel id where the bot sends a message when a member leaves the server.
         company_roles (dict): A dictionary containing the company roles and their respective role ids.
         ally_roles (dict): A dictionary containing the ally roles and their respective role ids.
-        current_event (Event): The current event instance.
+        events (EventRegistry): The running events by scheduled event id and by channel id.
+        attendance (AttendanceLog): The checkpoint of the running events' joins and leaves.
+        voice_updates (asyncio.Queue): Voice channel moves into or out of event channels, waiting to be applied.
         """
     def __init__(self, bot, pool):
         self.bot = bot
         self.pool = pool
+        self.store = get_bank_store(pool)
         self.leave_channel = 1162190524619444264
         self.company_roles = {
             "settler": 1040383506481692693,
@@ -32,7 +53,86 @@ class EventCog(commands.Cog):
             "Ally": 1052890530910044181,
             "Selected for War": 1047718256498192405
         }
-        self.current_event = None
+        self.events = EventRegistry()
+        self.attendance = AttendanceLog(pool)
+        self.voice_updates: asyncio.Queue = asyncio.Queue(maxsize=VOICE_QUEUE_SIZE)
+        self._voice_consumer = None
+
+    async def cog_load(self) -> None:
+        self.flush_attendance.start()
+        self.reconcile_attendance.start()
+        if TOKEN_ASSET_CHANNEL:
+            self.upload_token_assets.start()
+        self._voice_consumer = asyncio.create_task(self.consume_voice_updates())
+
+    async def cog_unload(self) -> None:
+        self.flush_attendance.cancel()
+        self.reconcile_attendance.cancel()
+        self.upload_token_assets.cancel()
+        if self._voice_consumer is not None:
+            self._voice_consumer.cancel()
+            self._voice_consumer = None
+        self.process_voice_updates()  # Apply whatever is still queued before the last flush
+        try:
+            await self.attendance.flush()
+        except Exception as e:
+            logging.error(f"Error flushing attendance on unload: {e}")
+
+    @tasks.loop(seconds=ATTENDANCE_FLUSH_SECONDS)
+    async def flush_attendance(self) -> None:
+        if not self.events:
+            return
+        try:
+            await self.attendance.flush()
+        except Exception as e:
+            logging.error(f"Error flushing attendance: {e}")
+
+    @tasks.loop(seconds=RECONCILE_SECONDS)
+    async def reconcile_attendance(self) -> None:
+        if not self.events:
+            return
+        # Apply queued updates first so only the ones the gateway never delivered count as corrections
+        while self.process_voice_updates():
+            pass
+        for event_id, event in list(self.events.events.items()):
+            try:
+                corrections = event.reconcile()
+                if corrections:
+                    logging.warning(f"Reconciled {corrections} attendance session(s) of event {event_id} "
+                                    f"({event.corrections} so far)")
+            except Exception as e:
+                logging.error(f"Error reconciling attendance of event {event_id}: {e}")
+
+    @tasks.loop(hours=TOKEN_ASSET_REFRESH_HOURS)
+    async def upload_token_assets(self) -> None:
+        # Runs at startup and again before Discord's signed attachment URLs expire
+        channel = self.bot.get_channel(TOKEN_ASSET_CHANNEL)
+        if channel is None:
+            logging.error(f"Token asset channel {TOKEN_ASSET_CHANNEL} not found; token images will be attached to every DM")
+            return
+        uploaded = await token_assets.upload(channel, token_registry.names)
+        logging.info(f"Uploaded {uploaded} token image(s) to the asset channel")
+
+    @upload_token_assets.before_loop
+    async def before_upload_token_assets(self) -> None:
+        await self.bot.wait_until_ready()
+
+    async def resume_events(self, guild) -> int:
+        """Rehydrate the active scheduled events of the guild that have an attendance checkpoint. Returns how many were resumed."""
+        resumed = 0
+        for scheduled_event in guild.scheduled_events:
+            if str(scheduled_event.status) != "EventStatus.active" or scheduled_event.id in self.events:
+                continue
+            event = Event(self.bot, self.pool, scheduled_event.id, self.attendance)
+            session = await self.attendance.load(scheduled_event.id)
+            if session is None:
+                # Started while the bot was down: track it from now on
+                await event.initialize(scheduled_event)
+            else:
+                await event.rehydrate(scheduled_event, session)
+                resumed += 1
+            self.events.add(scheduled_event.id, event)
+        return resumed
 
     @commands.Cog.listener()
     async def on_ready(self): # Called when the bot is ready
@@ -41,6 +141,11 @@ class EventCog(commands.Cog):
         guild = self.bot.get_guild(guild_id)
         if guild: # Check if the bot is in the guild
             logging.info(f"Connected to guild: {guild.name}")
+            try:
+                resumed = await self.resume_events(guild)
+                logging.info(f"Resumed {resumed} event(s) in progress")
+            except Exception as e:
+                logging.error(f"Error resuming events in progress: {e}")
         # Syncing application commands
         try:
             synced = await self.bot.tree.sync() # Sync the application commands
@@ -52,19 +157,9 @@ class EventCog(commands.Cog):
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
-        try:
-            bank = await openbank(self.pool)
-        except Exception as e:
-            logging.error(f"Error opening bank for member {member.id}: {e}")
-            return
-
         try: # Remove the member from the bank
-            member_id = str(member.id)
-            for role_name in bank:
-                if member_id in bank[role_name]:
-                    del bank[role_name][member_id]
-                    logging.info(f"Removed {member.name} from bank")
-            await savebank(bank, self.pool)
+            await self.store.delete_member(member.id, source="member_remove")
+            logging.info(f"Removed {member.name} from bank")
         except Exception as e:
             logging.error(f"Error updating bank for member {member.id}: {e}")
  
@@ -80,31 +175,70 @@ class EventCog(commands.Cog):
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        if self.current_event and self.current_event.is_ongoing and self.current_event.channel:
-            if self.current_event.channel == after.channel and before.channel != after.channel:
-                logging.info(f"{member.display_name} joined the event channel")
-                event_participant = self.current_event.participatns.get(member.id)
-                if event_participant:
-                    event_participant.join_event()
-                else:
-                    logging.info(f"{member.display_name} is not part of the event")
-                    event_participant = EventParticipant(member.id)
-                    self.current_event.participants[member.id] = event_participant
-                    event_participant.join_event()
-            elif self.current_event.channel == before.channel and before.channel != after.channel:
-                logging.info(f"{member.display_name} left the event channel")
-                event_participant = self.current_event.participants.get(member.id)
-                event_participant.leave_event()
+        # Runs in the gateway dispatch path, so it only filters and enqueues; consume_voice_updates does the bookkeeping
+        if before.channel == after.channel or not self.events:
+            return  # Mute, deafen, stream changes and the like don't move anyone in or out of an event
+        left_channel_id = before.channel.id if before.channel else None
+        joined_channel_id = after.channel.id if after.channel else None
+        if left_channel_id not in self.events.channels and joined_channel_id not in self.events.channels:
+            return
+        update = VoiceUpdate(member.id, left_channel_id, joined_channel_id, time.monotonic())
+        try:
+            self.voice_updates.put_nowait(update)
+        except asyncio.QueueFull:
+            # Never block the dispatcher and never drop attendance: apply the backlog in place, oldest first, so this
+            # update can't overtake an earlier one for the same member (a new join followed by their older leave)
+            logging.warning("Voice update queue is full, applying the queued updates inline")
+            while self.process_voice_updates():
+                pass
+            self.apply_voice_updates([update])
+
+    def apply_voice_updates(self, updates: List[VoiceUpdate]) -> None:
+        joins = leaves = 0
+        for update in updates:
+            for event in self.events.in_channel(update.left_channel_id):
+                if event.is_ongoing:
+                    event.member_left(update.member_id, update.at)
+                    leaves += 1
+            for event in self.events.in_channel(update.joined_channel_id):
+                if event.is_ongoing:
+                    event.member_joined(update.member_id, update.at)
+                    joins += 1
+        if joins or leaves:
+            logging.info(f"Applied {len(updates)} voice update(s): {joins} event join(s), {leaves} event leave(s)")
+
+    def process_voice_updates(self, updates: Optional[List[VoiceUpdate]] = None) -> int:
+        """Apply the given updates plus queued ones, up to VOICE_BATCH_SIZE, without waiting. Returns how many were applied."""
+        updates = list(updates or [])
+        while len(updates) < VOICE_BATCH_SIZE and not self.voice_updates.empty():
+            updates.append(self.voice_updates.get_nowait())
+        if updates:
+            self.apply_voice_updates(updates)
+        return len(updates)
+
+    async def consume_voice_updates(self) -> None:
+        while True:
+            # Wait for one update, then take everything else that queued up behind it as the same batch
+            update = await self.voice_updates.get()
+            try:
+                self.process_voice_updates([update])
+            except Exception as e:
+                logging.error(f"Error applying voice updates: {e}")
 
     @commands.Cog.listener()
     async def on_scheduled_event_update(self, before, after):
         try:
             if before.status != after.status:
                 if str(after.status) == "EventStatus.active":
-                    self.current_event = Event(self.bot, self.pool)
-                    await self.current_event.initialize(before)
+                    event = Event(self.bot, self.pool, after.id, self.attendance)
+                    await event.initialize(before)
+                    self.events.add(after.id, event)
                 elif str(after.status) == "EventStatus.completed":
-                    await self.current_event.finalize(before)
+                    event = self.events.remove(after.id)
+                    if event is None:
+                        logging.error(f"Scheduled event {after.name} ({after.id}) ended but was not being tracked")
+                    else:
+                        await event.finalize(before)
                 else:
                     logging.error(f"Unhandled event status: {after.status}")
         except Exception as e:
@@ -114,5 +248,5 @@ class EventCog(commands.Cog):
             logging.info(f"Event update completed: {after.name}")
 
 
-def setup(bot, pool):
-    bot.add_cog(EventCog(bot, pool))
+async def setup(bot, pool):
+    await bot.add_cog(EventCog(bot, pool))
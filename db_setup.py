@@ -1,8 +1,15 @@
 from utils.db import create_db_pool, close_db_pool
+from utils.bank_store import get_bank_store
+from utils.migrations import run_migrations
 
 
 async def initialize_db_pool():
     pool = await create_db_pool()
+    if pool is not None:
+        await run_migrations(pool)  # Only place DDL runs; hot paths issue DML only
+        store = get_bank_store(pool)
+        await store.import_legacy_bank()  # One-shot: retires the bank_data blob once imported
+        await store.take_snapshot()  # First snapshot only; later ones come from journal compaction
     return pool
 
 
@@ -20,11 +20,12 @@ async def setup_cogs(bot, pool):
 
 
 async def shutdown(bot, pool):
-    """Gracefully shut down the bot and database pool."""
+    """Gracefully shut down the bot, then the database pool."""
     logging.info("Shutting down bot and closing database connections...")
+    # Closing the bot unloads the cogs, which flush their attendance checkpoints, so the pool has to outlive it
+    await bot.close()
     if pool:
         await shutdown_db_pool(pool)
-    await bot.close()
     logging.info("Shutdown complete.")
 
 
@@ -35,6 +36,11 @@ async def main():
     bot = create_bot()
     DISCORD_TOKEN = configure_bot()
 
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # Closing the bot ends bot.start(), and the finally below then shuts down the bot and pool in order
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(bot.close()))
+
     try:
         # Load cogs
         await setup_cogs(bot, pool)
@@ -49,8 +55,4 @@ async def main():
 
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
-
-    for sig in (signal.SIGINT, signal.SIGTERM):
-        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(shutdown(bot=None, pool=None)))
-
     loop.run_until_complete(main())
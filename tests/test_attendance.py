@@ -0,0 +1,97 @@
+import datetime
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock
+from utils.attendance import JOIN, LEAVE, AttendanceLog
+from utils.db import SQLitePool
+from utils.migrations import run_migrations
+from views.views import Event, EventParticipant, datetime_from_clock
+
+
+class TestAttendanceLog(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = await SQLitePool(os.path.join(self.tmp.name, "bank.sqlite3"), 2).open()
+        await run_migrations(self.pool)
+        self.attendance = AttendanceLog(self.pool, guild_id=1)
+        self.started = datetime.datetime(2024, 1, 1, 20, 0)
+
+    async def asyncTearDown(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+        self.tmp.cleanup()
+
+    def minutes(self, minutes):
+        return self.started + datetime.timedelta(minutes=minutes)
+
+    async def test_flushed_records_survive_a_restart(self):
+        await self.attendance.start_event(10, 555, self.started)
+        self.attendance.record(10, 1, JOIN, self.minutes(0))
+        self.attendance.record(10, 2, JOIN, self.minutes(5))
+        self.attendance.record(10, 1, LEAVE, self.minutes(30))
+        self.assertEqual(await self.attendance.flush(), 3)
+        self.attendance.record(10, 2, LEAVE, self.minutes(40))  # Never flushed: lost in the crash
+
+        restarted = AttendanceLog(self.pool, guild_id=1)
+        session = await restarted.load(10)
+        self.assertEqual((session.channel_id, session.started_at), (555, self.started))
+        self.assertGreater(session.checkpoint_at, self.started)
+        self.assertEqual(session.records, [(1, JOIN, self.minutes(0)), (2, JOIN, self.minutes(5)), (1, LEAVE, self.minutes(30))])
+
+        await restarted.end_event(10)
+        self.assertIsNone(await restarted.load(10))
+
+    async def test_rehydrated_event_keeps_credit(self):
+        channel = MagicMock()
+        channel.id = 555
+        present = MagicMock()
+        present.id = 2
+        channel.members = [present]
+        scheduled_event = MagicMock()
+        scheduled_event.channel = channel
+        await self.attendance.start_event(10, 555, self.started)
+        self.attendance.record(10, 1, JOIN, self.minutes(0))
+        self.attendance.record(10, 2, JOIN, self.minutes(0))
+        self.attendance.record(10, 3, JOIN, self.minutes(0))
+        self.attendance.record(10, 3, LEAVE, self.minutes(10))
+        await self.attendance.flush()
+        session = (await self.attendance.load(10))._replace(checkpoint_at=self.minutes(60))
+
+        event = Event(MagicMock(), MagicMock(), 10, self.attendance)
+        await event.rehydrate(scheduled_event, session)
+        self.assertTrue(event.is_ongoing)
+        self.assertEqual(event.event_start_time, self.started)
+        # Member 1 left while the bot was down and is credited up to the last checkpoint
+        self.assertEqual(event.participants[1].get_total_time_spent(), datetime.timedelta(minutes=60))
+        self.assertEqual(event.participants[3].get_total_time_spent(), datetime.timedelta(minutes=10))
+        # Member 2 is still in the channel, so their period keeps running
+        self.assertEqual(event.participants[2].current_start_time, self.minutes(0))
+
+
+class TestEventParticipant(unittest.TestCase):
+
+    def test_sessions_are_merged_and_timed(self):
+        start = time.monotonic()
+
+        def minutes(count):
+            return start + count * 60
+
+        participant = EventParticipant(1234567890)
+        participant.join_event(minutes(0))
+        participant.join_event(minutes(1))  # Duplicate join keeps the running session
+        participant.leave_event(minutes(10))
+        participant.join_event(minutes(10))  # Rejoin at the same moment reopens it
+        participant.leave_event(minutes(20))
+        participant.join_event(minutes(30))
+        self.assertEqual(participant.current_start_time, datetime_from_clock(minutes(30)))
+        participant.leave_event(minutes(45))
+        self.assertIsNone(participant.current_start_time)
+        self.assertEqual(participant.get_total_time_spent(), datetime.timedelta(minutes=35))
+        self.assertEqual(participant.sessions(), [
+            (datetime_from_clock(minutes(0)), datetime_from_clock(minutes(20))),
+            (datetime_from_clock(minutes(30)), datetime_from_clock(minutes(45))),
+        ])
+        self.assertFalse(hasattr(participant, "__dict__"))
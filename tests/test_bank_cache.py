@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+from utils.bank_cache import BankCache
+
+
+class FakeStore:
+    """In-memory stand-in for BankStore that keeps a shared bank version like the database does."""
+    def __init__(self, database):
+        self.database = database
+        self.version = 0
+        self.writes = 0
+        self.load_calls = 0
+        self.delays = []  # Seconds each increment takes to commit after taking its version
+
+    async def get_version(self):
+        return self.database["version"]
+
+    async def load_bank(self):
+        self.load_calls += 1
+        return {
+            company: {str(member_id): dict(tokens) for member_id, tokens in members.items()}
+            for company, members in self.database["bank"].items()
+        }
+
+    async def increment(self, member_id, company, token_type, delta, floor=0, source="increment", source_id=None):
+        tokens = self.database["bank"].setdefault(company, {}).setdefault(member_id, {})
+        tokens[token_type] = max(floor, tokens.get(token_type, 0) + delta)
+        self.database["version"] += 1
+        version = self.database["version"]
+        await asyncio.sleep(self.delays.pop(0) if self.delays else 0)
+        self.version = max(self.version, version)
+        self.writes += 1
+        return tokens[token_type]
+
+
+class TestBankCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.database = {"version": 1, "bank": {"settler": {1234567890: {"War Token": 2}}}}
+        self.store = FakeStore(self.database)
+        self.cache = BankCache(self.store, check_interval=60)
+
+    async def test_reads_are_served_from_memory(self):
+        self.assertEqual(await self.cache.get_balance(1234567890, "settler", "War Token"), 2)
+        self.assertEqual(await self.cache.get_member_balances(1234567890), {"settler": {"War Token": 2}})
+        self.assertEqual(await self.cache.get_token_balances("War Token"), {"settler": {1234567890: 2}})
+        self.assertEqual(self.store.load_calls, 1)
+
+    async def test_own_writes_are_applied_without_reload(self):
+        await self.cache.get_balance(1234567890, "settler", "War Token")
+        self.assertEqual(await self.cache.increment(1234567890, "settler", "War Token", 3), 5)
+        self.cache.check_interval = 0
+        self.assertEqual(await self.cache.get_balance(1234567890, "settler", "War Token"), 5)
+        self.assertEqual(self.store.load_calls, 1)
+        self.assertEqual(self.cache.version, 2)
+
+    async def test_overlapping_own_writes_are_applied_without_reload(self):
+        await self.cache.get_balance(1234567890, "settler", "War Token")
+        # The first write takes version 2 but finishes after the second one has written version 3
+        self.store.delays = [0.02, 0]
+        await asyncio.gather(
+            self.cache.increment(1234567890, "settler", "War Token", 1),
+            self.cache.increment(1234567891, "settler", "War Token", 4),
+        )
+        self.cache.check_interval = 0
+        self.assertEqual(await self.cache.get_token_balances("War Token"), {"settler": {1234567890: 3, 1234567891: 4}})
+        self.assertEqual(self.store.load_calls, 1)
+        self.assertEqual(self.cache.version, 3)
+
+    async def test_foreign_writes_invalidate(self):
+        await self.cache.get_balance(1234567890, "settler", "War Token")
+        other_process = FakeStore(self.database)
+        await other_process.increment(1234567890, "settler", "War Token", 1)
+        self.cache.check_interval = 0
+        self.assertEqual(await self.cache.get_balance(1234567890, "settler", "War Token"), 3)
+        self.assertEqual(self.store.load_calls, 2)
@@ -0,0 +1,178 @@
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from utils.bank_store import SQLiteBankStore
+from utils.db import SQLitePool
+from utils.migrations import MIGRATIONS, run_migrations
+
+
+class TestSQLiteBankStore(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = await SQLitePool(os.path.join(self.tmp.name, "bank.sqlite3"), 2).open()
+        await run_migrations(self.pool)
+        self.store = SQLiteBankStore(self.pool, guild_id=1)
+
+    async def asyncTearDown(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+        self.tmp.cleanup()
+
+    async def test_migrations_run_once(self):
+        self.assertEqual(await run_migrations(self.pool), 0)
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT `version` FROM `schema_migrations` ORDER BY `version`")
+                self.assertEqual([row[0] for row in await cur.fetchall()], [m.version for m in MIGRATIONS])
+
+    async def test_partly_applied_migration_reruns(self):
+        # As if migration 8 had added its columns and then failed before it was recorded
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM `schema_migrations` WHERE `version` = 8")
+        self.assertEqual(await run_migrations(self.pool), 1)
+
+    async def test_concurrent_runs_apply_each_migration_once(self):
+        other = await SQLitePool(os.path.join(self.tmp.name, "other.sqlite3"), 2).open()
+        self.addAsyncCleanup(other.wait_closed)
+        self.assertEqual(sorted(await asyncio.gather(run_migrations(other), run_migrations(other))), [0, len(MIGRATIONS)])
+
+    async def test_increment_respects_floor(self):
+        self.assertEqual(await self.store.increment(1234567890, "settler", "war", 3), 3)
+        self.assertEqual(await self.store.increment(1234567890, "settler", "war", -5), 0)
+        self.assertEqual(await self.store.increment(1234567890, "settler", "war", 2), 2)
+        self.assertEqual(await self.store.get_balance(1234567890, "settler", "war"), 2)
+        self.assertEqual(await self.store.get_version(), 3)
+        self.assertEqual(self.store.version, 3)
+
+    async def test_floored_increment_journals_the_applied_change(self):
+        await self.store.increment(1, "settler", "war", 3)
+        await self.store.increment(1, "settler", "war", -5)
+        await self.store.increment(1, "settler", "war", -1)
+        self.assertEqual([(entry["delta"], entry["balance"]) for entry in await self.store.get_journal(1)], [(-3, 0), (3, 3)])
+        future = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        self.assertIsNotNone(await self.store.compact_journal(future))
+        await self.store.increment(1, "settler", "war", -4)
+        await self.store.increment(1, "settler", "war", 2)
+        self.assertEqual(await self.store.rebuild_balances(), 1)
+        self.assertEqual(await self.store.get_balance(1, "settler", "war"), 2)
+
+    async def test_concurrent_increments_are_not_lost(self):
+        await asyncio.gather(*[self.store.increment(member_id % 3, "settler", "war", 1) for member_id in range(30)])
+        self.assertEqual(await self.store.get_totals("settler", [0, 1, 2]), {"war": 30})
+
+    async def test_journal_records_every_change(self):
+        await self.store.increment_many([(1, "settler", "war", 5), (1, "settler", "siege", 2), (2, "mercenary", "war", 1)])
+        await self.store.increment(1, "settler", "war", 2, source="event", source_id="42")
+        self.assertEqual(await self.store.load_bank(), {"settler": {"1": {"war": 7, "siege": 2}}, "mercenary": {"2": {"war": 1}}})
+        journal = await self.store.get_journal(1)
+        self.assertEqual(sorted((entry["token_type"], entry["delta"], entry["balance"], entry["source"]) for entry in journal),
+                         [("siege", 2, 2, "increment"), ("war", 2, 7, "event"), ("war", 5, 5, "increment")])
+        self.assertEqual(journal[0]["source"], "event")
+        self.assertIsInstance(journal[0]["created_at"], datetime.datetime)
+
+    async def test_delete_member(self):
+        await self.store.increment_many([(1, "settler", "war", 5), (1, "consul", "siege", 1), (2, "settler", "war", 1)])
+        await self.store.delete_member(1)
+        self.assertEqual(await self.store.get_member_balances(1), {})
+        self.assertEqual(await self.store.get_token_balances("war"), {"settler": {2: 1}})
+        deletions = [entry for entry in await self.store.get_journal(1) if entry["source"] == "delete_member"]
+        self.assertEqual(sorted((entry["company"], entry["delta"], entry["balance"]) for entry in deletions),
+                         [("consul", -1, 0), ("settler", -5, 0)])
+
+    async def test_compaction_and_rebuild(self):
+        await self.store.increment(1, "settler", "war", 5)
+        self.assertIsNotNone(await self.store.take_snapshot())
+        self.assertIsNone(await self.store.take_snapshot())
+        await self.store.increment(1, "settler", "war", 2)
+        await self.store.increment(2, "settler", "siege", 1)
+        future = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        self.assertIsNotNone(await self.store.compact_journal(future))
+        self.assertEqual(await self.store.get_journal(1), [])
+        await self.store.increment(1, "settler", "war", 1)
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM `token_balances`")
+        self.assertEqual(await self.store.rebuild_balances(), 2)
+        self.assertEqual(await self.store.load_bank(), {"settler": {"1": {"war": 8}, "2": {"siege": 1}}})
+
+    async def test_import_legacy_bank(self):
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("INSERT INTO `bank_data` (`key`, `data`) VALUES ('bank', %s)",
+                                  (json.dumps({"settler": {"1": {"war": 4}}}),))
+        self.assertEqual(await self.store.import_legacy_bank(), 1)
+        self.assertEqual(await self.store.import_legacy_bank(), 0)
+        self.assertEqual(await self.store.get_member_balances(1), {"settler": {"war": 4}})
+
+    async def test_increment_many_in_one_transaction(self):
+        await self.store.increment(1, "settler", "War Token", 4)
+        changes = await self.store.increment_many(
+            [(1, "settler", "War Token", 1), (2, "settler", "War Token", 1), (1, "settler", "War Token", 1), (3, "consul", "War Token", -2)],
+            source="event", source_id="42",
+        )
+        self.assertEqual(changes, {
+            ("settler", 1, "War Token"): (4, 6),
+            ("settler", 2, "War Token"): (0, 1),
+            ("consul", 3, "War Token"): (0, 0),
+        })
+        self.assertEqual(await self.store.get_version(), 2)
+        self.assertEqual(await self.store.get_token_balances("War Token"), {"settler": {1: 6, 2: 1}})
+        journal = await self.store.get_journal(1)
+        self.assertEqual((journal[0]["delta"], journal[0]["balance"], journal[0]["source"], journal[0]["source_id"]), (2, 6, "event", "42"))
+        self.assertEqual(await self.store.get_journal(3), [])
+
+    async def test_pending_tokens_are_approved_in_one_transaction(self):
+        await self.store.increment(1, "settler", "War Token", 2)
+        self.assertEqual(await self.store.add_pending_tokens([(1, "settler", "War Token"), (2, "settler", "War Token")], 10), 2)
+        await self.store.add_pending_tokens([(1, "settler", "War Token")], 20)
+        self.assertEqual([row["event_id"] for row in await self.store.get_pending_tokens([1])], [10, 20])
+        self.assertEqual(await self.store.get_version(), 1)  # Queuing doesn't touch balances
+
+        changes = await self.store.approve_pending_tokens(event_id=10, approved_by="99")
+        self.assertEqual(changes, {("settler", 1, "War Token"): (2, 3), ("settler", 2, "War Token"): (0, 1)})
+        self.assertEqual(await self.store.get_pending_tokens(event_id=10), [])
+        self.assertEqual(await self.store.approve_pending_tokens(event_id=10), {})
+        self.assertEqual(await self.store.approve_pending_tokens(member_ids=[1]), {("settler", 1, "War Token"): (3, 4)})
+        self.assertEqual((await self.store.get_journal(1))[0]["source"], "vod_review")
+
+    async def test_payout_run_is_frozen_once_and_resets_paid_tokens(self):
+        await self.store.increment(1, "settler", "War Token", 5)
+        await self.store.increment(2, "officer", "War Token", 1)
+        lines = [(1, "War Token", 5, 500), (2, "War Token", 1, 100)]
+        resets = {("settler", 1, "War Token"): 5, ("officer", 2, "War Token"): 1}
+        await self.store.increment(2, "officer", "War Token", 2)  # Earned after the payout was computed
+        week = datetime.date(2026, 10, 12)
+        run_id, created = await self.store.create_payout_run("week-1", week, 1000, 600, lines, resets, "42")
+        self.assertTrue(created)
+        self.assertEqual(await self.store.create_payout_run("week-1", week, 1000, 600, lines, resets), (run_id, False))
+        self.assertEqual(await self.store.get_member_balances(1), {"settler": {"War Token": 0}})
+        self.assertEqual(await self.store.get_member_balances(2), {"officer": {"War Token": 2}})
+
+        await self.store.set_payout_delivery(run_id, 1, "sent")
+        run = await self.store.get_payout_run("week-1")
+        self.assertEqual(run["members"], {
+            1: {"status": "sent", "tokens": {"War Token": 5}, "amounts": {"War Token": 500}},
+            2: {"status": "pending", "tokens": {"War Token": 1}, "amounts": {"War Token": 100}},
+        })
+        self.assertEqual(await self.store.get_incomplete_payout_runs(), ["week-1"])
+        await self.store.complete_payout_run(run_id)
+        self.assertEqual(await self.store.get_incomplete_payout_runs(), [])
+        self.assertIsNone(await self.store.get_payout_run("week-2"))
+
+    async def test_payout_history_and_export_pages(self):
+        for day, amount in ((5, 100), (12, 200), (19, 300)):
+            week = datetime.date(2026, 10, day)
+            await self.store.create_payout_run(f"{week}", week, 1000, 600, [(1, "War Token", 1, amount), (2, "War Token", 1, 7)], {})
+        history = await self.store.get_payout_history(1, datetime.date(2026, 10, 12), datetime.date(2026, 10, 26))
+        self.assertEqual([(row["week"], row["amount"]) for row in history],
+                         [(datetime.date(2026, 10, 19), 300), (datetime.date(2026, 10, 12), 200)])
+        week = datetime.date(2026, 10, 12)
+        first = await self.store.get_payout_lines(week, limit=1)
+        second = await self.store.get_payout_lines(week, (first[-1]["member_id"], first[-1]["token_type"]), limit=1)
+        self.assertEqual([row["member_id"] for row in first + second], [1, 2])
+        self.assertEqual(await self.store.get_payout_lines(week, (2, "War Token")), [])
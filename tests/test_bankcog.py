@@ -1,11 +1,20 @@
 import asyncio
+import datetime
+import os
 import pytest
+import tempfile
 import unittest
 from unittest.mock import AsyncMock, MagicMock, patch
 import discord
 from discord.ext import commands
 import pytest
-from cogs.bank_cog import BankCog
+from cogs.bank_cog import BankCog, simulate_weekly_payout
+from utils.bank_cache import BankCache
+from utils.bank_store import SQLiteBankStore
+from utils.db import SQLitePool
+from utils.migrations import run_migrations
+from utils.payout import PayoutPreviews, to_gold
+from utils.role_index import RoleIndex
 from utils.bank_util import switch_token_emoji
 # Set up an emoji cache for testing purposes
 emoji_cache = {}
@@ -39,6 +48,7 @@ class TestBankCog(unittest.IsolatedAsyncioTestCase):  # Use IsolatedAsyncioTestC
         self.bot = commands.Bot(command_prefix="/", intents=intents)
         self.pool = AsyncMock()  # Mocking the connection pool
         self.cog = BankCog(self.bot, self.pool)
+        self.store = AsyncMock()  # Mocking the bank store
         self.ctx = AsyncMock(spec=commands.Context)
         self.ctx.guild = AsyncMock(spec=discord.Guild)
         self.ctx.author.guild_permissions.administrator = True
@@ -46,11 +56,16 @@ class TestBankCog(unittest.IsolatedAsyncioTestCase):  # Use IsolatedAsyncioTestC
         self.user.id = 1234567890
         self.user.display_name = "TestUser"
         self.ctx.guild.member = [self.user]
+        role_index_patcher = patch('cogs.bank_cog.role_index', RoleIndex())  # Every test builds its own role index
+        role_index_patcher.start()
+        self.addCleanup(role_index_patcher.stop)
+        previews_patcher = patch('cogs.bank_cog.payout_previews', PayoutPreviews())
+        previews_patcher.start()
+        self.addCleanup(previews_patcher.stop)
 
 
-    @patch ('cogs.bank_cog.openbank', new_callable=AsyncMock)
-    async def test_ledger_no_tokens(self, mock_openbank):
-        mock_openbank.return_value = {}  # Mock empty bank data
+    async def test_ledger_no_tokens(self):
+        self.store.get_token_balances.return_value = {}  # Mock empty bank data
         self.ctx.send = AsyncMock()
         # Run the ledger command
         await self.cog.ledger(self, self.ctx, 'Event Token')
@@ -63,8 +78,7 @@ class TestBankCog(unittest.IsolatedAsyncioTestCase):  # Use IsolatedAsyncioTestC
         assert len(sent_embed.fields) == 0  # Ensure no fields in the embed since it's an empty response
 
 
-    @patch ('cogs.bank_cog.openbank', new_callable=AsyncMock)
-    async def test_ledger_with_tokens(self, mock_openbank):
+    async def test_ledger_with_tokens(self):
         testOfficer = AsyncMock(spec=discord.Member)
         testOfficer.display_name = "TestOfficer"
         testOfficer.id = 1234567891
@@ -77,19 +91,12 @@ class TestBankCog(unittest.IsolatedAsyncioTestCase):  # Use IsolatedAsyncioTestC
             testUser.id: testUser
         }
         self.ctx.guild.fetch_member = AsyncMock(side_effect=lambda member_id: member_dict.get(int(member_id)))
-        mock_openbank.return_value = {
+        self.store.get_token_balances.return_value = {
             'settler': {
-                str(self.user.id): {
-                    'Event Token': 10
-                },
-                str(testUser.id): {
-                    'Event Token': 5
-                }
+                testUser.id: 5
             },
             'officer': {
-                str(testOfficer.id): {
-                    'Event Token': 5
-                }
+                testOfficer.id: 5
             }
         }
         await self.cog.ledger(self, self.ctx, 'Event Token')
@@ -102,17 +109,34 @@ class TestBankCog(unittest.IsolatedAsyncioTestCase):  # Use IsolatedAsyncioTestC
 
 
 
-    @patch ('cogs.bank_cog.openbank', new_callable=AsyncMock)
-    async def test_payout_no_tokens(self, mock_openbank):
-        mock_openbank.return_value = {}  # Mock empty bank data
+    async def test_approvetokens(self):
+        self.store.approve_pending_tokens.return_value = {("settler", 1234567890, "War Token"): (2, 3)}
+        await self.cog.approvetokens(self, self.ctx, members="<@1234567890> <@!1234567891>", event_id="1200000000000000000")
+        self.store.approve_pending_tokens.assert_awaited_once_with([1234567890, 1234567891], 1200000000000000000, str(self.ctx.author.id))
+        sent_embed = self.ctx.send.call_args[1]['embed']
+        self.assertIn("<@1234567890>: War Token 2 -> 3", sent_embed.description)
+
+    async def test_approvetokens_rejects_anything_but_members(self):
+        for members in ("<@&1040383506481692693>", "<#1040383506481692693> <@1234567890>", "1234 5678", "<@1234567890>x"):
+            self.ctx.send.reset_mock()
+            await self.cog.approvetokens(self, self.ctx, members=members)
+            self.assertIn("is not a member mention or id", self.ctx.send.call_args[0][0])
+        self.store.approve_pending_tokens.assert_not_awaited()
+        self.store.approve_pending_tokens.return_value = {}
+        await self.cog.approvetokens(self, self.ctx, members="<@1234567890><@!1234567891>, 1234567892345678")
+        self.store.approve_pending_tokens.assert_awaited_once_with([1234567890, 1234567891, 1234567892345678], None, str(self.ctx.author.id))
+
+
+    async def test_payout_no_tokens(self):
+        self.store.load_versioned_bank.return_value = (1, {})  # Mock empty bank data
+        self.store.get_payout_run.return_value = None
         self.ctx.send = AsyncMock()
         await self.cog.payout(self, self.ctx, income=1000.0)
         self.ctx.send.assert_called_with("No tokens have been earned this week. No payout necessary.")
 
 
     @patch ('os.makedirs')
-    @patch ('cogs.bank_cog.openbank', new_callable=AsyncMock)
-    async def test_payout_with_tokens(self, mock_openbank, mock_makedirs):
+    async def test_payout_with_tokens(self, mock_makedirs):
         # Mock roles
         settler_role = AsyncMock()
         settler_role.id = 1040383506481692693
@@ -126,12 +150,13 @@ class TestBankCog(unittest.IsolatedAsyncioTestCase):  # Use IsolatedAsyncioTestC
         # Mock context
         self.ctx.author.guild_permissions.administrator = True
         self.ctx.guild.members = [testUser]
+        self.ctx.guild.get_role = MagicMock(side_effect=lambda role_id: MagicMock(members=[testUser]) if role_id == settler_role.id else None)
         # Mock fetch_member to return TestUser based on id
         self.ctx.guild.fetch_member = AsyncMock(side_effect=lambda member_id: testUser if member_id == testUser.id else None)
         # Mock get_member to return TestUser based on id
-        self.ctx.guild.get_member = AsyncMock(side_effect=lambda member_id: testUser if member_id == testUser.id else None)
-        # Mock openbank to return a dictionary when awaited
-        mock_openbank.return_value = {
+        self.ctx.guild.get_member = MagicMock(side_effect=lambda member_id: testUser if member_id == testUser.id else None)
+        # Mock the bank and its version
+        self.store.load_versioned_bank.return_value = (1, {
             'settler': {
                 str(testUser.id): {
                     'Event Token': 10,
@@ -140,32 +165,142 @@ class TestBankCog(unittest.IsolatedAsyncioTestCase):  # Use IsolatedAsyncioTestC
                     'Competitive Token': 2
                 }
             }
-        }
-        with patch('cogs.bank_cog.savebank', new_callable=AsyncMock) as mock_savebank:
-            await self.cog.payout(self, ctx=self.ctx, income=1000.0)
+        })
+        run = {"run_id": 7, "payout_key": "10/12/2026", "completed_at": None, "members": {
+            testUser.id: {"status": "pending", "tokens": {}, "amounts": {"War Token": 30000, "Leadership Token": 20000, "Competitive Token": 10000}},
+        }}
+        self.store.get_payout_run.side_effect = [None, run]
+        await self.cog.payout(self, ctx=self.ctx, income=1000.0)
     # Assertions
-        mock_savebank.assert_called_once_with(mock_openbank.return_value, self.pool)
+        self.store.create_payout_run.assert_awaited_once_with(
+            unittest.mock.ANY, unittest.mock.ANY, 100000, 60000,
+            [(testUser.id, 'War Token', 5, 30000), (testUser.id, 'Leadership Token', 3, 20000), (testUser.id, 'Competitive Token', 2, 10000)],
+            {('settler', testUser.id, 'War Token'): 5, ('settler', testUser.id, 'Leadership Token'): 3, ('settler', testUser.id, 'Competitive Token'): 2},
+            str(self.ctx.author.id),
+        )
+        self.store.set_payout_delivery.assert_awaited_once_with(7, testUser.id, "sent")
+        self.store.complete_payout_run.assert_awaited_once_with(7)
         mock_makedirs.assert_called_once_with(
             'C:\\Users\\larry\\Desktop\\python update event bot\\weekly_payouts', exist_ok=True
         )
 
 
-    @patch('cogs.bank_cog.openbank', new_callable=AsyncMock)
-    async def test_balance(self, mock_openbank):
+    @patch ('cogs.bank_cog.create_payout_file')
+    async def test_payout_dry_run_is_cached_and_side_effect_free(self, mock_create_payout_file):
+        self.store.load_versioned_bank.return_value = (5, {'settler': {'1': {'War Token': 1}, '2': {'War Token': 3}}})
+        self.ctx.guild.get_role = MagicMock(side_effect=lambda role_id: MagicMock(members=[MagicMock(id=1), MagicMock(id=2)]) if role_id == 1040383506481692693 else None)
+        self.ctx.guild.get_member = MagicMock(return_value=None)
+        self.store.get_version.return_value = 5
+        await self.cog.payout(self, ctx=self.ctx, income=1000.0, dry_run=True)
+        await self.cog.payout(self, ctx=self.ctx, income=1000.0, dry_run=True)
+        self.store.load_versioned_bank.assert_awaited_once()  # The second preview is served from the cache
+        first, second = [call[1]['embed'] for call in self.ctx.send.call_args_list]
+        self.assertIn("600.00 gold to 2 member(s)", first.description)
+        self.assertIn("(cached)", second.description)
+        self.assertEqual(first.fields[-1].value, "2: 450.00 gold\n1: 150.00 gold")
+        self.store.get_payout_run.assert_not_awaited()
+        self.store.create_payout_run.assert_not_awaited()
+        mock_create_payout_file.assert_not_called()
+
+        # A bank write invalidates the preview, and the real payout reuses the fresh one
+        self.store.get_version.return_value = 6
+        self.store.load_versioned_bank.return_value = (6, {'settler': {'1': {'War Token': 1}, '2': {'War Token': 3}}})
+        self.store.get_payout_run.side_effect = [None, None]
+        await self.cog.payout(self, ctx=self.ctx, income=1000.0, dry_run=True)
+        await self.cog.payout(self, ctx=self.ctx, income=1000.0)
+        self.assertEqual(self.store.load_versioned_bank.await_count, 2)
+        self.store.create_payout_run.assert_awaited_once()
+
+
+    async def test_payout_preview_reflects_writes_between_previews(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = await SQLitePool(os.path.join(tmp, "bank.sqlite3"), 2).open()
+            self.addAsyncCleanup(pool.wait_closed)
+            self.addCleanup(pool.close)
+            await run_migrations(pool)
+            cache = BankCache(SQLiteBankStore(pool, guild_id=1), check_interval=60)
+            other_process = SQLiteBankStore(pool, guild_id=1)
+            guild = MagicMock(id=1)
+            guild.get_role = MagicMock(side_effect=lambda role_id: MagicMock(members=[MagicMock(id=1), MagicMock(id=2)]) if role_id == 1040383506481692693 else None)
+            await cache.increment(1, 'settler', 'War Token', 1)
+            first, _ = await simulate_weekly_payout(guild, cache, 1000.0)
+            self.assertEqual(dict(zip(first.plan.member_ids.tolist(), first.plan.totals.tolist())), {1: 60000, 2: 0})
+            # Written by another process while the cache's copy is still within its check interval
+            await other_process.increment(2, 'settler', 'War Token', 3)
+            second, cached = await simulate_weekly_payout(guild, cache, 1000.0)
+            self.assertFalse(cached)
+            self.assertEqual(dict(zip(second.plan.member_ids.tolist(), second.plan.totals.tolist())), {1: 15000, 2: 45000})
+            # Written through the cache
+            await cache.increment(1, 'settler', 'War Token', 2)
+            third, cached = await simulate_weekly_payout(guild, cache, 1000.0)
+            self.assertFalse(cached)
+            self.assertEqual(dict(zip(third.plan.member_ids.tolist(), third.plan.totals.tolist())), {1: 30000, 2: 30000})
+            self.assertEqual(await simulate_weekly_payout(guild, cache, 1000.0), (third, True))
+
+
+    @patch ('cogs.bank_cog.create_payout_file')
+    async def test_payout_resume_skips_paid_members(self, mock_create_payout_file):
+        paid, unpaid = AsyncMock(spec=discord.Member), AsyncMock(spec=discord.Member)
+        paid.display_name, unpaid.display_name = "Paid", "Unpaid"
+        self.ctx.guild.get_member = MagicMock(side_effect={1: paid, 2: unpaid}.get)
+        amounts = {"War Token": 150, "Leadership Token": 0, "Competitive Token": 0}
+        run = {"run_id": 7, "payout_key": "10/12/2026", "completed_at": None, "members": {
+            1: {"status": "sent", "tokens": {}, "amounts": amounts},
+            2: {"status": "pending", "tokens": {}, "amounts": amounts},
+        }}
+        self.store.get_payout_run.return_value = run
+        await self.cog.payout(self, ctx=self.ctx, income=1000.0)
+        self.store.create_payout_run.assert_not_awaited()
+        paid.send.assert_not_awaited()
+        self.assertIn("1.50 gold", str(unpaid.send.call_args[1]['embed'].fields))
+        self.store.set_payout_delivery.assert_awaited_once_with(7, 2, "sent")
+        self.store.complete_payout_run.assert_awaited_once_with(7)
+        self.assertEqual(mock_create_payout_file.call_args[0][1], {"Paid": to_gold(150), "Unpaid": to_gold(150)})
+
+
+    async def test_payouthistory(self):
+        self.ctx.author = self.user
+        self.store.get_payout_history.return_value = [
+            {"week": datetime.date(2026, 10, 12), "token_type": "Leadership Token", "tokens": 1, "amount": 250},
+            {"week": datetime.date(2026, 10, 12), "token_type": "War Token", "tokens": 2, "amount": 1000},
+            {"week": datetime.date(2026, 10, 5), "token_type": "War Token", "tokens": 1, "amount": 500},
+        ]
+        await self.cog.payouthistory(self, self.ctx, weeks=4)
+        member_id, since, before = self.store.get_payout_history.call_args[0]
+        self.assertEqual((member_id, (before - since).days, before.weekday()), (self.user.id, 28, 0))
+        sent_embed = self.ctx.send.call_args[1]['embed']
+        self.assertEqual([field.name for field in sent_embed.fields], ["Week of 10/12/2026: 12.50 gold", "Week of 10/05/2026: 5.00 gold"])
+        self.assertIn("War Token: 2 token(s), 10.00 gold", sent_embed.fields[0].value)
+
+
+    async def test_payoutexport_pages_through_the_week(self):
+        self.ctx.guild.get_member = MagicMock(return_value=None)
+        with patch('cogs.bank_cog.payout_export_page_size', 2):
+            self.store.get_payout_lines.side_effect = [
+                [{"member_id": 1, "token_type": "War Token", "tokens": 2, "amount": 1000}, {"member_id": 2, "token_type": "War Token", "tokens": 1, "amount": 500}],
+                [{"member_id": 3, "token_type": "War Token", "tokens": 1, "amount": 500}],
+            ]
+            await self.cog.payoutexport(self, self.ctx, week="10/14/2026")
+        self.assertEqual(self.store.get_payout_lines.call_args_list[1][0], (datetime.date(2026, 10, 12), (2, "War Token"), 2))
+        sent_file = self.ctx.send.call_args[1]['file']
+        self.assertEqual(sent_file.filename, "payout_2026-10-12.csv")
+        self.assertEqual(sent_file.fp.read().decode().splitlines()[-1], "2026-10-12,3,,War Token,1,5.00")
+
+
+    async def test_balance(self):
         # Set up mock data
-        mock_openbank.return_value = {
+        self.store.get_member_balances.return_value = {
             'settler': {
-                str(self.user.id): {
-                    'Event Token': 10,
-                    'Leadership Token': 5,
-                    'Competitive Token': 3,
-                    'War Token': 1
-                }
+                'Event Token': 10,
+                'Leadership Token': 5,
+                'Competitive Token': 3,
+                'War Token': 1
             }
         }
         await self.cog.balance(self, self.ctx, target=self.user)
         # Check if the balance command returns the correct balance
         self.ctx.send.assert_called_once()
+        self.store.get_member_balances.assert_called_once_with(self.user.id)
         sent_embed = self.ctx.send.call_args[1]['embed']
         self.assertEqual(sent_embed.title, f"{self.user.display_name}'s current balances")
         # Include the emoji in the expected field name
@@ -174,24 +309,28 @@ class TestBankCog(unittest.IsolatedAsyncioTestCase):  # Use IsolatedAsyncioTestC
         self.assertEqual(sent_embed.fields[0].name, expected_field_name)
 
 
-    @patch('cogs.bank_cog.openbank', new_callable=AsyncMock)
-    @patch('cogs.bank_cog.savebank', new_callable=AsyncMock)
-    async def test_removetokens(self, mock_savebank, mock_openbank):
-        # Initialize bank data
-        bank_data = {
+    async def test_removetokens(self):
+        # Initialize the member's bank rows
+        self.store.get_member_balances.return_value = {
             'settler': {
-                str(self.user.id): {
-                    'Event Token': 10
-                }
+                'Event Token': 10
             }
         }
-        # Set up mock_openbank to return the mutable bank_data dictionary
-        mock_openbank.return_value = bank_data
         await self.cog.removetokens(self, self.ctx, self.user, 'Event Token', 5)
-        # Verify the changes in the bank data
-        self.assertEqual(bank_data['settler'][str(self.user.id)]['Event Token'], 5)
-        # Ensure that savebank was called to persist the changes
-        mock_savebank.assert_called_once_with(bank_data, self.pool)
+        # Ensure the removal was applied as a single atomic decrement
+        self.store.increment.assert_called_once_with(self.user.id, 'settler', 'Event Token', -5, source="removetokens", source_id=str(self.ctx.author.id))
+
+
+    async def test_removetokens_resolves_aliases_and_rejects_unknown_types(self):
+        settler_role = MagicMock()
+        settler_role.id = 1040383506481692693
+        self.user.roles = [settler_role]
+        self.store.get_member_balances.return_value = {'settler': {'War Token': 3}}
+        await self.cog.removetokens(self, self.ctx, self.user, ' war TOKENS ', 1)
+        self.store.increment.assert_called_once_with(self.user.id, 'settler', 'War Token', -1, source="removetokens", source_id=str(self.ctx.author.id))
+        await self.cog.removetokens(self, self.ctx, self.user, 'Gold Token', 1)
+        self.assertIn("Gold Token is not a recognized token type", self.ctx.send.call_args[0][0])
+        self.store.increment.assert_called_once()
 
 
 if __name__ == "__main__":
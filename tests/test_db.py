@@ -0,0 +1,46 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from utils.db import InstrumentedPool, SQLitePool
+
+
+class TestInstrumentedPool(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = InstrumentedPool(await SQLitePool(os.path.join(self.tmp.name, "bank.sqlite3"), 2).open())
+
+    async def asyncTearDown(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+        self.tmp.cleanup()
+
+    async def test_acquire_metrics(self):
+        async def query():
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT 1")
+                    await asyncio.sleep(0.01)
+
+        # Three queries on two connections: the third has to wait
+        await asyncio.gather(query(), query(), query())
+        stats = self.pool.stats()
+        self.assertEqual(stats["acquisitions"], 3)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["max_in_use"], 2)
+        self.assertGreater(stats["max_wait"], 0)
+        self.assertEqual(stats["free"], 2)
+
+    async def test_health_check_pings_idle_connections(self):
+        self.assertEqual(await self.pool.warm_up(5), 2)
+        self.assertEqual(await self.pool.check_health(), 0)
+        self.assertEqual(self.pool.stats()["errors"], 0)
+        self.assertEqual(self.pool.dialect, "sqlite")
+
+    async def test_watched_stats_are_logged_with_the_pool(self):
+        self.pool.watch("Bank lock", lambda: {"max_wait": 0.5})
+        with self.assertLogs(level="INFO") as logs:
+            self.pool.log_stats()
+        self.assertIn("Database pool stats", logs.output[0])
+        self.assertIn("Bank lock stats: {'max_wait': 0.5}", logs.output[1])
@@ -0,0 +1,51 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+import discord
+from utils.dm_dispatcher import BLOCKED, FAILED, SENT, DMDispatcher
+
+
+class FakeMember:
+    active = 0
+    max_active = 0
+
+    def __init__(self, member_id, errors=()):
+        self.id = member_id
+        self.display_name = f"member {member_id}"
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send(self, **kwargs):
+        FakeMember.active += 1
+        FakeMember.max_active = max(FakeMember.max_active, FakeMember.active)
+        await asyncio.sleep(0.01)
+        FakeMember.active -= 1
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(kwargs)
+
+
+def http_error(error_class, status):
+    return error_class(MagicMock(status=status), "error")
+
+
+class TestDMDispatcher(unittest.IsolatedAsyncioTestCase):
+
+    async def test_statuses_and_bounded_concurrency(self):
+        dispatcher = DMDispatcher(concurrency=2, retries=1)
+        members = [
+            FakeMember(1),
+            FakeMember(2, [http_error(discord.Forbidden, 403)]),
+            FakeMember(3, [http_error(discord.HTTPException, 500)]),
+            FakeMember(4, [http_error(discord.HTTPException, 400)]),
+        ]
+
+        with self.assertLogs(level="WARNING") as logs:
+            statuses = await dispatcher.dispatch("war", [(member, lambda: {"content": "token"}) for member in members])
+        self.assertEqual(statuses, {1: SENT, 2: BLOCKED, 3: SENT, 4: FAILED})
+        self.assertEqual(members[2].sent, [{"content": "token"}])  # Retried after the server error
+        self.assertEqual(FakeMember.max_active, 2)
+        self.assertEqual(dispatcher._tasks, set())
+        # The members to retry are logged by id
+        self.assertIn("DMs for war failed: 4", "\n".join(logs.output))
+        self.assertIn("DMs for war blocked: 2", "\n".join(logs.output))
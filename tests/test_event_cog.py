@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from cogs.event_cog import EventCog
+from views.views import Event
+
+
+def make_channel(channel_id):
+    channel = MagicMock()
+    channel.id = channel_id
+    channel.members = []
+    return channel
+
+
+def make_scheduled_event(event_id, channel, status):
+    scheduled_event = MagicMock()
+    scheduled_event.id = event_id
+    scheduled_event.channel = channel
+    scheduled_event.status = status
+    return scheduled_event
+
+
+class TestEventCog(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.bot = MagicMock()
+        self.cog = EventCog(self.bot, MagicMock())
+        self.cog.attendance = MagicMock(start_event=AsyncMock(), end_event=AsyncMock(), flush=AsyncMock())
+        self.war_channel = make_channel(1)
+        self.pve_channel = make_channel(2)
+
+    async def start(self, event_id, channel):
+        scheduled = make_scheduled_event(event_id, channel, "EventStatus.scheduled")
+        await self.cog.on_scheduled_event_update(scheduled, make_scheduled_event(event_id, channel, "EventStatus.active"))
+
+    async def test_overlapping_events_are_tracked_separately(self):
+        await self.start(10, self.war_channel)
+        await self.start(20, self.pve_channel)
+        member = MagicMock()
+        member.id = 1234567890
+        await self.cog.on_voice_state_update(member, MagicMock(channel=None), MagicMock(channel=self.war_channel))
+        self.assertEqual(self.cog.process_voice_updates(), 1)
+        self.assertIn(member.id, self.cog.events.get(10).participants)
+        self.assertNotIn(member.id, self.cog.events.get(20).participants)
+
+        # Moving channels leaves the war and joins the PvE run
+        await self.cog.on_voice_state_update(member, MagicMock(channel=self.war_channel), MagicMock(channel=self.pve_channel))
+        self.assertEqual(self.cog.process_voice_updates(), 1)
+        self.assertIsNone(self.cog.events.get(10).participants[member.id].current_start_time)
+        self.assertIsNotNone(self.cog.events.get(20).participants[member.id].current_start_time)
+        self.assertEqual([call.args[::2] for call in self.cog.attendance.record.call_args_list],
+                         [(10, "join"), (10, "leave"), (20, "join")])
+
+    async def test_voice_updates_are_timed_on_the_monotonic_clock(self):
+        await self.start(10, self.war_channel)
+        member = MagicMock()
+        member.id = 1234567890
+        with patch("cogs.event_cog.time.monotonic", return_value=1000.0):
+            await self.cog.on_voice_state_update(member, MagicMock(channel=None), MagicMock(channel=self.war_channel))
+        # Durations come from the monotonic readings the updates carry, so wall-clock steps can't skew them
+        with patch("cogs.event_cog.time.monotonic", return_value=1600.0):
+            await self.cog.on_voice_state_update(member, MagicMock(channel=self.war_channel), MagicMock(channel=None))
+        self.assertEqual(self.cog.process_voice_updates(), 2)
+        self.assertEqual(self.cog.events.get(10).participants[member.id].get_total_time_spent(), datetime.timedelta(minutes=10))
+
+    async def test_voice_updates_outside_events_are_dropped(self):
+        await self.start(10, self.war_channel)
+        member = MagicMock()
+        member.id = 1234567890
+        await self.cog.on_voice_state_update(member, MagicMock(channel=None), MagicMock(channel=make_channel(99)))
+        self.assertTrue(self.cog.voice_updates.empty())
+
+    async def test_full_queue_applies_inline(self):
+        await self.start(10, self.war_channel)
+        self.cog.voice_updates = asyncio.Queue(maxsize=1)
+        for member_id in (1, 2):
+            member = MagicMock()
+            member.id = member_id
+            await self.cog.on_voice_state_update(member, MagicMock(channel=None), MagicMock(channel=self.war_channel))
+        self.assertEqual(sorted(self.cog.events.get(10).participants), [1, 2])
+        self.assertTrue(self.cog.voice_updates.empty())
+
+    async def test_full_queue_keeps_updates_in_order(self):
+        await self.start(10, self.war_channel)
+        member = MagicMock()
+        member.id = 1234567890
+        await self.cog.on_voice_state_update(member, MagicMock(channel=None), MagicMock(channel=self.war_channel))
+        self.cog.process_voice_updates()
+        self.cog.voice_updates = asyncio.Queue(maxsize=1)
+        # The leave is still queued when the queue overflows with the member's rejoin
+        await self.cog.on_voice_state_update(member, MagicMock(channel=self.war_channel), MagicMock(channel=None))
+        await self.cog.on_voice_state_update(member, MagicMock(channel=None), MagicMock(channel=self.war_channel))
+        self.cog.process_voice_updates()
+        event = self.cog.events.get(10)
+        self.assertIn(member.id, event.present)
+        self.assertIsNotNone(event.participants[member.id].current_start_time)
+
+    async def test_completed_event_is_finalized_and_removed(self):
+        await self.start(10, self.war_channel)
+        await self.start(20, self.pve_channel)
+        event = self.cog.events.get(10)
+        event.finalize = AsyncMock()
+        ended = make_scheduled_event(10, self.war_channel, "EventStatus.completed")
+        await self.cog.on_scheduled_event_update(make_scheduled_event(10, self.war_channel, "EventStatus.active"), ended)
+        event.finalize.assert_awaited_once()
+        self.assertNotIn(10, self.cog.events)
+        self.assertEqual(self.cog.events.in_channel(self.war_channel.id), [])
+        self.assertIsInstance(self.cog.events.get(20), Event)
+
+    async def test_reconcile_fixes_missed_voice_updates(self):
+        await self.start(10, self.war_channel)
+        event = self.cog.events.get(10)
+        stayed, missed_join, missed_leave = MagicMock(id=1), MagicMock(id=2), MagicMock(id=3)
+        event.member_joined(stayed.id)
+        event.member_joined(missed_leave.id)
+        self.war_channel.members = [stayed, missed_join]
+        await self.cog.reconcile_attendance()
+        self.assertEqual(event.present, {1, 2})
+        self.assertIsNone(event.participants[3].current_start_time)
+        self.assertEqual(event.corrections, 2)
+        self.assertEqual(event.reconcile(), 0)
@@ -0,0 +1,35 @@
+import csv
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from utils.event_report import EventReportWriter
+
+
+class TestEventReportWriter(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reports_are_written_in_every_format(self):
+        start = datetime.datetime(2024, 1, 1, 20, 0)
+        end = start + datetime.timedelta(minutes=30)
+        event_data = {"Siege": {"event_duration": 1800.0, "members": {"1234567890": {
+            "start_balance": 2,
+            "join_time": start,
+            "Token Earned": "War Token",
+            "end_balance": 3,
+            "duration": datetime.timedelta(minutes=30),
+            "sessions": [(start, end)],
+        }}}}
+        with tempfile.TemporaryDirectory() as folder:
+            paths = await EventReportWriter(folder).write(42, event_data, {1234567890: "Larry"}, end)
+            self.assertEqual([os.path.basename(path) for path in paths],
+                             ["42_20240101T203000.jsonl", "42_20240101T203000.csv", "42_20240101T203000.txt"])
+            with open(paths[0]) as file:
+                row = json.loads(file.readline())
+            self.assertEqual(row["member_name"], "Larry")
+            self.assertEqual(row["duration_seconds"], 1800.0)
+            self.assertEqual(row["sessions"], [["2024-01-01T20:00:00", "2024-01-01T20:30:00"]])
+            with open(paths[1], newline="") as file:
+                self.assertEqual(next(csv.DictReader(file))["end_balance"], "3")
+            with open(paths[2]) as file:
+                self.assertIn("Member Nickname: Larry\n", file.read())
@@ -0,0 +1,42 @@
+import asyncio
+import unittest
+from utils.locks import StripedLock
+
+
+class TestStripedLock(unittest.IsolatedAsyncioTestCase):
+
+    async def test_same_key_is_serialized(self):
+        locks = StripedLock(stripes=8)
+        order = []
+
+        async def writer(name):
+            async with locks.hold([("settler", 1234567890)]):
+                order.append(f"{name} start")
+                await asyncio.sleep(0.01)
+                order.append(f"{name} end")
+
+        await asyncio.gather(writer("first"), writer("second"))
+        self.assertEqual(order, ["first start", "first end", "second start", "second end"])
+        stripe = locks.stripe(("settler", 1234567890))
+        stats = locks.stats()
+        self.assertEqual(list(stats), [stripe])
+        self.assertEqual(stats[stripe]["acquisitions"], 2)
+        self.assertGreater(stats[stripe]["max_wait"], 0)
+        summary = locks.summary()
+        self.assertEqual((summary["acquisitions"], summary["hottest_stripe"], summary["locked"]), (2, stripe, 0))
+        self.assertEqual(summary["max_wait"], stats[stripe]["max_wait"])
+
+    async def test_overlapping_key_sets_do_not_deadlock(self):
+        locks = StripedLock(stripes=4)
+        keys = [("settler", member_id) for member_id in range(20)]
+
+        async def writer(member_keys):
+            async with locks.hold(member_keys):
+                await asyncio.sleep(0)
+
+        async def resetter():
+            async with locks.hold_all():
+                await asyncio.sleep(0)
+
+        await asyncio.wait_for(asyncio.gather(writer(keys), resetter(), writer(list(reversed(keys)))), timeout=1)
+        self.assertFalse(any(stats["locked"] for stats in locks.stats().values()))
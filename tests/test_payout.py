@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+from utils.payout import PayoutPreviews, compute_payouts, largest_remainder, simulate_payout, to_gold, token_counts
+
+
+class TestPayout(unittest.TestCase):
+
+    def test_largest_remainder_pays_exactly_the_total(self):
+        self.assertEqual(largest_remainder(100, np.array([1, 1, 1])).tolist(), [34, 33, 33])
+        self.assertEqual(largest_remainder(10, np.array([0, 2, 3])).tolist(), [0, 4, 6])
+        with self.assertRaises(ValueError):
+            largest_remainder(10, np.array([0, 0]))
+
+    def test_token_counts_sum_over_company_roles(self):
+        bank = {
+            "settler": {"1": {"War Token": 5, "Event Token": 9}, "2": {"Competitive Token": 1}},
+            "officer": {"1": {"Leadership Token": 2}},
+        }
+        member_ids, tokens = token_counts(bank, {"settler": [1, 2, 3], "officer": [1]})
+        self.assertEqual(member_ids.tolist(), [1, 2, 3])
+        self.assertEqual(tokens.tolist(), [[5, 2, 0], [0, 0, 1], [0, 0, 0]])
+
+    def test_payout_splits_the_whole_pool(self):
+        plan = compute_payouts([1, 2, 3], [[1, 3, 2], [1, 0, 0], [1, 0, 1]], 1000.01)
+        self.assertEqual(plan.pool, 60001)
+        self.assertEqual(int(plan.amounts.sum()), plan.pool)
+        self.assertEqual(plan.breakdown, {"War Token": 30001, "Leadership Token": 20000, "Competitive Token": 10000})
+        self.assertEqual(plan.amounts[:, 0].tolist(), [10001, 10000, 10000])
+        self.assertEqual(to_gold(plan.totals[0]), to_gold(10001 + 20000 + 6667))
+
+    def test_unheld_token_types_share_nothing(self):
+        plan = compute_payouts([1, 2], [[4, 0, 0], [1, 0, 0]], 100)
+        self.assertEqual(plan.amounts.tolist(), [[4800, 0, 0], [1200, 0, 0]])
+        self.assertEqual(compute_payouts([1], [[0, 0, 0]], 100).pool, 0)
+
+
+    def test_simulation_and_preview_cache(self):
+        bank = {"settler": {"1": {"War Token": 2, "Event Token": 4}}, "officer": {"1": {"War Token": 1}}}
+        preview = simulate_payout(bank, {"settler": [1], "officer": [1, 2]}, 10)
+        self.assertEqual(preview.resets, {("settler", 1, "War Token"): 2, ("officer", 1, "War Token"): 1})
+        self.assertEqual(preview.plan.lines(), [(1, "War Token", 3, 600)])
+        self.assertEqual(bank["settler"]["1"]["War Token"], 2)
+
+        previews = PayoutPreviews(size=1)
+        previews.put(3, 10, {"settler": [1], "officer": [2, 1]}, preview)
+        self.assertIs(previews.get(3, 10.0, {"officer": [1, 2], "settler": [1]}), preview)
+        self.assertIsNone(previews.get(4, 10, {"settler": [1], "officer": [1, 2]}))
+        previews.put(4, 10, {}, preview)
+        self.assertIsNone(previews.get(3, 10, {"settler": [1], "officer": [1, 2]}))
@@ -0,0 +1,43 @@
+import unittest
+from unittest.mock import MagicMock
+from utils.role_index import RoleIndex
+
+
+def make_member(member_id, *role_ids, guild_id=1):
+    member = MagicMock()
+    member.id = member_id
+    member.guild.id = guild_id
+    member.roles = [MagicMock(id=role_id) for role_id in role_ids]
+    return member
+
+
+class TestRoleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.guild = MagicMock(id=1)
+        roles = {10: MagicMock(members=[make_member(1, 10), make_member(2, 10, 20)]), 20: MagicMock(members=[make_member(2, 10, 20)])}
+        self.guild.get_role = MagicMock(side_effect=roles.get)
+        self.index = RoleIndex()
+
+    def test_build_from_role_members(self):
+        self.assertEqual(self.index.build(self.guild, [10, 20, 30]), 3)
+        self.assertEqual(self.index.member_ids(10), {1, 2})
+        self.assertEqual(self.index.member_ids(30), set())
+
+    def test_member_events_keep_the_index_current(self):
+        self.index.build(self.guild, [10, 20])
+        self.index.update(make_member(1, 20))  # Moved from role 10 to 20
+        self.index.update(make_member(3, 10))  # Joined with role 10
+        self.index.update(make_member(4, 10, guild_id=2))  # Another guild
+        self.index.remove(2)
+        self.assertEqual(self.index.member_ids(10), {3})
+        self.assertEqual(self.index.member_ids(20), {1})
+
+    def test_ensure_builds_only_when_needed(self):
+        self.index.ensure(self.guild, [10])
+        self.index.remove(1)
+        self.index.ensure(self.guild, [10])
+        self.assertEqual(self.index.member_ids(10), {2})
+        self.index.ensure(self.guild, [10, 20])
+        self.assertEqual(self.index.member_ids(20), {2})
+        self.assertEqual(self.guild.get_role.call_count, 3)
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+import discord
+from utils.token_assets import TokenAssets
+
+
+class TestTokenAssets(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp.name, "War Token.png"), "wb") as file:
+            file.write(b"png")
+        self.assets = TokenAssets(self.tmp.name, refresh_hours=12)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_uploaded_url_is_reused(self):
+        channel = MagicMock()
+        channel.send = AsyncMock(return_value=MagicMock(attachments=[MagicMock(url="https://cdn.example/war.png")]))
+        self.assertEqual(await self.assets.upload(channel, ["War Token"]), 1)
+        kwargs = self.assets.embed(discord.Embed(), "War Token")
+        self.assertEqual(list(kwargs), ["embed"])
+        self.assertEqual(kwargs["embed"].image.url, "https://cdn.example/war.png")
+
+    async def test_falls_back_to_cached_bytes(self):
+        channel = MagicMock()
+        channel.send = AsyncMock(side_effect=discord.HTTPException(MagicMock(status=500), "error"))
+        self.assertEqual(await self.assets.upload(channel, ["War Token"]), 0)
+        os.remove(os.path.join(self.tmp.name, "War Token.png"))  # Served from memory from now on
+        kwargs = self.assets.embed(discord.Embed(), "War Token")
+        self.assertEqual(kwargs["embed"].image.url, "attachment://token.png")
+        self.assertEqual(kwargs["file"].fp.read(), b"png")
@@ -0,0 +1,31 @@
+import json
+import os
+import tempfile
+import unittest
+from utils.token_registry import TokenRegistry, TokenType
+
+
+class TestTokenRegistry(unittest.TestCase):
+
+    def test_resolve_names_ids_aliases_and_plurals(self):
+        registry = TokenRegistry()
+        self.assertEqual(registry.resolve("  WAR   token ").name, "War Token")
+        self.assertEqual(registry.resolve("lead").name, "Leadership Token")
+        self.assertEqual(registry.resolve("competitive tokens").name, "Competitive Token")
+        self.assertIsNone(registry.resolve("gold"))
+        self.assertEqual(registry.payout_names, ["War Token", "Leadership Token", "Competitive Token"])
+        self.assertEqual([token_type.name for token_type in registry.search("LEAD")], ["Leadership Token"])
+
+    def test_conflicting_aliases_are_rejected(self):
+        with self.assertRaises(ValueError):
+            TokenRegistry([TokenType("war", "War Token", ("pvp",)), TokenType("arena", "Arena Token", ("PvP",))])
+
+    def test_load_from_config_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "token_types.json")
+            with open(path, "w") as file:
+                json.dump([{"id": "raid", "name": "Raid Token", "aliases": ["raids"], "payout_weight": 4, "payout": True}], file)
+            registry = TokenRegistry.load(path)
+            self.assertEqual(registry.names, ["Raid Token"])
+            self.assertEqual(registry.payout_weights, {"Raid Token": 4})
+            self.assertEqual(TokenRegistry.load(os.path.join(folder, "missing.json")).names[0], "Event Token")
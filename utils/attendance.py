@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+import logging
+import os
+from typing import List, NamedTuple, Optional, Tuple
+from utils.bank_store import GUILD_ID
+
+ATTENDANCE_FLUSH_SECONDS = float(os.getenv("ATTENDANCE_FLUSH_SECONDS", "5"))
+
+JOIN = "join"
+LEAVE = "leave"
+
+insert_attendance_query = """
+INSERT INTO `event_attendance` (`guild_id`, `event_id`, `member_id`, `action`, `created_at`)
+VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+class EventSession(NamedTuple):
+    channel_id: Optional[int]
+    started_at: datetime.datetime
+    checkpoint_at: datetime.datetime
+    records: List[Tuple[int, str, datetime.datetime]]  # (member_id, action, created_at) in the order they happened
+
+
+class AttendanceLog:
+    """
+    Append-only, batched checkpoint of event attendance.
+
+    Joins and leaves are buffered in memory by `record` and written in one
+    transaction by `flush`, which the event cog calls every few seconds. Each
+    flush also stamps `checkpoint_at` on the guild's running sessions, the last
+    moment the bot is known to have been tracking them. After a restart, `load`
+    returns a session's start time, checkpoint and records so the event can be
+    replayed.
+
+    Attributes:
+    pool: The connection pool to the database.
+    guild_id (int): The guild whose events are tracked.
+
+    Methods:
+    start_event: Records that an event started, replacing any earlier session with the same id.
+    record: Buffers a join or leave.
+    flush: Writes the buffered records and the checkpoint time.
+    load: Gets the checkpointed session of an event, if any.
+    end_event: Flushes and removes the session and attendance of a finalized event.
+    """
+    def __init__(self, pool, guild_id: int = GUILD_ID) -> None:
+        self.pool = pool
+        self.guild_id = guild_id
+        self._pending: List[tuple] = []
+        self._flush_lock = asyncio.Lock()
+
+    async def _execute(self, statements: List[Tuple[str, list]]) -> None:
+        # Runs (query, args) pairs in one transaction; args that are a list of tuples go through executemany
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                try:
+                    await conn.begin()
+                    for query, args in statements:
+                        if args and isinstance(args[0], tuple):
+                            await cur.executemany(query, args)
+                        else:
+                            await cur.execute(query, args)
+                    await conn.commit()
+                except Exception as e:
+                    logging.error(f"Error executing attendance query: {e}")
+                    await conn.rollback()
+                    raise
+
+    def _clear_statements(self, event_id: int) -> List[Tuple[str, list]]:
+        return [
+            ("DELETE FROM `event_attendance` WHERE `guild_id` = %s AND `event_id` = %s", [self.guild_id, event_id]),
+            ("DELETE FROM `event_sessions` WHERE `guild_id` = %s AND `event_id` = %s", [self.guild_id, event_id]),
+        ]
+
+    async def start_event(self, event_id: int, channel_id: Optional[int], started_at: datetime.datetime) -> None:
+        async with self._flush_lock:
+            await self._execute(self._clear_statements(event_id) + [(
+                "INSERT INTO `event_sessions` (`guild_id`, `event_id`, `channel_id`, `started_at`, `checkpoint_at`) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [self.guild_id, event_id, channel_id, started_at, started_at],
+            )])
+
+    def record(self, event_id: int, member_id: int, action: str, at: datetime.datetime) -> None:
+        self._pending.append((self.guild_id, event_id, member_id, action, at))
+
+    async def flush(self) -> int:
+        """Write the buffered records. Returns how many were written; on failure they stay buffered for the next flush."""
+        async with self._flush_lock:
+            pending, self._pending = self._pending, []
+            statements = [(insert_attendance_query, pending)] if pending else []
+            statements.append((
+                "UPDATE `event_sessions` SET `checkpoint_at` = %s WHERE `guild_id` = %s",
+                [datetime.datetime.utcnow(), self.guild_id],
+            ))
+            try:
+                await self._execute(statements)
+            except Exception:
+                self._pending[:0] = pending
+                raise
+            return len(pending)
+
+    async def load(self, event_id: int) -> Optional[EventSession]:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT `channel_id`, `started_at`, `checkpoint_at` FROM `event_sessions` WHERE `guild_id` = %s AND `event_id` = %s",
+                    (self.guild_id, event_id),
+                )
+                session = await cur.fetchone()
+                if session is None:
+                    return None
+                await cur.execute(
+                    "SELECT `member_id`, `action`, `created_at` FROM `event_attendance` "
+                    "WHERE `guild_id` = %s AND `event_id` = %s ORDER BY `attendance_id`",
+                    (self.guild_id, event_id),
+                )
+                records = [tuple(row) for row in await cur.fetchall()]
+        return EventSession(session[0], session[1], session[2], records)
+
+    async def end_event(self, event_id: int) -> None:
+        await self.flush()
+        async with self._flush_lock:
+            await self._execute(self._clear_statements(event_id))
@@ -0,0 +1,189 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+BANK_CACHE_CHECK_INTERVAL = float(os.getenv("BANK_CACHE_CHECK_INTERVAL", "2.0"))
+
+
+class BankCache:
+    """
+    Write-through, process-level cache in front of a BankStore.
+
+    The whole bank is loaded once and reads are served from memory. Writes go to
+    the store first and are then applied to the cached copy. At most once every
+    `check_interval` seconds a read compares the store's `bank_version` with the
+    cached version and reloads when another process has written in between.
+    Overlapping writes of this process may finish out of version order; the
+    versions they leave behind are accounted for rather than reloaded.
+
+    Attributes:
+    store (BankStore): The store that owns the data.
+    check_interval (float): Seconds between bank version checks.
+    version (int): The bank version the cached copy reflects.
+    loads (int): How many times the bank was loaded from the store.
+
+    Methods:
+    invalidate: Forces the next read to reload the bank.
+    get_member_balances, get_balance, get_token_balances, get_totals, load_bank: Served from memory.
+    load_versioned_bank: Checks the bank version, then serves the bank from memory with the version it reflects.
+    increment, increment_many, approve_pending_tokens, delete_member: Written through to the store.
+    import_legacy_bank, rebuild_balances, create_payout_run: Passed to the store, then invalidate.
+    """
+    def __init__(self, store, check_interval: float = BANK_CACHE_CHECK_INTERVAL) -> None:
+        self.store = store
+        self.check_interval = check_interval
+        self.version = 0
+        self.loads = 0
+        self._bank: Optional[Dict[str, Dict[int, Dict[str, int]]]] = None
+        self._checked_at = 0.0
+        self._load_lock = asyncio.Lock()
+        self._writes = 0  # store.writes when self.version was last in step with the store
+        self._in_flight = 0
+
+    def __getattr__(self, name):
+        # Anything the cache doesn't override (locks, snapshots, ...) goes straight to the store
+        return getattr(self.store, name)
+
+    def invalidate(self) -> None:
+        self._bank = None
+
+    async def _current(self, check: bool = False) -> Dict[str, Dict[int, Dict[str, int]]]:
+        # check compares the bank version with the store even if it was checked less than check_interval ago
+        if not check and self._bank is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self._bank
+        async with self._load_lock:
+            if not check and self._bank is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._bank
+            # Read the version before the rows so a write landing in between only causes an extra reload
+            version = await self.store.get_version()
+            if self._bank is None or version != self.version:
+                bank = {}
+                for company, members in (await self.store.load_bank()).items():
+                    bank[company] = {int(member_id): tokens for member_id, tokens in members.items()}
+                self._bank = bank
+                self.version = version
+                self._writes = self.store.writes
+                self.loads += 1
+                logging.info(f"Bank cache loaded at version {version}.")
+            self._checked_at = time.monotonic()
+            return self._bank
+
+    @asynccontextmanager
+    async def _writing(self):
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    def _written(self) -> bool:
+        # True when the write can be applied in place: every version since the cached one was written by this process
+        if self._bank is None:
+            return False
+        if self.store.version - self.version == self.store.writes - self._writes:
+            self.version = self.store.version
+            self._writes = self.store.writes
+            return True
+        if self._in_flight:
+            # An overlapping write of ours may hold the missing version; the last one to finish checks again
+            return True
+        self.invalidate()
+        return False
+
+    async def get_member_balances(self, member_id: int, company: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        bank = await self._current()
+        member_id = int(member_id)
+        companies = [company] if company is not None else list(bank)
+        return {
+            name: dict(bank[name][member_id])
+            for name in companies
+            if member_id in bank.get(name, {})
+        }
+
+    async def get_balance(self, member_id: int, company: str, token_type: str) -> int:
+        bank = await self._current()
+        return bank.get(company, {}).get(int(member_id), {}).get(token_type, 0)
+
+    async def get_token_balances(self, token_type: str) -> Dict[str, Dict[int, int]]:
+        balances = {}
+        for company, members in (await self._current()).items():
+            for member_id, tokens in members.items():
+                if tokens.get(token_type, 0) > 0:
+                    balances.setdefault(company, {})[member_id] = tokens[token_type]
+        return balances
+
+    async def get_totals(self, company: str, member_ids: Iterable[int]) -> Dict[str, int]:
+        members = (await self._current()).get(company, {})
+        totals = {}
+        for member_id in member_ids:
+            for token_type, balance in members.get(int(member_id), {}).items():
+                totals[token_type] = totals.get(token_type, 0) + balance
+        return totals
+
+    async def load_bank(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        bank = await self._current()
+        return {
+            company: {str(member_id): dict(tokens) for member_id, tokens in members.items()}
+            for company, members in bank.items()
+        }
+
+    async def load_versioned_bank(self) -> Tuple[int, Dict[str, Dict[str, Dict[str, int]]]]:
+        # Reports self.version rather than the store's, so the pair always describes the same copy of the bank
+        bank = await self._current(check=True)
+        return self.version, {
+            company: {str(member_id): dict(tokens) for member_id, tokens in members.items()}
+            for company, members in bank.items()
+        }
+
+    async def increment(self, member_id: int, company: str, token_type: str, delta: int, floor: int = 0,
+                        source: str = "increment", source_id: Optional[str] = None) -> int:
+        async with self._writing():
+            balance = await self.store.increment(member_id, company, token_type, delta, floor, source, source_id)
+        if self._written():
+            self._bank.setdefault(company, {}).setdefault(int(member_id), {})[token_type] = balance
+        return balance
+
+    async def increment_many(self, increments: Iterable[Tuple[int, str, str, int]], floor: int = 0, source: str = "increment",
+                             source_id: Optional[str] = None) -> Dict[Tuple[str, int, str], Tuple[int, int]]:
+        async with self._writing():
+            changes = await self.store.increment_many(increments, floor, source, source_id)
+        if changes and self._written():
+            for (company, member_id, token_type), (_, balance) in changes.items():
+                self._bank.setdefault(company, {}).setdefault(member_id, {})[token_type] = balance
+        return changes
+
+    async def approve_pending_tokens(self, member_ids: Optional[Iterable[int]] = None, event_id: Optional[int] = None,
+                                     approved_by: Optional[str] = None) -> Dict[Tuple[str, int, str], Tuple[int, int]]:
+        async with self._writing():
+            changes = await self.store.approve_pending_tokens(member_ids, event_id, approved_by)
+        if changes and self._written():
+            for (company, member_id, token_type), (_, balance) in changes.items():
+                self._bank.setdefault(company, {}).setdefault(member_id, {})[token_type] = balance
+        return changes
+
+    async def create_payout_run(self, payout_key: str, week: datetime.date, income: int, pool: int, lines: Iterable[Tuple[int, str, int, int]],
+                                resets: Dict[Tuple[str, int, str], int], created_by: Optional[str] = None) -> Tuple[int, bool]:
+        run = await self.store.create_payout_run(payout_key, week, income, pool, lines, resets, created_by)
+        self.invalidate()  # The reset is floored at zero, so only the store knows the resulting balances
+        return run
+
+    async def delete_member(self, member_id: int, source: str = "delete_member", source_id: Optional[str] = None) -> None:
+        async with self._writing():
+            await self.store.delete_member(member_id, source, source_id)
+        if self._written():
+            for members in self._bank.values():
+                members.pop(int(member_id), None)
+
+    async def import_legacy_bank(self) -> int:
+        imported = await self.store.import_legacy_bank()
+        self.invalidate()
+        return imported
+
+    async def rebuild_balances(self) -> int:
+        rebuilt = await self.store.rebuild_balances()
+        self.invalidate()
+        return rebuilt
@@ -0,0 +1,687 @@
+import abc
+import datetime
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
+from utils.bank_cache import BankCache
+from utils.db import InstrumentedPool
+from utils.locks import StripedLock
+
+GUILD_ID = int(os.getenv("GUILD_ID", "1040334471028801639"))
+BANK_LOCK_STRIPES = int(os.getenv("BANK_LOCK_STRIPES", "64"))
+BANK_CACHE = os.getenv("BANK_CACHE", "true").lower() in ("1", "true", "yes")
+
+# MySQL
+upsert_balance_query = """
+INSERT INTO `token_balances` (`guild_id`, `company`, `member_id`, `token_type`, `balance`)
+VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE `balance` = VALUES(`balance`)
+"""
+# LAST_INSERT_ID(expr) hands the new version back in the OK packet (cursor.lastrowid),
+# so bumping the version and reading it cost a single round trip.
+bump_version_query = """
+INSERT INTO `bank_version` (`guild_id`, `version`) VALUES (%s, LAST_INSERT_ID(1))
+ON DUPLICATE KEY UPDATE `version` = LAST_INSERT_ID(`version` + 1)
+"""
+# SQLite: the same statements with ON CONFLICT, and RETURNING in place of LAST_INSERT_ID(expr)
+sqlite_upsert_balance_query = """
+INSERT INTO `token_balances` (`guild_id`, `company`, `member_id`, `token_type`, `balance`)
+VALUES (%s, %s, %s, %s, %s)
+ON CONFLICT (`guild_id`, `company`, `member_id`, `token_type`) DO UPDATE SET `balance` = excluded.`balance`
+"""
+sqlite_bump_version_query = """
+INSERT INTO `bank_version` (`guild_id`, `version`) VALUES (%s, 1)
+ON CONFLICT (`guild_id`) DO UPDATE SET `version` = `version` + 1
+RETURNING `version`
+"""
+insert_journal_query = """
+INSERT INTO `token_journal` (`guild_id`, `company`, `member_id`, `token_type`, `delta`, `balance`, `source`, `source_id`, `created_at`)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+BalanceKey = Tuple[str, int, str]  # (company, member_id, token_type)
+
+
+class BankStore(Protocol):
+    """
+    The storage interface the bank is written against. `MySQLBankStore` and
+    `SQLiteBankStore` implement it with the same query semantics, and
+    `get_bank_store` picks one from the pool's dialect.
+    """
+    locks: StripedLock
+    version: int
+
+    async def import_legacy_bank(self) -> int: ...
+    async def get_version(self) -> int: ...
+    async def get_member_balances(self, member_id: int, company: Optional[str] = None) -> Dict[str, Dict[str, int]]: ...
+    async def get_balance(self, member_id: int, company: str, token_type: str) -> int: ...
+    async def get_token_balances(self, token_type: str) -> Dict[str, Dict[int, int]]: ...
+    async def get_totals(self, company: str, member_ids: Iterable[int]) -> Dict[str, int]: ...
+    async def get_journal(self, member_id: int, limit: int = 25) -> List[dict]: ...
+    async def increment(self, member_id: int, company: str, token_type: str, delta: int, floor: int = 0,
+                        source: str = "increment", source_id: Optional[str] = None) -> int: ...
+    async def increment_many(self, increments: Iterable[Tuple[int, str, str, int]], floor: int = 0, source: str = "increment",
+                             source_id: Optional[str] = None) -> Dict[BalanceKey, Tuple[int, int]]: ...
+    async def delete_member(self, member_id: int, source: str = "delete_member", source_id: Optional[str] = None) -> None: ...
+    async def add_pending_tokens(self, entries: Iterable[Tuple[int, str, str]], event_id: int) -> int: ...
+    async def get_pending_tokens(self, member_ids: Optional[Iterable[int]] = None, event_id: Optional[int] = None) -> List[dict]: ...
+    async def approve_pending_tokens(self, member_ids: Optional[Iterable[int]] = None, event_id: Optional[int] = None,
+                                     approved_by: Optional[str] = None) -> Dict[BalanceKey, Tuple[int, int]]: ...
+    async def create_payout_run(self, payout_key: str, week: datetime.date, income: int, pool: int, lines: Iterable[Tuple[int, str, int, int]],
+                                resets: Dict[BalanceKey, int], created_by: Optional[str] = None) -> Tuple[int, bool]: ...
+    async def get_payout_run(self, payout_key: str) -> Optional[dict]: ...
+    async def get_payout_history(self, member_id: int, since: datetime.date, before: datetime.date) -> List[dict]: ...
+    async def get_payout_lines(self, week: datetime.date, after: Optional[Tuple[int, str]] = None, limit: int = 500) -> List[dict]: ...
+    async def get_incomplete_payout_runs(self) -> List[str]: ...
+    async def set_payout_delivery(self, run_id: int, member_id: int, status: str) -> None: ...
+    async def complete_payout_run(self, run_id: int) -> None: ...
+    async def load_bank(self) -> Dict[str, Dict[str, Dict[str, int]]]: ...
+    async def load_versioned_bank(self) -> Tuple[int, Dict[str, Dict[str, Dict[str, int]]]]: ...
+    async def take_snapshot(self) -> Optional[int]: ...
+    async def compact_journal(self, before: datetime.datetime) -> Optional[int]: ...
+    async def rebuild_balances(self) -> int: ...
+
+
+class SQLBankStore(abc.ABC):
+    """
+    Row-based storage for member token balances. The tables are created by the
+    migrations in utils/migrations.py, so every method here is plain DML.
+
+    Balances live in the `token_balances` table with one row per
+    (guild_id, company, member_id, token_type), so a command only reads and
+    writes the rows of the member it touches. Writes hold the lock stripes of the
+    (company, member_id) keys they change; reads take no lock. Every write also
+    bumps the guild's row in `bank_version` in the same transaction, so any
+    process can tell when its cached copy of the bank is stale.
+
+    Every change is appended to `token_journal` in the same transaction as the
+    balance itself, with the delta, the resulting balance and the command or
+    event that caused it. `token_balances` is the materialized current state;
+    it can be rebuilt from the latest snapshot in `token_snapshots` plus the
+    journal entries after it, and compaction folds old entries into a new
+    snapshot.
+
+    Attributes:
+    pool: The connection pool to the database.
+    guild_id (int): The guild whose balances are stored.
+    locks (StripedLock): The per-member write locks.
+    version (int): The highest bank version written by this process.
+    writes (int): How many bank versions this process has written.
+
+    Methods:
+    import_legacy_bank: Imports the old `bank_data` JSON blob into `token_balances` once.
+    get_version: Gets the current bank version.
+    get_member_balances: Gets all balances of a member grouped by company.
+    get_balance: Gets a single balance of a member.
+    get_token_balances: Gets every member's balance of one token type grouped by company.
+    get_totals: Sums the balances of the given members of a company per token type.
+    get_journal: Gets the latest journal entries of a member.
+    increment: Adds to a single balance of a member under its row lock and returns the new balance.
+    increment_many: Adds to many balances in one transaction and returns their start and end balances.
+    delete_member: Removes every balance of a member.
+    add_pending_tokens: Queues tokens that wait on a VOD review.
+    get_pending_tokens: Gets the unapproved pending tokens of some members and/or an event.
+    approve_pending_tokens: Grants the unapproved pending tokens of some members and/or an event in one transaction.
+    create_payout_run: Freezes a payout's amounts and resets the tokens it pays for in one transaction.
+    get_payout_run: Gets a payout run with its amounts and delivery statuses.
+    get_payout_history: Gets a member's payout lines over a range of weeks.
+    get_payout_lines: Gets a page of a week's payout lines.
+    get_incomplete_payout_runs: Gets the payout keys of runs whose deliveries haven't finished.
+    set_payout_delivery: Records the delivery status of a member's payout DM.
+    complete_payout_run: Marks a payout run as delivered.
+    load_bank: Loads all balances in the legacy nested dict format.
+    load_versioned_bank: Loads all balances together with a bank version they are at least as new as.
+    take_snapshot: Snapshots `token_balances` if the guild has no snapshot yet.
+    compact_journal: Folds journal entries older than a cutoff into a new snapshot.
+    rebuild_balances: Rewrites `token_balances` from the latest snapshot and the journal tail.
+
+    The queries are shared by both backends; subclasses only supply the
+    statements whose syntax differs between MySQL and SQLite.
+    """
+    upsert_balance_query: str
+    # Appended to reads of rows a transaction is about to rewrite
+    lock_rows = ""
+
+    def __init__(self, pool, guild_id: int = GUILD_ID) -> None:
+        self.pool = pool
+        self.guild_id = guild_id
+        self.locks = StripedLock(BANK_LOCK_STRIPES)
+        self.version = 0
+        self.writes = 0
+
+    async def _fetchall(self, query: str, args=None) -> tuple:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, args)
+                return await cur.fetchall()
+
+    @asynccontextmanager
+    async def _transaction(self, bump_version: bool = True):
+        # Yields a cursor inside a transaction; balance changes also bump the bank version before commit
+        version = None
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                try:
+                    await conn.begin()
+                    yield cur
+                    if bump_version:
+                        version = await self._bump_version(cur)
+                    await conn.commit()
+                except Exception as e:
+                    logging.error(f"Error executing bank query: {e}")
+                    await conn.rollback()
+                    raise
+        if version is not None:
+            self.version = max(self.version, version)
+            self.writes += 1
+
+    @abc.abstractmethod
+    async def _bump_version(self, cur) -> int:
+        """Bump the guild's bank version and return the new version."""
+
+    def _row_values(self, count: int) -> str:
+        # Right-hand side of a (company, member_id, token_type) IN (...) comparison
+        return ", ".join(["(%s, %s, %s)"] * count)
+
+    async def _journal(self, cur, entries: List[Tuple[str, int, str, int, int]], source: str, source_id: Optional[str]) -> None:
+        # entries are (company, member_id, token_type, delta, balance); timestamps are UTC like the rest of the bot
+        if entries:
+            created_at = datetime.datetime.utcnow()
+            await cur.executemany(
+                insert_journal_query,
+                [(self.guild_id, company, member_id, token_type, delta, balance, source, source_id, created_at)
+                 for company, member_id, token_type, delta, balance in entries],
+            )
+
+    async def _balances_for_update(self, cur, keys: List[BalanceKey]) -> Dict[BalanceKey, int]:
+        if not keys:
+            return {}
+        await cur.execute(
+            "SELECT `company`, `member_id`, `token_type`, `balance` FROM `token_balances` "
+            f"WHERE `guild_id` = %s AND (`company`, `member_id`, `token_type`) IN ({self._row_values(len(keys))}){self.lock_rows}",
+            [self.guild_id, *[value for key in keys for value in key]],
+        )
+        return {(company, member_id, token_type): balance for company, member_id, token_type, balance in await cur.fetchall()}
+
+    async def _write_balances(self, cur, balances: Dict[BalanceKey, int], source: str, source_id: Optional[str]) -> None:
+        current = await self._balances_for_update(cur, list(balances))
+        entries = [
+            (company, member_id, token_type, balance - current.get((company, member_id, token_type), 0), balance)
+            for (company, member_id, token_type), balance in balances.items()
+            if current.get((company, member_id, token_type)) != balance
+        ]
+        await self._upsert_entries(cur, entries, source, source_id)
+
+    async def _upsert_entries(self, cur, entries: List[Tuple[str, int, str, int, int]], source: str, source_id: Optional[str]) -> None:
+        # executemany sends a single multi-row INSERT on aiomysql, so this is one statement per table however many rows change
+        if entries:
+            await cur.executemany(
+                self.upsert_balance_query,
+                [(self.guild_id, company, member_id, token_type, balance) for company, member_id, token_type, _, balance in entries],
+            )
+            await self._journal(cur, entries, source, source_id)
+
+    async def import_legacy_bank(self) -> int:
+        """Copy the `bank_data` blob into `token_balances` and retire the blob. Returns the number of rows imported."""
+        rows = await self._fetchall("SELECT `data` FROM `bank_data` WHERE `key` = 'bank'")
+        if not rows:
+            return 0
+        balances = {
+            (company, int(member_id), token_type): balance
+            for company, members in json.loads(rows[0][0]).items()
+            for member_id, tokens in members.items()
+            for token_type, balance in tokens.items()
+        }
+        async with self._transaction() as cur:
+            await self._write_balances(cur, balances, "legacy_import", None)
+            # Keep the blob around as a backup, under a key import_legacy_bank no longer reads
+            await cur.execute("DELETE FROM `bank_data` WHERE `key` = 'bank_migrated'")
+            await cur.execute("UPDATE `bank_data` SET `key` = 'bank_migrated' WHERE `key` = 'bank'")
+        logging.info(f"Imported {len(balances)} balances from the legacy bank.")
+        return len(balances)
+
+    async def get_version(self) -> int:
+        rows = await self._fetchall("SELECT `version` FROM `bank_version` WHERE `guild_id` = %s", (self.guild_id,))
+        return rows[0][0] if rows else 0
+
+    async def get_member_balances(self, member_id: int, company: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        query = "SELECT `company`, `token_type`, `balance` FROM `token_balances` WHERE `guild_id` = %s AND `member_id` = %s"
+        args = [self.guild_id, int(member_id)]
+        if company is not None:
+            query += " AND `company` = %s"
+            args.append(company)
+        balances = {}
+        for row_company, token_type, balance in await self._fetchall(query, args):
+            balances.setdefault(row_company, {})[token_type] = balance
+        return balances
+
+    async def get_balance(self, member_id: int, company: str, token_type: str) -> int:
+        rows = await self._fetchall(
+            "SELECT `balance` FROM `token_balances` WHERE `guild_id` = %s AND `company` = %s AND `member_id` = %s AND `token_type` = %s",
+            (self.guild_id, company, int(member_id), token_type),
+        )
+        return rows[0][0] if rows else 0
+
+    async def get_token_balances(self, token_type: str) -> Dict[str, Dict[int, int]]:
+        rows = await self._fetchall(
+            "SELECT `company`, `member_id`, `balance` FROM `token_balances` WHERE `guild_id` = %s AND `token_type` = %s AND `balance` > 0",
+            (self.guild_id, token_type),
+        )
+        balances = {}
+        for company, member_id, balance in rows:
+            balances.setdefault(company, {})[member_id] = balance
+        return balances
+
+    async def get_totals(self, company: str, member_ids: Iterable[int]) -> Dict[str, int]:
+        member_ids = [int(member_id) for member_id in member_ids]
+        if not member_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(member_ids))
+        rows = await self._fetchall(
+            "SELECT `token_type`, SUM(`balance`) FROM `token_balances` "
+            f"WHERE `guild_id` = %s AND `company` = %s AND `member_id` IN ({placeholders}) GROUP BY `token_type`",
+            [self.guild_id, company, *member_ids],
+        )
+        return {token_type: int(total) for token_type, total in rows}
+
+    async def get_journal(self, member_id: int, limit: int = 25) -> List[dict]:
+        rows = await self._fetchall(
+            "SELECT `journal_id`, `company`, `token_type`, `delta`, `balance`, `source`, `source_id`, `created_at` "
+            "FROM `token_journal` WHERE `guild_id` = %s AND `member_id` = %s ORDER BY `journal_id` DESC LIMIT %s",
+            (self.guild_id, int(member_id), limit),
+        )
+        keys = ("journal_id", "company", "token_type", "delta", "balance", "source", "source_id", "created_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    async def increment(self, member_id: int, company: str, token_type: str, delta: int, floor: int = 0,
+                        source: str = "increment", source_id: Optional[str] = None) -> int:
+        """
+        Add delta to a balance, never letting it drop below floor (which must be >= 0). The balance is read under its
+        row lock and the floor applied here, so the journal records the change that was actually made.
+        """
+        key = (company, int(member_id), token_type)
+        async with self.locks.hold([(company, int(member_id))]):
+            async with self._transaction() as cur:
+                changes = await self._increment_many(cur, {key: delta}, floor, source, source_id)
+        return changes[key][1]
+
+    async def increment_many(self, increments: Iterable[Tuple[int, str, str, int]], floor: int = 0, source: str = "increment",
+                             source_id: Optional[str] = None) -> Dict[BalanceKey, Tuple[int, int]]:
+        """
+        Apply (member_id, company, token_type, delta) increments in one transaction, never letting a balance drop
+        below floor. Repeated keys are summed. Returns the (start, end) balance of every key.
+        """
+        deltas: Dict[BalanceKey, int] = {}
+        for member_id, company, token_type, delta in increments:
+            key = (company, int(member_id), token_type)
+            deltas[key] = deltas.get(key, 0) + delta
+        if not deltas:
+            return {}
+        async with self.locks.hold({(company, member_id) for company, member_id, _ in deltas}):
+            async with self._transaction() as cur:
+                return await self._increment_many(cur, deltas, floor, source, source_id)
+
+    async def _increment_many(self, cur, deltas: Dict[BalanceKey, int], floor: int, source: str,
+                              source_id: Optional[str]) -> Dict[BalanceKey, Tuple[int, int]]:
+        current = await self._balances_for_update(cur, list(deltas))
+        changes = {key: (current.get(key, 0), max(floor, current.get(key, 0) + delta)) for key, delta in deltas.items()}
+        await self._upsert_entries(
+            cur,
+            [(company, member_id, token_type, end - start, end)
+             for (company, member_id, token_type), (start, end) in changes.items() if end != start],
+            source,
+            source_id,
+        )
+        return changes
+
+    def _pending_filter(self, member_ids: Optional[List[int]], event_id: Optional[int]) -> Tuple[str, list]:
+        query = "WHERE `guild_id` = %s AND `approved_at` IS NULL"
+        args = [self.guild_id]
+        if event_id is not None:
+            query += " AND `event_id` = %s"
+            args.append(int(event_id))
+        if member_ids is not None:
+            query += f" AND `member_id` IN ({', '.join(['%s'] * len(member_ids)) or 'NULL'})"
+            args += member_ids
+        return query, args
+
+    async def add_pending_tokens(self, entries: Iterable[Tuple[int, str, str]], event_id: int) -> int:
+        """Queue (member_id, company, token_type) tokens of an event until their VOD review is approved. Returns how many."""
+        created_at = datetime.datetime.utcnow()
+        rows = [(self.guild_id, int(event_id), int(member_id), company, token_type, created_at) for member_id, company, token_type in entries]
+        if rows:
+            # Balances don't change, so the bank version (and every cache) stays as is
+            async with self._transaction(bump_version=False) as cur:
+                await cur.executemany(
+                    "INSERT INTO `pending_tokens` (`guild_id`, `event_id`, `member_id`, `company`, `token_type`, `created_at`) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    rows,
+                )
+        return len(rows)
+
+    async def get_pending_tokens(self, member_ids: Optional[Iterable[int]] = None, event_id: Optional[int] = None) -> List[dict]:
+        if member_ids is not None:
+            member_ids = [int(member_id) for member_id in member_ids]
+        query, args = self._pending_filter(member_ids, event_id)
+        rows = await self._fetchall(
+            "SELECT `pending_id`, `event_id`, `member_id`, `company`, `token_type`, `created_at` FROM `pending_tokens` "
+            f"{query} ORDER BY `pending_id`",
+            args,
+        )
+        keys = ("pending_id", "event_id", "member_id", "company", "token_type", "created_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    async def approve_pending_tokens(self, member_ids: Optional[Iterable[int]] = None, event_id: Optional[int] = None,
+                                     approved_by: Optional[str] = None) -> Dict[BalanceKey, Tuple[int, int]]:
+        """Grant every unapproved pending token of the given members and/or event in one transaction. Returns the start and end balances."""
+        if member_ids is not None:
+            member_ids = [int(member_id) for member_id in member_ids]
+        # The stripes to lock are only known from the rows, so read them first and re-read them under the locks
+        pending = await self.get_pending_tokens(member_ids, event_id)
+        if not pending:
+            return {}
+        query, args = self._pending_filter(member_ids, event_id)
+        async with self.locks.hold({(row["company"], row["member_id"]) for row in pending}):
+            async with self._transaction() as cur:
+                await cur.execute(
+                    f"SELECT `pending_id`, `company`, `member_id`, `token_type` FROM `pending_tokens` {query}{self.lock_rows}",
+                    args,
+                )
+                rows = await cur.fetchall()
+                deltas: Dict[BalanceKey, int] = {}
+                for _, company, member_id, token_type in rows:
+                    deltas[(company, member_id, token_type)] = deltas.get((company, member_id, token_type), 0) + 1
+                if not deltas:
+                    return {}
+                changes = await self._increment_many(cur, deltas, 0, "vod_review", approved_by)
+                pending_ids = [row[0] for row in rows]
+                await cur.execute(
+                    "UPDATE `pending_tokens` SET `approved_at` = %s, `approved_by` = %s "
+                    f"WHERE `pending_id` IN ({', '.join(['%s'] * len(pending_ids))})",
+                    [datetime.datetime.utcnow(), approved_by, *pending_ids],
+                )
+        return changes
+
+    async def create_payout_run(self, payout_key: str, week: datetime.date, income: int, pool: int, lines: Iterable[Tuple[int, str, int, int]],
+                                resets: Dict[BalanceKey, int], created_by: Optional[str] = None) -> Tuple[int, bool]:
+        """
+        Freeze a payout's (member_id, token_type, tokens, amount) lines and take the tokens it pays for out of the
+        balances, in one transaction. Every member starts out with a pending delivery.
+
+        Idempotent per payout_key: an existing run is returned as is. Returns the run id and whether it was created.
+        """
+        lines = list(lines)
+        # Tokens earned after the payout was computed are not reset, they count towards the next one
+        deltas = {key: -tokens for key, tokens in resets.items() if tokens}
+        async with self.locks.hold({(company, member_id) for company, member_id, _ in deltas}):
+            async with self._transaction() as cur:
+                await cur.execute(
+                    f"SELECT `run_id` FROM `payout_runs` WHERE `guild_id` = %s AND `payout_key` = %s{self.lock_rows}",
+                    (self.guild_id, payout_key),
+                )
+                row = await cur.fetchone()
+                if row:
+                    return row[0], False
+                created_at = datetime.datetime.utcnow()
+                await cur.execute(
+                    "INSERT INTO `payout_runs` (`guild_id`, `payout_key`, `week`, `income`, `pool`, `created_at`, `created_by`) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                    (self.guild_id, payout_key, week, income, pool, created_at, created_by),
+                )
+                run_id = cur.lastrowid
+                if lines:
+                    await cur.executemany(
+                        "INSERT INTO `payout_lines` (`run_id`, `guild_id`, `week`, `member_id`, `token_type`, `tokens`, `amount`) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                        [(run_id, self.guild_id, week, int(member_id), token_type, int(tokens), int(amount))
+                         for member_id, token_type, tokens, amount in lines],
+                    )
+                    await cur.executemany(
+                        "INSERT INTO `payout_deliveries` (`run_id`, `member_id`, `status`, `updated_at`) VALUES (%s, %s, %s, %s)",
+                        [(run_id, member_id, "pending", created_at) for member_id in dict.fromkeys(int(line[0]) for line in lines)],
+                    )
+                await self._increment_many(cur, deltas, 0, "payout", payout_key)
+        return run_id, True
+
+    async def get_payout_run(self, payout_key: str) -> Optional[dict]:
+        """Get a payout run with each member's frozen tokens and amounts per token type and delivery status."""
+        runs = await self._fetchall(
+            "SELECT `run_id`, `week`, `income`, `pool`, `created_at`, `created_by`, `completed_at` FROM `payout_runs` "
+            "WHERE `guild_id` = %s AND `payout_key` = %s",
+            (self.guild_id, payout_key),
+        )
+        if not runs:
+            return None
+        run_id, week, income, pool, created_at, created_by, completed_at = runs[0]
+        members: Dict[int, dict] = {}
+        for member_id, status in await self._fetchall(
+            "SELECT `member_id`, `status` FROM `payout_deliveries` WHERE `run_id` = %s ORDER BY `member_id`", (run_id,)
+        ):
+            members[member_id] = {"status": status, "tokens": {}, "amounts": {}}
+        for member_id, token_type, tokens, amount in await self._fetchall(
+            "SELECT `member_id`, `token_type`, `tokens`, `amount` FROM `payout_lines` WHERE `run_id` = %s", (run_id,)
+        ):
+            members[member_id]["tokens"][token_type] = tokens
+            members[member_id]["amounts"][token_type] = amount
+        return {
+            "run_id": run_id, "payout_key": payout_key, "week": week, "income": income, "pool": pool, "created_at": created_at,
+            "created_by": created_by, "completed_at": completed_at, "members": members,
+        }
+
+    async def get_payout_history(self, member_id: int, since: datetime.date, before: datetime.date) -> List[dict]:
+        """Get a member's payout lines of the weeks in [since, before), newest first. One range scan of idx_payout_lines_member_week."""
+        rows = await self._fetchall(
+            "SELECT `week`, `token_type`, `tokens`, `amount` FROM `payout_lines` "
+            "WHERE `guild_id` = %s AND `member_id` = %s AND `week` >= %s AND `week` < %s ORDER BY `week` DESC, `token_type`",
+            (self.guild_id, int(member_id), since, before),
+        )
+        return [dict(zip(("week", "token_type", "tokens", "amount"), row)) for row in rows]
+
+    async def get_payout_lines(self, week: datetime.date, after: Optional[Tuple[int, str]] = None, limit: int = 500) -> List[dict]:
+        """Get a page of a week's payout lines ordered by (member_id, token_type), starting after the given key."""
+        query = "SELECT `member_id`, `token_type`, `tokens`, `amount` FROM `payout_lines` WHERE `guild_id` = %s AND `week` = %s"
+        args = [self.guild_id, week]
+        if after is not None:
+            # Keyset pagination: each page is a range scan of idx_payout_lines_week however deep it is
+            query += " AND (`member_id` > %s OR (`member_id` = %s AND `token_type` > %s))"
+            args += [int(after[0]), int(after[0]), after[1]]
+        rows = await self._fetchall(f"{query} ORDER BY `member_id`, `token_type` LIMIT %s", [*args, int(limit)])
+        return [dict(zip(("member_id", "token_type", "tokens", "amount"), row)) for row in rows]
+
+    async def get_incomplete_payout_runs(self) -> List[str]:
+        rows = await self._fetchall(
+            "SELECT `payout_key` FROM `payout_runs` WHERE `guild_id` = %s AND `completed_at` IS NULL ORDER BY `run_id`",
+            (self.guild_id,),
+        )
+        return [row[0] for row in rows]
+
+    async def set_payout_delivery(self, run_id: int, member_id: int, status: str) -> None:
+        async with self._transaction(bump_version=False) as cur:
+            await cur.execute(
+                "UPDATE `payout_deliveries` SET `status` = %s, `updated_at` = %s WHERE `run_id` = %s AND `member_id` = %s",
+                (status, datetime.datetime.utcnow(), run_id, int(member_id)),
+            )
+
+    async def complete_payout_run(self, run_id: int) -> None:
+        async with self._transaction(bump_version=False) as cur:
+            await cur.execute(
+                "UPDATE `payout_runs` SET `completed_at` = %s WHERE `run_id` = %s AND `completed_at` IS NULL",
+                (datetime.datetime.utcnow(), run_id),
+            )
+
+    async def delete_member(self, member_id: int, source: str = "delete_member", source_id: Optional[str] = None) -> None:
+        # Lock stripes are per (company, member_id), so find the member's companies before taking them
+        companies = sorted({row[0] for row in await self._fetchall(
+            "SELECT DISTINCT `company` FROM `token_balances` WHERE `guild_id` = %s AND `member_id` = %s",
+            (self.guild_id, int(member_id)),
+        )})
+        if not companies:
+            return
+        member_filter = f"WHERE `guild_id` = %s AND `member_id` = %s AND `company` IN ({', '.join(['%s'] * len(companies))})"
+        args = (self.guild_id, int(member_id), *companies)
+        async with self.locks.hold([(company, int(member_id)) for company in companies]):
+            async with self._transaction() as cur:
+                await cur.execute("SELECT `company`, `token_type`, `balance` FROM `token_balances` " + member_filter + self.lock_rows, args)
+                entries = [(company, int(member_id), token_type, -balance, 0) for company, token_type, balance in await cur.fetchall()]
+                await cur.execute("DELETE FROM `token_balances` " + member_filter, args)
+                await self._journal(cur, entries, source, source_id)
+
+    async def load_bank(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        rows = await self._fetchall(
+            "SELECT `company`, `member_id`, `token_type`, `balance` FROM `token_balances` WHERE `guild_id` = %s",
+            (self.guild_id,),
+        )
+        bank = {}
+        for company, member_id, token_type, balance in rows:
+            bank.setdefault(company, {}).setdefault(str(member_id), {})[token_type] = balance
+        return bank
+
+    async def load_versioned_bank(self) -> Tuple[int, Dict[str, Dict[str, Dict[str, int]]]]:
+        # Read the version before the rows: a write landing in between makes the rows newer than the version, never older
+        version = await self.get_version()
+        return version, await self.load_bank()
+
+    async def _latest_snapshot(self, cur) -> Tuple[Optional[int], int, Dict[BalanceKey, int]]:
+        await cur.execute(
+            "SELECT `snapshot_id`, `journal_id` FROM `token_snapshots` WHERE `guild_id` = %s ORDER BY `snapshot_id` DESC LIMIT 1",
+            (self.guild_id,),
+        )
+        snapshot = await cur.fetchone()
+        if snapshot is None:
+            return None, 0, {}
+        await cur.execute(
+            "SELECT `company`, `member_id`, `token_type`, `balance` FROM `token_snapshot_balances` WHERE `snapshot_id` = %s",
+            (snapshot[0],),
+        )
+        balances = {(company, member_id, token_type): balance for company, member_id, token_type, balance in await cur.fetchall()}
+        return snapshot[0], snapshot[1], balances
+
+    async def _apply_journal(self, cur, balances: Dict[BalanceKey, int], after_id: int, up_to_id: Optional[int] = None) -> None:
+        # Each entry carries the resulting balance, so replaying is just keeping the last one per key
+        query = ("SELECT `company`, `member_id`, `token_type`, `balance` FROM `token_journal` "
+                 "WHERE `guild_id` = %s AND `journal_id` > %s")
+        args = [self.guild_id, after_id]
+        if up_to_id is not None:
+            query += " AND `journal_id` <= %s"
+            args.append(up_to_id)
+        await cur.execute(query + " ORDER BY `journal_id`", args)
+        for company, member_id, token_type, balance in await cur.fetchall():
+            balances[(company, member_id, token_type)] = balance
+
+    async def _insert_snapshot(self, cur, journal_id: int, balances: Dict[BalanceKey, int]) -> int:
+        await cur.execute(
+            "INSERT INTO `token_snapshots` (`guild_id`, `journal_id`) VALUES (%s, %s)",
+            (self.guild_id, journal_id),
+        )
+        snapshot_id = cur.lastrowid
+        rows = [(snapshot_id, company, member_id, token_type, balance)
+                for (company, member_id, token_type), balance in balances.items() if balance]
+        if rows:
+            await cur.executemany(
+                "INSERT INTO `token_snapshot_balances` (`snapshot_id`, `company`, `member_id`, `token_type`, `balance`) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+        return snapshot_id
+
+    async def take_snapshot(self) -> Optional[int]:
+        """Snapshot `token_balances` as the starting point for rebuilds, unless the guild already has a snapshot."""
+        async with self._transaction(bump_version=False) as cur:
+            snapshot_id, _, _ = await self._latest_snapshot(cur)
+            if snapshot_id is not None:
+                return None
+            # Both reads come from the transaction's consistent view, so the balances match the journal position
+            await cur.execute("SELECT COALESCE(MAX(`journal_id`), 0) FROM `token_journal` WHERE `guild_id` = %s", (self.guild_id,))
+            journal_id = (await cur.fetchone())[0]
+            await cur.execute(
+                "SELECT `company`, `member_id`, `token_type`, `balance` FROM `token_balances` WHERE `guild_id` = %s",
+                (self.guild_id,),
+            )
+            balances = {(company, member_id, token_type): balance for company, member_id, token_type, balance in await cur.fetchall()}
+            snapshot_id = await self._insert_snapshot(cur, journal_id, balances)
+        logging.info(f"Took bank snapshot {snapshot_id} at journal entry {journal_id}.")
+        return snapshot_id
+
+    async def compact_journal(self, before: datetime.datetime) -> Optional[int]:
+        """Fold journal entries created before the (UTC) cutoff into a new snapshot and delete them. Returns the new snapshot id."""
+        async with self._transaction(bump_version=False) as cur:
+            await cur.execute(
+                "SELECT MAX(`journal_id`) FROM `token_journal` WHERE `guild_id` = %s AND `created_at` < %s",
+                (self.guild_id, before),
+            )
+            journal_id = (await cur.fetchone())[0]
+            previous_id, previous_journal_id, balances = await self._latest_snapshot(cur)
+            if journal_id is None or journal_id <= previous_journal_id:
+                return None
+            await self._apply_journal(cur, balances, previous_journal_id, journal_id)
+            snapshot_id = await self._insert_snapshot(cur, journal_id, balances)
+            await cur.execute("DELETE FROM `token_journal` WHERE `guild_id` = %s AND `journal_id` <= %s", (self.guild_id, journal_id))
+            if previous_id is not None:
+                await cur.execute("DELETE FROM `token_snapshot_balances` WHERE `snapshot_id` = %s", (previous_id,))
+                await cur.execute("DELETE FROM `token_snapshots` WHERE `snapshot_id` = %s", (previous_id,))
+        logging.info(f"Compacted the token journal up to entry {journal_id} into snapshot {snapshot_id}.")
+        return snapshot_id
+
+    async def rebuild_balances(self) -> int:
+        """Rewrite `token_balances` from the latest snapshot plus the journal tail. Returns the number of balances."""
+        async with self.locks.hold_all():
+            async with self._transaction() as cur:
+                _, journal_id, balances = await self._latest_snapshot(cur)
+                await self._apply_journal(cur, balances, journal_id)
+                await cur.execute("DELETE FROM `token_balances` WHERE `guild_id` = %s", (self.guild_id,))
+                rows = [(self.guild_id, company, member_id, token_type, balance)
+                        for (company, member_id, token_type), balance in balances.items() if balance]
+                if rows:
+                    await cur.executemany(self.upsert_balance_query, rows)
+        return len(rows)
+
+
+class MySQLBankStore(SQLBankStore):
+    """SQLBankStore for aiomysql pools (MySQL/InnoDB)."""
+    upsert_balance_query = upsert_balance_query
+    lock_rows = " FOR UPDATE"
+
+    async def _bump_version(self, cur) -> int:
+        await cur.execute(bump_version_query, (self.guild_id,))
+        return cur.lastrowid
+
+
+class SQLiteBankStore(SQLBankStore):
+    """
+    SQLBankStore for `utils.db.SQLitePool`. SQLite has no row locks; `begin()`
+    takes the database write lock up front (BEGIN IMMEDIATE), which serializes
+    writers the way FOR UPDATE does on MySQL.
+    """
+    upsert_balance_query = sqlite_upsert_balance_query
+
+    def _row_values(self, count: int) -> str:
+        # SQLite only accepts a subquery on the right of a row-value IN
+        return "VALUES " + super()._row_values(count)
+
+    async def _bump_version(self, cur) -> int:
+        await cur.execute(sqlite_bump_version_query, (self.guild_id,))
+        return (await cur.fetchone())[0]
+
+
+_bank_stores: Dict[int, BankStore] = {}
+
+
+def get_bank_store(pool) -> BankStore:
+    """Return the process-wide BankStore for the given pool, wrapped in a BankCache unless BANK_CACHE is off."""
+    if pool is None:
+        logging.error("Connection pool has not been initialized.")
+        raise ValueError("Connection pool has not been initialized.")
+    store = _bank_stores.get(id(pool))
+    if store is None:
+        # aiomysql pools have no dialect attribute; SQLitePool says "sqlite"
+        store_class = SQLiteBankStore if getattr(pool, "dialect", None) == "sqlite" else MySQLBankStore
+        store = store_class(pool)
+        if isinstance(pool, InstrumentedPool):
+            # Lock waits are logged with the pool's stats, so contention on the stripes shows up in production
+            pool.watch("Bank lock", store.locks.summary)
+        if BANK_CACHE:
+            store = BankCache(store)
+        _bank_stores[id(pool)] = store
+    return store
@@ -1,39 +1,303 @@
 import aiomysql
+import aiosqlite
 import asyncio
 import os
+import sqlite3
 import logging
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
 from dotenv import load_dotenv
 
 logging.basicConfig(level=logging.ERROR)
 # Load environment variables
 load_dotenv("db_configs.env")
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()  # "mysql" or "sqlite"
 DBHOST = os.getenv("DBHOST")
-DBPORT = int(os.getenv("DBPORT"))
+DBPORT = int(os.getenv("DBPORT", "3306"))
 DBUSER = os.getenv("DBUSER")
 DBPASSWORD = os.getenv("DBPASSWORD")
 DBNAME = os.getenv("DBNAME")
-if not all([DBHOST, DBPORT, DBUSER, DBPASSWORD, DBNAME]):
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bank.sqlite3")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+DB_POOL_MINSIZE = int(os.getenv("DB_POOL_MINSIZE", "1"))
+DB_POOL_MAXSIZE = int(os.getenv("DB_POOL_MAXSIZE", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))  # Seconds before a connection is replaced, -1 to never recycle
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "5"))  # Connections opened at startup, capped at the pool size
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "60"))  # Seconds between idle connection pings, 0 to disable
+if DB_BACKEND not in ("mysql", "sqlite"):
+    raise ValueError(f"Unknown DB_BACKEND '{DB_BACKEND}', use 'mysql' or 'sqlite'.")
+if DB_BACKEND == "mysql" and not all([DBHOST, DBPORT, DBUSER, DBPASSWORD, DBNAME]):
     raise ValueError("One or more database configuration environment variables are missing.")
 pool = None
 
 
+class SQLiteCursor:
+    """Wraps an aiosqlite cursor with the aiomysql cursor calls the bank uses, translating %s placeholders to ?."""
+    def __init__(self, cursor: aiosqlite.Cursor) -> None:
+        self._cursor = cursor
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    async def execute(self, query: str, args=None):
+        return await self._cursor.execute(query.replace("%s", "?"), tuple(args or ()))
+
+    async def executemany(self, query: str, args):
+        return await self._cursor.executemany(query.replace("%s", "?"), [tuple(row) for row in args])
+
+    async def fetchone(self):
+        return await self._cursor.fetchone()
+
+    async def fetchall(self):
+        return await self._cursor.fetchall()
+
+
+class SQLiteConnection:
+    """Wraps an aiosqlite connection with the aiomysql connection calls the bank uses."""
+    def __init__(self, conn: aiosqlite.Connection) -> None:
+        self._conn = conn
+
+    @asynccontextmanager
+    async def cursor(self):
+        cursor = await self._conn.cursor()
+        try:
+            yield SQLiteCursor(cursor)
+        finally:
+            await cursor.close()
+
+    async def begin(self):
+        # IMMEDIATE takes the write lock up front, like InnoDB's FOR UPDATE reads would
+        await self._conn.execute("BEGIN IMMEDIATE")
+
+    async def commit(self):
+        await self._conn.commit()
+
+    async def rollback(self):
+        await self._conn.rollback()
+
+
+class SQLitePool:
+    """
+    A small pool of aiosqlite connections in WAL mode with the aiomysql pool interface the bank uses.
+
+    WAL lets readers keep going while one connection writes; each connection runs
+    in its own aiosqlite thread, so waiting on the database's busy timeout never
+    blocks the event loop.
+
+    Attributes:
+    dialect (str): Always "sqlite"; tells the bank store and migrations which SQL to use.
+    path (str): The database file.
+    """
+    dialect = "sqlite"
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self._size = size
+        self._connections = []
+        self._free: asyncio.Queue = asyncio.Queue()
+
+    async def open(self) -> "SQLitePool":
+        for _ in range(self._size):
+            # isolation_level=None leaves transaction control to begin()/commit(), as with aiomysql autocommit
+            conn = await aiosqlite.connect(self.path, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES)
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await conn.execute("PRAGMA synchronous=NORMAL")
+            await conn.execute("PRAGMA busy_timeout=5000")
+            self._connections.append(conn)
+            self._free.put_nowait(SQLiteConnection(conn))
+        return self
+
+    def size(self) -> int:
+        return len(self._connections)
+
+    @property
+    def maxsize(self) -> int:
+        return self._size
+
+    @property
+    def freesize(self) -> int:
+        return self._free.qsize()
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self._free.get()
+        try:
+            yield conn
+        finally:
+            self._free.put_nowait(conn)
+
+    def close(self) -> None:
+        pass
+
+    async def wait_closed(self) -> None:
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+
+
+class InstrumentedPool:
+    """
+    Wraps a connection pool (aiomysql or SQLitePool) with acquire metrics, warm-up and a health probe.
+
+    Attributes:
+    pool: The wrapped pool; anything not defined here is delegated to it.
+    acquisitions (int): How many connections were handed out.
+    total_wait (float): Seconds spent waiting for a connection, summed over all acquisitions.
+    max_wait (float): The longest single wait for a connection.
+    in_use (int): Connections currently handed out.
+    max_in_use (int): The most connections handed out at once.
+    errors (int): Failed acquisitions and failed health pings.
+
+    Methods:
+    acquire: Async context manager yielding a connection, like the wrapped pool's.
+    warm_up: Opens connections ahead of the first burst.
+    check_health: Pings every idle connection once.
+    start_health_checks: Runs check_health in the background every interval seconds.
+    stats: Returns the metrics above along with the pool's size and free count.
+    watch: Adds another component's metrics to the periodic stats log.
+    log_stats: Logs the pool's metrics and those of every watched component.
+    """
+    def __init__(self, pool) -> None:
+        self.pool = pool
+        self.acquisitions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.errors = 0
+        self._health_task = None
+        self._watched = {}
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    @asynccontextmanager
+    async def acquire(self):
+        started = time.monotonic()
+        async with AsyncExitStack() as stack:
+            try:
+                conn = await stack.enter_async_context(self.pool.acquire())
+            except Exception:
+                self.errors += 1
+                raise
+            wait = time.monotonic() - started
+            self.acquisitions += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            try:
+                yield conn
+            finally:
+                self.in_use -= 1
+
+    async def _ping(self, conn) -> bool:
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT 1")
+                await cur.fetchone()
+            return True
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Database health check failed: {e}")
+            if hasattr(conn, "close"):
+                conn.close()  # aiomysql drops closed connections on release and opens a fresh one on demand
+            return False
+
+    async def warm_up(self, count: int) -> int:
+        """Hold `count` connections at once so the pool opens them now rather than during the first burst."""
+        count = min(count, self.pool.maxsize)
+        async with AsyncExitStack() as stack:
+            for _ in range(count):
+                await stack.enter_async_context(self.pool.acquire())
+        logging.info(f"Database pool warmed up to {self.pool.size()} connection(s).")
+        return count
+
+    async def check_health(self) -> int:
+        """Ping each idle connection once. Returns how many failed."""
+        failed = 0
+        # Both pools hand out idle connections first-in first-out, so this cycles through every one of them
+        for _ in range(self.pool.freesize):
+            async with self.pool.acquire() as conn:
+                if not await self._ping(conn):
+                    failed += 1
+        return failed
+
+    async def _health_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check_health()
+                self.log_stats()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Error checking database pool health: {e}")
+
+    def start_health_checks(self, interval: float) -> None:
+        if self._health_task is None and interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop(interval))
+
+    def stats(self) -> dict:
+        return {
+            "size": self.pool.size(),
+            "free": self.pool.freesize,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "acquisitions": self.acquisitions,
+            "avg_wait": self.total_wait / self.acquisitions if self.acquisitions else 0.0,
+            "max_wait": self.max_wait,
+            "errors": self.errors,
+        }
+
+    def watch(self, name: str, stats) -> None:
+        # stats is called on every health check, so it has to be cheap and synchronous
+        self._watched[name] = stats
+
+    def log_stats(self) -> None:
+        logging.info(f"Database pool stats: {self.stats()}")
+        for name, stats in self._watched.items():
+            logging.info(f"{name} stats: {stats()}")
+
+    def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        self.pool.close()
+
+    async def wait_closed(self) -> None:
+        await self.pool.wait_closed()
+
+
 async def create_db_pool():
     global pool
     try:
-        pool = await aiomysql.create_pool(
-            host=DBHOST,
-            port=DBPORT,
-            user=DBUSER,
-            password=DBPASSWORD,
-            db=DBNAME,
-            autocommit=True,  # Optional: set autocommit if you want automatic commits
-            minsize=1,        # Minimum connections in the pool
-            maxsize=10        # Maximum connections in the pool
-        )
-        if pool is not None:
-            logging.info("Database pool created successfully.")
-            logging.info(f"Database pool size: {pool.size()}")
-    except aiomysql.Error as e:
+        if DB_BACKEND == "sqlite":
+            db_pool = await SQLitePool(SQLITE_PATH, SQLITE_POOL_SIZE).open()
+        else:
+            db_pool = await aiomysql.create_pool(
+                host=DBHOST,
+                port=DBPORT,
+                user=DBUSER,
+                password=DBPASSWORD,
+                db=DBNAME,
+                autocommit=True,  # Optional: set autocommit if you want automatic commits
+                minsize=DB_POOL_MINSIZE,
+                maxsize=DB_POOL_MAXSIZE,
+                pool_recycle=DB_POOL_RECYCLE,
+                connect_timeout=DB_CONNECT_TIMEOUT,
+            )
+        pool = InstrumentedPool(db_pool)
+        await pool.warm_up(DB_POOL_WARMUP)
+        pool.start_health_checks(DB_HEALTH_CHECK_INTERVAL)
+        logging.info(f"Database pool created successfully ({DB_BACKEND}).")
+        logging.info(f"Database pool size: {pool.size()}")
+    except (aiomysql.Error, aiosqlite.Error) as e:
         logging.error(f"Error creating database pool: {e}")
         pool = None
     except Exception as e:
@@ -42,14 +306,15 @@ async def create_db_pool():
     return pool
 
 
-async def close_db_pool():
+async def close_db_pool(db_pool=None):
     global pool
-    if pool is not None:
+    db_pool = db_pool or pool
+    if db_pool is not None:
         try:
-            pool.close()
-            await pool.wait_closed()
+            db_pool.close()
+            await db_pool.wait_closed()
             logging.info("Database pool closed successfully.")
-        except aiomysql.Error as e:
+        except (aiomysql.Error, aiosqlite.Error) as e:
             logging.error(f"Error closing database pool: {e}")
         except Exception as e:
             logging.error(f"Unexpected error when closing the database pool: {e}")
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, Iterable, Set, Tuple
+import discord
+
+DM_CONCURRENCY = int(os.getenv("DM_CONCURRENCY", "5"))
+DM_RETRIES = int(os.getenv("DM_RETRIES", "2"))
+
+SENT = "sent"
+BLOCKED = "blocked"  # The member doesn't accept DMs from the server
+FAILED = "failed"
+
+# A message is the member plus a factory for the `send` keyword arguments, called per attempt
+# because a discord.File can only be uploaded once.
+Message = Tuple[discord.abc.Messageable, Callable[[], dict]]
+
+
+class DMDispatcher:
+    """
+    Sends DMs in the background with bounded concurrency.
+
+    discord.py already queues requests per rate-limit bucket and retries 429s;
+    the semaphore keeps a large fan-out from piling hundreds of requests into
+    those queues at once and starving the rest of the bot. Server errors and
+    rate limits that outlast discord.py's own retries are retried with backoff.
+
+    Attributes:
+    concurrency (int): The most DMs in flight at once.
+    retries (int): Extra attempts for a DM that failed with a rate limit or server error.
+
+    Methods:
+    dispatch: Starts delivering messages in the background and returns the task.
+    deliver: Delivers messages and returns each member's delivery status.
+    """
+    def __init__(self, concurrency: int = DM_CONCURRENCY, retries: int = DM_RETRIES) -> None:
+        self.concurrency = concurrency
+        self.retries = retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def dispatch(self, name: str, messages: Iterable[Message]) -> "asyncio.Task[Dict[int, str]]":
+        task = asyncio.create_task(self.deliver(name, list(messages)))
+        # Keep a reference until it finishes, or the task could be garbage collected mid-delivery
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def deliver(self, name: str, messages: Iterable[Message]) -> Dict[int, str]:
+        messages = list(messages)
+        results = await asyncio.gather(*[self._send(member, build) for member, build in messages])
+        statuses = {member.id: status for (member, _), status in zip(messages, results)}
+        counts = {status: list(statuses.values()).count(status) for status in (SENT, BLOCKED, FAILED)}
+        logging.info(f"DMs for {name}: {counts[SENT]} sent, {counts[BLOCKED]} blocked, {counts[FAILED]} failed")
+        for status in (BLOCKED, FAILED):
+            if counts[status]:
+                # The ids are what a retry needs; display names can change before anyone looks
+                member_ids = sorted(member_id for member_id, member_status in statuses.items() if member_status == status)
+                logging.warning(f"DMs for {name} {status}: {', '.join(map(str, member_ids))}")
+        return statuses
+
+    async def _send(self, member, build: Callable[[], dict]) -> str:
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    await member.send(**build())
+                    return SENT
+                except discord.Forbidden:
+                    logging.warning(f"Cannot send message to {member.display_name} due to privacy settings.")
+                    return BLOCKED
+                except discord.HTTPException as e:
+                    if attempt < self.retries and (e.status == 429 or e.status >= 500):
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+                    logging.error(f"Failed to send message to {member.display_name}: {e}")
+                    return FAILED
+                except Exception as e:
+                    logging.error(f"Failed to send message to {member.display_name}: {e}")
+                    return FAILED
+            return FAILED
+
+
+dm_dispatcher = DMDispatcher()
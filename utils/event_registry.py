@@ -0,0 +1,49 @@
+from typing import Dict, List, Optional
+
+
+class EventRegistry:
+    """
+    The running events, keyed by scheduled event id, with an index from voice channel id to the events held in it.
+
+    Attributes:
+    events (Dict[int, Event]): The running events by scheduled event id.
+    channels (Dict[int, Dict[int, Event]]): The running events by channel id, then scheduled event id.
+
+    Methods:
+    add: Registers a started event under its scheduled event id and channel.
+    get: Gets a running event by scheduled event id.
+    remove: Unregisters an event and returns it.
+    in_channel: Gets the running events held in a channel.
+    """
+    def __init__(self) -> None:
+        self.events: Dict[int, "Event"] = {}
+        self.channels: Dict[int, Dict[int, "Event"]] = {}
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __contains__(self, event_id: int) -> bool:
+        return event_id in self.events
+
+    def add(self, event_id: int, event) -> None:
+        self.remove(event_id)
+        self.events[event_id] = event
+        if event.channel is not None:
+            self.channels.setdefault(event.channel.id, {})[event_id] = event
+
+    def get(self, event_id: int):
+        return self.events.get(event_id)
+
+    def remove(self, event_id: int):
+        event = self.events.pop(event_id, None)
+        if event is not None and event.channel is not None:
+            channel_events = self.channels.get(event.channel.id, {})
+            channel_events.pop(event_id, None)
+            if not channel_events:
+                self.channels.pop(event.channel.id, None)
+        return event
+
+    def in_channel(self, channel_id: Optional[int]) -> List["Event"]:
+        if channel_id is None:
+            return []
+        return list(self.channels.get(channel_id, {}).values())
@@ -0,0 +1,99 @@
+import asyncio
+import csv
+import datetime
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+EVENT_REPORT_FOLDER = os.getenv("EVENT_REPORT_FOLDER", "event_files")
+
+report_columns = ["event_id", "event_name", "member_id", "member_name", "token", "start_balance", "end_balance",
+                  "duration_seconds", "sessions"]
+
+
+def _report_rows(event_id, event_name: str, event_info: dict, names: Dict[int, str]) -> List[dict]:
+    return [
+        {
+            "event_id": event_id,
+            "event_name": event_name,
+            "member_id": int(member_id),
+            "member_name": names.get(int(member_id), str(member_id)),
+            "token": member_data["Token Earned"],
+            "start_balance": member_data["start_balance"],
+            "end_balance": member_data["end_balance"],
+            "duration_seconds": round(member_data["duration"].total_seconds(), 3),
+            "sessions": [[joined.isoformat(), left.isoformat() if left else None] for joined, left in member_data["sessions"]],
+        }
+        for member_id, member_data in event_info["members"].items()
+    ]
+
+
+def write_event_report(folder: str, event_id, event_data: dict, names: Dict[int, str], ended_at: datetime.datetime) -> List[str]:
+    """Write the JSONL, CSV and legacy text reports of an event. Blocking; returns the paths written."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for event_name, event_info in event_data.items():
+        rows = _report_rows(event_id, event_name, event_info, names)
+        base = os.path.join(folder, f"{event_id}_{ended_at:%Y%m%dT%H%M%S}")
+        with open(f"{base}.jsonl", "w", encoding="utf-8") as file:
+            for row in rows:
+                file.write(json.dumps(row) + "\n")
+        with open(f"{base}.csv", "w", encoding="utf-8", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=report_columns)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({**row, "sessions": ";".join(f"{joined}/{left}" for joined, left in row["sessions"])})
+        with open(f"{base}.txt", "w", encoding="utf-8") as file:
+            # Write event general information
+            file.write(
+                f"Event Name: {event_name}\n"
+                f"Event Duration: {event_info['event_duration']} seconds\n\n"
+            )
+            for row, member_data in zip(rows, event_info["members"].values()):
+                # Write member-specific information
+                file.write(
+                    f"Member ID: {row['member_id']}\n"
+                    f"Member Nickname: {row['member_name']}\n"
+                    f"Token Earned: {row['token']}\n"
+                    f"Start Balance: {row['start_balance']}\n"
+                    f"End Balance: {row['end_balance']}\n"
+                    f"Time Spent in Event: {row['duration_seconds']} seconds\n"
+                    f"Sessions: {', '.join(f'{joined:%H:%M:%S}-{left:%H:%M:%S}' for joined, left in member_data['sessions'])}\n\n"
+                )
+        paths += [f"{base}.jsonl", f"{base}.csv", f"{base}.txt"]
+    return paths
+
+
+class EventReportWriter:
+    """
+    Writes event reports on a background thread so large reports never block the event loop.
+
+    A single worker keeps reports from competing for the disk and writes them in the order they were submitted.
+
+    Attributes:
+    folder (str): Where the reports are written.
+
+    Methods:
+    write: Writes the reports of an event off the event loop and returns the paths written.
+    """
+    def __init__(self, folder: str = EVENT_REPORT_FOLDER) -> None:
+        self.folder = folder
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-report")
+
+    async def write(self, event_id, event_data: dict, names: Dict[int, str], ended_at: datetime.datetime) -> List[str]:
+        try:
+            paths = await asyncio.get_running_loop().run_in_executor(
+                self._executor, write_event_report, self.folder, event_id, event_data, names, ended_at,
+            )
+            logging.info(f"Event report written: {', '.join(paths)}")
+            return paths
+        except OSError as io_err:
+            logging.error(f"IOError when writing the report of event {event_id}: {io_err}")
+        except Exception as e:
+            logging.error(f"Error when writing the report of event {event_id}: {e}")
+        return []
+
+
+report_writer = EventReportWriter()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, Iterable, List
+
+
+class StripedLock:
+    """
+    A bounded pool of asyncio locks shared out by key.
+
+    Keys are hashed onto a fixed number of stripes, so memory stays constant no
+    matter how many members the bank holds, while writes for different members
+    rarely wait on each other. Stripes are always acquired in ascending order,
+    which keeps multi-key holders from deadlocking.
+
+    Attributes:
+    stripes (int): The number of locks in the pool.
+    acquisitions (List[int]): How many times each stripe was acquired.
+    total_wait (List[float]): Seconds spent waiting for each stripe.
+    max_wait (List[float]): The longest single wait for each stripe.
+
+    Methods:
+    stripe: Gets the stripe index of a key.
+    hold: Holds the stripes of the given keys.
+    hold_all: Holds every stripe.
+    stats: Gets the wait-time metrics of every stripe that was used.
+    summary: Gets the wait-time metrics over all stripes, for periodic logging.
+    """
+    def __init__(self, stripes: int = 64) -> None:
+        self.stripes = stripes
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self.acquisitions: List[int] = [0] * stripes
+        self.total_wait: List[float] = [0.0] * stripes
+        self.max_wait: List[float] = [0.0] * stripes
+
+    def stripe(self, key: Hashable) -> int:
+        return hash(key) % self.stripes
+
+    @asynccontextmanager
+    async def hold(self, keys: Iterable[Hashable]):
+        async with self._hold_stripes(sorted({self.stripe(key) for key in keys})):
+            yield
+
+    @asynccontextmanager
+    async def hold_all(self):
+        async with self._hold_stripes(range(self.stripes)):
+            yield
+
+    @asynccontextmanager
+    async def _hold_stripes(self, stripes: Iterable[int]):
+        held = []
+        try:
+            for index in stripes:
+                started = time.perf_counter()
+                await self._locks[index].acquire()
+                held.append(index)
+                waited = time.perf_counter() - started
+                self.acquisitions[index] += 1
+                self.total_wait[index] += waited
+                if waited > self.max_wait[index]:
+                    self.max_wait[index] = waited
+            yield
+        finally:
+            for index in reversed(held):
+                self._locks[index].release()
+
+    def stats(self) -> Dict[int, Dict[str, float]]:
+        return {
+            index: {
+                "acquisitions": self.acquisitions[index],
+                "total_wait": self.total_wait[index],
+                "avg_wait": self.total_wait[index] / self.acquisitions[index],
+                "max_wait": self.max_wait[index],
+                "locked": self._locks[index].locked(),
+            }
+            for index in range(self.stripes)
+            if self.acquisitions[index]
+        }
+
+    def summary(self) -> Dict[str, float]:
+        acquisitions = sum(self.acquisitions)
+        total_wait = sum(self.total_wait)
+        return {
+            "acquisitions": acquisitions,
+            "avg_wait": total_wait / acquisitions if acquisitions else 0.0,
+            "max_wait": max(self.max_wait),
+            # The stripe writers waited on longest; a hot member or an unlucky hash shows up here
+            "hottest_stripe": max(range(self.stripes), key=self.total_wait.__getitem__),
+            "locked": sum(lock.locked() for lock in self._locks),
+        }
@@ -0,0 +1,436 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import List, NamedTuple, Optional, Union
+
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("MIGRATION_LOCK_TIMEOUT", "60"))  # Seconds to wait for another process's migrations
+
+
+class AddColumn(NamedTuple):
+    """Adds a column unless the table already has it."""
+    table: str
+    column: str
+    definition: str
+
+
+class AddIndex(NamedTuple):
+    """Adds an index unless the table already has one by that name."""
+    table: str
+    name: str
+    columns: str
+
+
+Statement = Union[str, AddColumn, AddIndex]
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: List[Statement]
+    # SQLite versions of the statements, when its syntax differs from MySQL's
+    sqlite_statements: Optional[List[Statement]] = None
+
+
+create_schema_migrations_query = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    `version` INT PRIMARY KEY,
+    `name` VARCHAR(255) NOT NULL,
+    `applied_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Append new migrations at the end with the next version number; never edit one that has shipped.
+# Statements use IF NOT EXISTS, and schema changes to existing tables use AddColumn and AddIndex, so databases
+# created before the runner existed and migrations that failed partway both rerun cleanly.
+# SQLite has no inline KEY clauses or AUTO_INCREMENT, so indexes get their own CREATE INDEX statements.
+MIGRATIONS = [
+    Migration(1, "create bank_data", [
+        """
+        CREATE TABLE IF NOT EXISTS bank_data (
+            `key` VARCHAR(255) PRIMARY KEY,
+            `data` JSON NOT NULL
+        )
+        """,
+    ], [
+        """
+        CREATE TABLE IF NOT EXISTS bank_data (
+            `key` VARCHAR(255) PRIMARY KEY,
+            `data` TEXT NOT NULL
+        )
+        """,
+    ]),
+    Migration(2, "create token_balances", [
+        """
+        CREATE TABLE IF NOT EXISTS token_balances (
+            `guild_id` BIGINT NOT NULL,
+            `company` VARCHAR(64) NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `balance` INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`guild_id`, `company`, `member_id`, `token_type`),
+            KEY `idx_token_balances_member` (`guild_id`, `member_id`),
+            KEY `idx_token_balances_token` (`guild_id`, `token_type`)
+        )
+        """,
+    ], [
+        """
+        CREATE TABLE IF NOT EXISTS token_balances (
+            `guild_id` BIGINT NOT NULL,
+            `company` VARCHAR(64) NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `balance` INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`guild_id`, `company`, `member_id`, `token_type`)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_token_balances_member ON token_balances (`guild_id`, `member_id`)",
+        "CREATE INDEX IF NOT EXISTS idx_token_balances_token ON token_balances (`guild_id`, `token_type`)",
+    ]),
+    Migration(3, "create bank_version", [
+        """
+        CREATE TABLE IF NOT EXISTS bank_version (
+            `guild_id` BIGINT PRIMARY KEY,
+            `version` BIGINT NOT NULL
+        )
+        """,
+    ]),
+    Migration(4, "create token_journal and snapshots", [
+        """
+        CREATE TABLE IF NOT EXISTS token_journal (
+            `journal_id` BIGINT AUTO_INCREMENT PRIMARY KEY,
+            `guild_id` BIGINT NOT NULL,
+            `company` VARCHAR(64) NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `delta` INT NOT NULL,
+            `balance` INT NOT NULL,
+            `source` VARCHAR(64) NOT NULL,
+            `source_id` VARCHAR(64) NULL,
+            `created_at` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            KEY `idx_token_journal_member` (`guild_id`, `member_id`, `journal_id`),
+            KEY `idx_token_journal_created` (`guild_id`, `created_at`)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS token_snapshots (
+            `snapshot_id` BIGINT AUTO_INCREMENT PRIMARY KEY,
+            `guild_id` BIGINT NOT NULL,
+            `journal_id` BIGINT NOT NULL,
+            `created_at` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            KEY `idx_token_snapshots_guild` (`guild_id`, `snapshot_id`)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS token_snapshot_balances (
+            `snapshot_id` BIGINT NOT NULL,
+            `company` VARCHAR(64) NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `balance` INT NOT NULL,
+            PRIMARY KEY (`snapshot_id`, `company`, `member_id`, `token_type`)
+        )
+        """,
+    ], [
+        """
+        CREATE TABLE IF NOT EXISTS token_journal (
+            `journal_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            `guild_id` BIGINT NOT NULL,
+            `company` VARCHAR(64) NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `delta` INT NOT NULL,
+            `balance` INT NOT NULL,
+            `source` VARCHAR(64) NOT NULL,
+            `source_id` VARCHAR(64) NULL,
+            `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_token_journal_member ON token_journal (`guild_id`, `member_id`, `journal_id`)",
+        "CREATE INDEX IF NOT EXISTS idx_token_journal_created ON token_journal (`guild_id`, `created_at`)",
+        """
+        CREATE TABLE IF NOT EXISTS token_snapshots (
+            `snapshot_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            `guild_id` BIGINT NOT NULL,
+            `journal_id` BIGINT NOT NULL,
+            `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_token_snapshots_guild ON token_snapshots (`guild_id`, `snapshot_id`)",
+        """
+        CREATE TABLE IF NOT EXISTS token_snapshot_balances (
+            `snapshot_id` BIGINT NOT NULL,
+            `company` VARCHAR(64) NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `balance` INT NOT NULL,
+            PRIMARY KEY (`snapshot_id`, `company`, `member_id`, `token_type`)
+        )
+        """,
+    ]),
+    Migration(5, "create event_sessions and event_attendance", [
+        """
+        CREATE TABLE IF NOT EXISTS event_sessions (
+            `guild_id` BIGINT NOT NULL,
+            `event_id` BIGINT NOT NULL,
+            `channel_id` BIGINT NULL,
+            `started_at` DATETIME(6) NOT NULL,
+            `checkpoint_at` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`guild_id`, `event_id`)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS event_attendance (
+            `attendance_id` BIGINT AUTO_INCREMENT PRIMARY KEY,
+            `guild_id` BIGINT NOT NULL,
+            `event_id` BIGINT NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `action` VARCHAR(8) NOT NULL,
+            `created_at` DATETIME(6) NOT NULL,
+            KEY `idx_event_attendance_event` (`guild_id`, `event_id`, `attendance_id`)
+        )
+        """,
+    ], [
+        """
+        CREATE TABLE IF NOT EXISTS event_sessions (
+            `guild_id` BIGINT NOT NULL,
+            `event_id` BIGINT NOT NULL,
+            `channel_id` BIGINT NULL,
+            `started_at` TIMESTAMP NOT NULL,
+            `checkpoint_at` TIMESTAMP NOT NULL,
+            PRIMARY KEY (`guild_id`, `event_id`)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS event_attendance (
+            `attendance_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            `guild_id` BIGINT NOT NULL,
+            `event_id` BIGINT NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `action` VARCHAR(8) NOT NULL,
+            `created_at` TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_event_attendance_event ON event_attendance (`guild_id`, `event_id`, `attendance_id`)",
+    ]),
+    Migration(6, "create pending_tokens", [
+        """
+        CREATE TABLE IF NOT EXISTS pending_tokens (
+            `pending_id` BIGINT AUTO_INCREMENT PRIMARY KEY,
+            `guild_id` BIGINT NOT NULL,
+            `event_id` BIGINT NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `company` VARCHAR(64) NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `created_at` DATETIME(6) NOT NULL,
+            `approved_at` DATETIME(6) NULL,
+            `approved_by` VARCHAR(64) NULL,
+            KEY `idx_pending_tokens_event` (`guild_id`, `event_id`, `approved_at`),
+            KEY `idx_pending_tokens_member` (`guild_id`, `member_id`, `approved_at`)
+        )
+        """,
+    ], [
+        """
+        CREATE TABLE IF NOT EXISTS pending_tokens (
+            `pending_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            `guild_id` BIGINT NOT NULL,
+            `event_id` BIGINT NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `company` VARCHAR(64) NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `created_at` TIMESTAMP NOT NULL,
+            `approved_at` TIMESTAMP NULL,
+            `approved_by` VARCHAR(64) NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_pending_tokens_event ON pending_tokens (`guild_id`, `event_id`, `approved_at`)",
+        "CREATE INDEX IF NOT EXISTS idx_pending_tokens_member ON pending_tokens (`guild_id`, `member_id`, `approved_at`)",
+    ]),
+    # Amounts are in hundredths of a gold (utils.payout.MINOR_UNITS)
+    Migration(7, "create payout_runs, payout_lines and payout_deliveries", [
+        """
+        CREATE TABLE IF NOT EXISTS payout_runs (
+            `run_id` BIGINT AUTO_INCREMENT PRIMARY KEY,
+            `guild_id` BIGINT NOT NULL,
+            `payout_key` VARCHAR(64) NOT NULL,
+            `income` BIGINT NOT NULL,
+            `pool` BIGINT NOT NULL,
+            `created_at` DATETIME(6) NOT NULL,
+            `created_by` VARCHAR(64) NULL,
+            `completed_at` DATETIME(6) NULL,
+            UNIQUE KEY `uq_payout_runs_key` (`guild_id`, `payout_key`)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payout_lines (
+            `run_id` BIGINT NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `tokens` BIGINT NOT NULL,
+            `amount` BIGINT NOT NULL,
+            PRIMARY KEY (`run_id`, `member_id`, `token_type`)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payout_deliveries (
+            `run_id` BIGINT NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `status` VARCHAR(16) NOT NULL,
+            `updated_at` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`run_id`, `member_id`)
+        )
+        """,
+    ], [
+        """
+        CREATE TABLE IF NOT EXISTS payout_runs (
+            `run_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            `guild_id` BIGINT NOT NULL,
+            `payout_key` VARCHAR(64) NOT NULL,
+            `income` BIGINT NOT NULL,
+            `pool` BIGINT NOT NULL,
+            `created_at` TIMESTAMP NOT NULL,
+            `created_by` VARCHAR(64) NULL,
+            `completed_at` TIMESTAMP NULL,
+            UNIQUE (`guild_id`, `payout_key`)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payout_lines (
+            `run_id` BIGINT NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `token_type` VARCHAR(64) NOT NULL,
+            `tokens` BIGINT NOT NULL,
+            `amount` BIGINT NOT NULL,
+            PRIMARY KEY (`run_id`, `member_id`, `token_type`)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payout_deliveries (
+            `run_id` BIGINT NOT NULL,
+            `member_id` BIGINT NOT NULL,
+            `status` VARCHAR(16) NOT NULL,
+            `updated_at` TIMESTAMP NOT NULL,
+            PRIMARY KEY (`run_id`, `member_id`)
+        )
+        """,
+    ]),
+    # Lines carry their guild and week so a member's history or a week's export is one range scan on payout_lines
+    Migration(8, "add payout weeks and history indexes", [
+        AddColumn("payout_runs", "week", "DATE NULL"),
+        AddIndex("payout_runs", "idx_payout_runs_week", "`guild_id`, `week`"),
+        AddColumn("payout_lines", "guild_id", "BIGINT NULL"),
+        AddColumn("payout_lines", "week", "DATE NULL"),
+        AddIndex("payout_lines", "idx_payout_lines_member_week", "`guild_id`, `member_id`, `week`"),
+        AddIndex("payout_lines", "idx_payout_lines_week", "`guild_id`, `week`, `member_id`, `token_type`"),
+        "UPDATE payout_runs SET `week` = STR_TO_DATE(`payout_key`, '%m/%d/%Y') WHERE `week` IS NULL",
+        """
+        UPDATE payout_lines JOIN payout_runs ON payout_runs.`run_id` = payout_lines.`run_id`
+        SET payout_lines.`guild_id` = payout_runs.`guild_id`, payout_lines.`week` = payout_runs.`week`
+        WHERE payout_lines.`week` IS NULL
+        """,
+    ], [
+        AddColumn("payout_runs", "week", "DATE NULL"),
+        AddColumn("payout_lines", "guild_id", "BIGINT NULL"),
+        AddColumn("payout_lines", "week", "DATE NULL"),
+        """
+        UPDATE payout_runs SET `week` = substr(`payout_key`, 7, 4) || '-' || substr(`payout_key`, 1, 2) || '-' || substr(`payout_key`, 4, 2)
+        WHERE `week` IS NULL
+        """,
+        """
+        UPDATE payout_lines SET
+            `guild_id` = (SELECT `guild_id` FROM payout_runs WHERE payout_runs.`run_id` = payout_lines.`run_id`),
+            `week` = (SELECT `week` FROM payout_runs WHERE payout_runs.`run_id` = payout_lines.`run_id`)
+        WHERE `week` IS NULL
+        """,
+        AddIndex("payout_runs", "idx_payout_runs_week", "`guild_id`, `week`"),
+        AddIndex("payout_lines", "idx_payout_lines_member_week", "`guild_id`, `member_id`, `week`"),
+        AddIndex("payout_lines", "idx_payout_lines_week", "`guild_id`, `week`, `member_id`, `token_type`"),
+    ]),
+]
+
+
+async def _has_column(cur, sqlite: bool, table: str, column: str) -> bool:
+    if sqlite:
+        await cur.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in await cur.fetchall())
+    await cur.execute(
+        "SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column),
+    )
+    return await cur.fetchone() is not None
+
+
+async def _has_index(cur, table: str, name: str) -> bool:
+    await cur.execute(
+        "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table, name),
+    )
+    return await cur.fetchone() is not None
+
+
+async def _execute(cur, sqlite: bool, statement: Statement) -> None:
+    if isinstance(statement, AddColumn):
+        if not await _has_column(cur, sqlite, statement.table, statement.column):
+            await cur.execute(f"ALTER TABLE {statement.table} ADD COLUMN `{statement.column}` {statement.definition}")
+    elif isinstance(statement, AddIndex):
+        if sqlite:
+            await cur.execute(f"CREATE INDEX IF NOT EXISTS {statement.name} ON {statement.table} ({statement.columns})")
+        elif not await _has_index(cur, statement.table, statement.name):
+            await cur.execute(f"ALTER TABLE {statement.table} ADD KEY `{statement.name}` ({statement.columns})")
+    else:
+        await cur.execute(statement)
+
+
+@asynccontextmanager
+async def _migration_lock(conn, cur, sqlite: bool):
+    # Keeps two bot processes starting at once from applying the same migration twice
+    if sqlite:
+        # SQLite DDL is transactional: the whole run is one BEGIN IMMEDIATE transaction, holding the write lock throughout
+        await conn.begin()
+        try:
+            yield
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+        return
+    await cur.execute("SELECT GET_LOCK('schema_migrations', %s)", (MIGRATION_LOCK_TIMEOUT,))
+    if (await cur.fetchone())[0] != 1:
+        raise RuntimeError(f"Timed out after {MIGRATION_LOCK_TIMEOUT}s waiting for another process's schema migrations")
+    try:
+        yield
+    finally:
+        await cur.execute("SELECT RELEASE_LOCK('schema_migrations')")
+        await cur.fetchone()
+
+
+async def run_migrations(pool, migrations: List[Migration] = MIGRATIONS) -> int:
+    """Apply every migration not yet recorded in schema_migrations, in version order. Returns how many were applied."""
+    applied_count = 0
+    sqlite = getattr(pool, "dialect", None) == "sqlite"
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            async with _migration_lock(conn, cur, sqlite):
+                await cur.execute(create_schema_migrations_query)
+                await cur.execute("SELECT `version` FROM `schema_migrations`")
+                applied = {row[0] for row in await cur.fetchall()}
+                for migration in sorted(migrations, key=lambda migration: migration.version):
+                    if migration.version in applied:
+                        continue
+                    logging.info(f"Applying migration {migration.version}: {migration.name}")
+                    try:
+                        # MySQL commits DDL implicitly, so the version is recorded only after every statement succeeded
+                        statements = migration.sqlite_statements if sqlite and migration.sqlite_statements else migration.statements
+                        for statement in statements:
+                            await _execute(cur, sqlite, statement)
+                        await cur.execute(
+                            "INSERT INTO `schema_migrations` (`version`, `name`) VALUES (%s, %s)",
+                            (migration.version, migration.name),
+                        )
+                        if not sqlite:
+                            await conn.commit()
+                    except Exception as e:
+                        logging.error(f"Error applying migration {migration.version} ({migration.name}): {e}")
+                        raise
+                    applied_count += 1
+    logging.info(f"Database schema is up to date ({applied_count} migration(s) applied).")
+    return applied_count
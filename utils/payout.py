@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import numpy as np
+from utils.token_registry import token_registry
+
+PAYOUT_SHARE = Decimal("0.6")  # Share of the weekly income that is paid out
+MINOR_UNITS = 100  # Gold is paid out in hundredths
+payout_token_ratios = token_registry.payout_weights
+
+
+class PayoutPlan(NamedTuple):
+    """
+    The gold owed to every member, in minor units, per payout token.
+
+    `amounts[i, j]` is what `member_ids[i]` earned with `token_types[j]`; the amounts add up to exactly `pool`.
+    """
+    member_ids: np.ndarray
+    token_types: Tuple[str, ...]
+    tokens: np.ndarray
+    amounts: np.ndarray
+    pool: int
+
+    @property
+    def totals(self) -> np.ndarray:
+        return self.amounts.sum(axis=1)
+
+    @property
+    def breakdown(self) -> Dict[str, int]:
+        return {token_type: int(amount) for token_type, amount in zip(self.token_types, self.amounts.sum(axis=0))}
+
+    def members(self) -> Dict[int, dict]:
+        """Each member's tokens and amounts per token type, shaped like the members of a stored payout run."""
+        return {
+            member_id: {"status": "pending", "tokens": dict(zip(self.token_types, tokens)), "amounts": dict(zip(self.token_types, amounts))}
+            for member_id, tokens, amounts in zip(self.member_ids.tolist(), self.tokens.tolist(), self.amounts.tolist())
+        }
+
+    def lines(self) -> List[Tuple[int, str, int, int]]:
+        """The (member_id, token_type, tokens, amount) rows of every token a member holds."""
+        return [
+            (member_id, token_type, tokens, amount)
+            for member_id, member in self.members().items()
+            for token_type, tokens, amount in zip(self.token_types, member["tokens"].values(), member["amounts"].values())
+            if tokens
+        ]
+
+
+class PayoutPreview(NamedTuple):
+    """A simulated payout: the plan plus the (company, member_id, token_type) token counts a real payout would reset."""
+    plan: PayoutPlan
+    resets: Dict[Tuple[str, int, str], int]
+
+
+def to_minor_units(gold) -> int:
+    return int((Decimal(str(gold)) * MINOR_UNITS).to_integral_value())
+
+
+def to_gold(minor_units) -> Decimal:
+    return Decimal(int(minor_units)) / MINOR_UNITS
+
+
+def largest_remainder(total: int, weights: np.ndarray) -> np.ndarray:
+    """Split the integer `total` in proportion to integer weights; the parts sum to exactly `total`."""
+    weights = np.asarray(weights, dtype=np.int64)
+    weight_total = int(weights.sum())
+    if weight_total == 0:
+        raise ValueError("Cannot split an amount over zero weights")
+    quotas, remainders = np.divmod(total * weights, weight_total)
+    leftover = total - int(quotas.sum())
+    # The leftover units go to the largest remainders, ties to the earliest rows, so the result is deterministic
+    order = np.argsort(-remainders, kind="stable")
+    quotas[order[:leftover]] += 1
+    return quotas
+
+
+def token_counts(bank: dict, members_by_role: Dict[str, Iterable[int]],
+                 token_types: Iterable[str] = payout_token_ratios) -> Tuple[np.ndarray, np.ndarray]:
+    """Load every member's payout token counts, summed over their company roles, into an (members, tokens) integer array."""
+    token_types = list(token_types)
+    rows: Dict[int, List[int]] = {}
+    for role_name, member_ids in members_by_role.items():
+        role_bank = bank.get(role_name, {})
+        for member_id in member_ids:
+            balances = role_bank.get(str(member_id), {})
+            row = rows.setdefault(int(member_id), [0] * len(token_types))
+            for index, token_type in enumerate(token_types):
+                row[index] += int(balances.get(token_type, 0))
+    member_ids = np.fromiter(rows, dtype=np.int64, count=len(rows))
+    counts = np.array(list(rows.values()), dtype=np.int64).reshape(len(rows), len(token_types))
+    return member_ids, counts
+
+
+def compute_payouts(member_ids: np.ndarray, tokens: np.ndarray, income,
+                    ratios: Dict[str, int] = payout_token_ratios) -> PayoutPlan:
+    """
+    Split PAYOUT_SHARE of the income between members by their token counts.
+
+    The pool is split between the token types by ratio, then each type's share
+    between its holders by token count, both with largest-remainder rounding so
+    that exactly the pool is paid out. Token types nobody holds are left out of
+    the split instead of stranding their share. Pure, so it serves the payout
+    command, dry runs and benchmarks alike.
+    """
+    member_ids = np.asarray(member_ids, dtype=np.int64)
+    tokens = np.asarray(tokens, dtype=np.int64).reshape(len(member_ids), len(ratios))
+    pool = to_minor_units(PAYOUT_SHARE * Decimal(str(income)))
+    amounts = np.zeros(tokens.shape, dtype=np.int64)
+    held = tokens.sum(axis=0) > 0
+    if held.any() and pool > 0:
+        type_pools = largest_remainder(pool, np.array(list(ratios.values()), dtype=np.int64)[held])
+        for column, type_pool in zip(np.flatnonzero(held), type_pools):
+            amounts[:, column] = largest_remainder(int(type_pool), tokens[:, column])
+    else:
+        pool = 0
+    return PayoutPlan(member_ids, tuple(ratios), tokens, amounts, pool)
+
+
+def simulate_payout(bank: dict, members_by_role: Dict[str, Iterable[int]], income,
+                    ratios: Dict[str, int] = payout_token_ratios) -> PayoutPreview:
+    """Compute a payout from a bank snapshot without touching the bank, Discord or the disk."""
+    members_by_role = {role_name: list(member_ids) for role_name, member_ids in members_by_role.items()}
+    member_ids, tokens = token_counts(bank, members_by_role, ratios)
+    resets = {
+        (role_name, int(member_id), token_type): int(bank.get(role_name, {}).get(str(member_id), {}).get(token_type, 0))
+        for role_name, role_member_ids in members_by_role.items()
+        for member_id in role_member_ids
+        for token_type in ratios
+    }
+    return PayoutPreview(compute_payouts(member_ids, tokens, income, ratios), {key: count for key, count in resets.items() if count})
+
+
+class PayoutPreviews:
+    """
+    The latest payout simulations, keyed by bank version, income and company role members.
+
+    Any balance change bumps the bank version, so a cached preview is exactly
+    what a payout would compute as long as its key still matches: previews are
+    free after the first, and the real payout reuses the last one.
+
+    Methods:
+    get: Gets the cached preview for a bank version, income and role members.
+    put: Caches a preview, dropping the oldest beyond `size`.
+    """
+    def __init__(self, size: int = 8) -> None:
+        self.size = size
+        self._previews: "OrderedDict[tuple, PayoutPreview]" = OrderedDict()
+
+    @staticmethod
+    def _key(version: int, income, members_by_role: Dict[str, Iterable[int]]) -> tuple:
+        return version, to_minor_units(income), tuple((role_name, tuple(sorted(member_ids))) for role_name, member_ids in sorted(members_by_role.items()))
+
+    def get(self, version: int, income, members_by_role: Dict[str, Iterable[int]]) -> Optional[PayoutPreview]:
+        return self._previews.get(self._key(version, income, members_by_role))
+
+    def put(self, version: int, income, members_by_role: Dict[str, Iterable[int]], preview: PayoutPreview) -> None:
+        key = self._key(version, income, members_by_role)
+        self._previews[key] = preview
+        self._previews.move_to_end(key)
+        while len(self._previews) > self.size:
+            self._previews.popitem(last=False)
+
+
+payout_previews = PayoutPreviews()
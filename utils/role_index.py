@@ -0,0 +1,60 @@
+from typing import Dict, Iterable, Optional, Set
+
+
+class RoleIndex:
+    """
+    The members of each tracked role, by role id.
+
+    Built once from `guild.get_role(id).members` and kept current from member
+    join, update and remove events, so payouts and role summaries read the
+    members of a role directly instead of scanning every guild member's roles.
+
+    Attributes:
+    guild_id (Optional[int]): The guild the index was built for, None until it is built.
+    roles (Dict[int, Set[int]]): The member ids holding each tracked role.
+
+    Methods:
+    build: Indexes the members of the given roles from the guild's cache.
+    ensure: Builds the index unless it already covers the guild and roles.
+    update: Adds a member to, or drops them from, each tracked role after a join or role change.
+    remove: Drops a member from every tracked role.
+    member_ids: Gets the member ids holding a role.
+    """
+    def __init__(self) -> None:
+        self.guild_id: Optional[int] = None
+        self.roles: Dict[int, Set[int]] = {}
+
+    def build(self, guild, role_ids: Iterable[int]) -> int:
+        """Index the members of the given roles. Returns how many role memberships were indexed."""
+        roles = {}
+        for role_id in role_ids:
+            role = guild.get_role(role_id)
+            roles[role_id] = {member.id for member in role.members} if role else set()
+        self.guild_id = guild.id
+        self.roles = roles
+        return sum(len(member_ids) for member_ids in roles.values())
+
+    def ensure(self, guild, role_ids: Iterable[int]) -> None:
+        role_ids = list(role_ids)
+        if self.guild_id != guild.id or any(role_id not in self.roles for role_id in role_ids):
+            self.build(guild, set(self.roles) | set(role_ids) if self.guild_id == guild.id else role_ids)
+
+    def update(self, member) -> None:
+        if member.guild.id != self.guild_id:
+            return
+        held = {role.id for role in member.roles}
+        for role_id, member_ids in self.roles.items():
+            if role_id in held:
+                member_ids.add(member.id)
+            else:
+                member_ids.discard(member.id)
+
+    def remove(self, member_id: int) -> None:
+        for member_ids in self.roles.values():
+            member_ids.discard(member_id)
+
+    def member_ids(self, role_id: int) -> Set[int]:
+        return self.roles.get(role_id, set())
+
+
+role_index = RoleIndex()
@@ -0,0 +1,76 @@
+import datetime
+import io
+import logging
+import os
+from typing import Dict, Iterable, Optional
+import discord
+from utils.token_registry import token_registry
+
+photos_folder = os.path.join(os.getcwd(), "photos")
+TOKEN_ASSET_CHANNEL = int(os.getenv("TOKEN_ASSET_CHANNEL", "0"))  # 0: don't upload, attach the cached bytes instead
+TOKEN_ASSET_REFRESH_HOURS = float(os.getenv("TOKEN_ASSET_REFRESH_HOURS", "12"))
+
+
+class TokenAssets:
+    """
+    Token artwork, read once from the token type's image under `photos/` (`<token>.png` by default) and uploaded once to a storage channel.
+
+    Embeds point at the uploaded attachment's CDN URL, so a notification is a
+    plain JSON message with no file read or multipart upload. Discord signs
+    attachment URLs with an expiry, so `upload` runs again every
+    TOKEN_ASSET_REFRESH_HOURS. A token with no fresh URL (no storage channel,
+    failed upload) is attached from the bytes cached in memory.
+
+    Attributes:
+    folder (str): Where the token images are read from.
+    urls (Dict[str, str]): The CDN URL of each uploaded token image.
+
+    Methods:
+    image: Gets the bytes of a token image.
+    upload: Uploads token images to a channel and remembers their URLs.
+    url: Gets the uploaded URL of a token image while it is fresh.
+    embed: Sets a token image on an embed and returns the `send` keyword arguments for it.
+    """
+    def __init__(self, folder: str = photos_folder, refresh_hours: float = TOKEN_ASSET_REFRESH_HOURS) -> None:
+        self.folder = folder
+        self.refresh = datetime.timedelta(hours=refresh_hours)
+        self.urls: Dict[str, str] = {}
+        self._uploaded_at: Dict[str, datetime.datetime] = {}
+        self._images: Dict[str, bytes] = {}
+
+    def image(self, token: str) -> bytes:
+        if token not in self._images:
+            token_type = token_registry.get(token)
+            with open(os.path.join(self.folder, token_type.image if token_type and token_type.image else f"{token}.png"), "rb") as file:
+                self._images[token] = file.read()
+        return self._images[token]
+
+    async def upload(self, channel, tokens: Iterable[str]) -> int:
+        """Upload the given token images to the channel. Returns how many were uploaded."""
+        uploaded = 0
+        for token in tokens:
+            try:
+                message = await channel.send(content=token, file=discord.File(io.BytesIO(self.image(token)), filename="token.png"))
+                self.urls[token] = message.attachments[0].url
+                self._uploaded_at[token] = datetime.datetime.utcnow()
+                uploaded += 1
+            except Exception as e:
+                logging.error(f"Error uploading the {token} image: {e}")
+        return uploaded
+
+    def url(self, token: str) -> Optional[str]:
+        uploaded_at = self._uploaded_at.get(token)
+        if uploaded_at is None or datetime.datetime.utcnow() - uploaded_at > self.refresh:
+            return None
+        return self.urls[token]
+
+    def embed(self, embed: discord.Embed, token: str) -> dict:
+        url = self.url(token)
+        if url is not None:
+            embed.set_image(url=url)
+            return {"embed": embed}
+        embed.set_image(url="attachment://token.png")
+        return {"embed": embed, "file": discord.File(io.BytesIO(self.image(token)), filename="token.png")}
+
+
+token_assets = TokenAssets()
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+TOKEN_TYPES_FILE = os.getenv("TOKEN_TYPES_FILE", os.path.join("config", "token_types.json"))
+
+
+class TokenType(NamedTuple):
+    """
+    A token type. `name` is what balances, the journal and payouts store, so it must not change once tokens exist;
+    everything else can.
+    """
+    id: str
+    name: str
+    aliases: Tuple[str, ...] = ()
+    emoji: Optional[str] = None  # Name of the server emoji
+    image: Optional[str] = None  # File under photos/, `<name>.png` when not set
+    url: Optional[str] = None  # Hosted copy of the image
+    payout_weight: int = 0
+    payout: bool = False  # Paid out and reset by /payout
+    vod_review: bool = False  # Earned from events only once a VOD review is approved
+
+
+default_token_types = [
+    TokenType("event", "Event Token", ("event", "events"), "event_token",
+              url="https://drive.google.com/file/d/1ioi8s17Da6-f7llwg9tiVAtQztz3o479/view?usp=drive_link"),
+    TokenType("leadership", "Leadership Token", ("leadership", "lead"), "leadership_token", payout_weight=2, payout=True,
+              url="https://drive.google.com/file/d/1f-ml9i5GuvQLn5mL2u8hzzCD3hcgrsXR/view?usp=drive_link"),
+    TokenType("competitive", "Competitive Token", ("competitive", "comp"), "competitive_token", payout_weight=1, payout=True,
+              url="https://drive.google.com/file/d/1WAPLeau4w2i-g6LGAVVDIdD-h73YUydZ/view?usp=drive_link"),
+    TokenType("war", "War Token", ("war", "wars"), "war_token", payout_weight=3, payout=True, vod_review=True,
+              url="https://drive.google.com/file/d/1Qno6hchFbxPTBrmpUAOJlJqfTqXUhJW_/view?usp=drive_link"),
+]
+
+
+def normalize(text: str) -> str:
+    return " ".join(str(text).split()).casefold()
+
+
+class TokenRegistry:
+    """
+    Every token type the bot knows, in display order.
+
+    Names, ids, aliases and their plurals are casefolded into one lookup map
+    up front, so resolving what a member typed is a single dict lookup.
+
+    Attributes:
+    tokens (Dict[str, TokenType]): The token types by name.
+    names (List[str]): The token type names.
+    payout_names (List[str]): The names of the token types /payout pays for, by descending payout weight.
+    payout_weights (Dict[str, int]): The share of the payout pool of each paid token type.
+
+    Methods:
+    load: Reads the token types from a JSON file, or falls back to the defaults.
+    get: Gets a token type by name.
+    resolve: Gets a token type from a name, id or alias in any case.
+    search: Gets the token types whose name, id or alias contains some text.
+    """
+    def __init__(self, token_types: Iterable[TokenType] = default_token_types) -> None:
+        self.tokens: Dict[str, TokenType] = {}
+        self._keys: Dict[str, List[str]] = {}
+        lookup: Dict[str, TokenType] = {}
+        for token_type in token_types:
+            if token_type.name in self.tokens:
+                raise ValueError(f"Duplicate token type {token_type.name}")
+            self.tokens[token_type.name] = token_type
+            self._keys[token_type.name] = list(dict.fromkeys(normalize(key) for key in (token_type.name, token_type.id, *token_type.aliases)))
+            for key in self._keys[token_type.name]:
+                other = lookup.setdefault(key, token_type)
+                if other is not token_type:
+                    raise ValueError(f"{key} names both {other.name} and {token_type.name}")
+        # Plurals ("war tokens") resolve too, unless they are another token type's name or alias
+        self._lookup = {f"{key}s": token_type for key, token_type in lookup.items()}
+        self._lookup.update(lookup)
+        self.names: List[str] = list(self.tokens)
+        # Heaviest first, the order payouts are listed in
+        self.payout_names: List[str] = sorted((name for name, token_type in self.tokens.items() if token_type.payout),
+                                              key=lambda name: -self.tokens[name].payout_weight)
+        self.payout_weights: Dict[str, int] = {name: self.tokens[name].payout_weight for name in self.payout_names}
+
+    @classmethod
+    def load(cls, path: str = TOKEN_TYPES_FILE) -> "TokenRegistry":
+        """Load `[{"id": ..., "name": ..., ...}, ...]` from a JSON file, or the default token types if there is none."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding="utf-8") as file:
+            entries = json.load(file)
+        registry = cls(TokenType(**{**entry, "aliases": tuple(entry.get("aliases", ()))}) for entry in entries)
+        logging.info(f"Loaded {len(registry.names)} token type(s) from {path}")
+        return registry
+
+    def get(self, name: str) -> Optional[TokenType]:
+        return self.tokens.get(name)
+
+    def resolve(self, text: str) -> Optional[TokenType]:
+        return self._lookup.get(normalize(text))
+
+    def search(self, text: str, limit: int = 25) -> List[TokenType]:
+        text = normalize(text)
+        return [token_type for name, token_type in self.tokens.items() if any(text in key for key in self._keys[name])][:limit]
+
+
+token_registry = TokenRegistry.load()
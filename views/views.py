@@ -1,13 +1,20 @@
-from decimal import Decimal
+from array import array
+import functools
+import time
 import traceback
 import discord
-from typing import Dict
+from typing import Dict, Optional, Set
 import datetime
 import logging
 from dotenv import load_dotenv
 import os
-from utils.bank_util import openbank, savebank
-from utils.event_util import event_token_add
+from utils.bank_store import get_bank_store
+from utils.event_util import event_tokens_add
+from utils.attendance import JOIN, LEAVE
+from utils.dm_dispatcher import dm_dispatcher
+from utils.event_report import report_writer
+from utils.token_assets import token_assets
+from utils.token_registry import token_registry
 
 logging.basicConfig(level=logging.INFO)
 # Create a logger
@@ -18,7 +25,6 @@ logger.setLevel(logging.INFO)
 console_handler = logging.StreamHandler()
 # Add the console handler to the logger
 logger.addHandler(console_handler)
-token_types = ["Event Token", "Leadership Token", "Competitive Token", "War Token"]
 
 global DISCORD_TOKEN, EVENT_CHANNEL, VODS_CHANNEL
 load_dotenv(os.path.join(os.getcwd(), "config", "event_configs.env"))
@@ -26,8 +32,6 @@ EVENT_CHANNEL = int(os.getenv("EVENT_CHANNEL"))
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 VODS_CHANNEL = int(os.getenv("VODS_CHANNEL"))
 
-photos_folder = os.path.join(os.getcwd(), "photos")
-
 company_lead_roles = {
     "STR Bruiser Lead": 1168251564419461120,
     "INT Bruiser Lead": 1168251540046364836,
@@ -42,9 +46,6 @@ company_roles = {
     "governor": 1040383340320149554
 }
 
-payout_event_tokens = ["War Token", "Leadership Token", "Competitive Token"]
-
-
 class Event:
     """
     Class to handle a Discord Event's Lifecycle.
@@ -56,35 +57,51 @@ class Event:
     event_start_time (datetime.datetime): The time when the event started.
     event_end_time (datetime.datetime): The time when the event ended.
     participants (Dict[int, EventParticipant]): The participants in the event.
+    present (Set[int]): The ids of the participants with an open session.
+    corrections (int): How many sessions reconcile had to open or close.
     joined_times (Dict[int, datetime.datetime]): The times when participants joined the event.
     leave_times (Dict[int, datetime.datetime]): The times when participants left the event.
     rejoined_times (Dict[int, datetime.datetime]): The times when participants rejoined the event.
     pool: The connection pool to the database.
+    event_id (int): The id of the scheduled event.
+    attendance (AttendanceLog): Where joins and leaves are checkpointed, if anywhere.
+    delivery (asyncio.Task): The background delivery of the event's DMs; its result maps member ids to delivery status.
 
     Methods:
     reset: Resets the event attributes.
     initialize: Initializes the event with the given channel.
-    send_token_embed: Sends a token embed to the given member.
-    create_event_file: Creates an event file with the given event data.
-    handle_vod_review: Handles the VOD review for the given member.
+    rehydrate: Restores an event in progress from its attendance checkpoint.
+    member_joined: Starts a period in the event for a member.
+    member_left: Ends a member's current period in the event.
+    reconcile: Opens and closes sessions so they match who is in the channel.
+    token_message: Builds the token DM for a member.
+    create_event_file: Writes the JSONL, CSV and text reports of the event off the event loop.
+    vod_review_message: Builds the pending token DM for a member who needs a VOD review.
     finalize: Finalizes the event and calculates the time spent by each member and updates the bank, and sends the token to each member.
     """
-    def __init__(self, bot, pool):
+    def __init__(self, bot, pool, event_id=None, attendance=None):
         self.is_ongoing = False
         self.channel = None
         self.bot = bot
         self.event_start_time = None
         self.event_end_time = None
         self.participants: Dict[int, EventParticipant] = {}
+        self.present: Set[int] = set()
+        self.corrections = 0
         self.joined_times = {}
         self.leave_times = {}
         self.rejoined_times = {}
         self.pool = pool
+        self.store = get_bank_store(pool)
+        self.event_id = event_id
+        self.attendance = attendance
+        self.delivery = None
 
     async def reset(self):
         self.is_ongoing = False
         self.channel = None
         self.participants.clear()
+        self.present.clear()
         self.joined_times.clear()
         self.leave_times.clear()
         self.rejoined_times.clear()
@@ -93,69 +110,91 @@ class Event:
         logger.info("Event Has Started!")
         self.is_ongoing = True
         self.channel = after.channel
+        started = time.monotonic()
         self.event_start_time = datetime.datetime.utcnow()
+        if self.attendance:
+            await self.attendance.start_event(self.event_id, self.channel.id if self.channel else None, self.event_start_time)
         for member in self.channel.members:
-            self.participants[member.id] = EventParticipant(member.id)
-            self.participants[member.id].current_start_time = self.event_start_time
-
-    async def send_token_embed(self, member, token, event_name, bank):
-        member_id = member.id
-        member_discord = self.channel.guild.get_member(member_id)
-        company = next((role_name for role_name, role_id in company_roles.items() if discord.utils.get(member_discord.roles, id=role_id)), None)
-        file = discord.File(os.path.join(photos_folder, f"{token}.png"), filename="token.png")
+            self.member_joined(member.id, started)
+
+    async def rehydrate(self, after, session):
+        # Replay the checkpointed joins and leaves, then reconcile them with who is in the channel now
+        logger.info(f"Resuming event {after.name} from its attendance checkpoint")
+        self.is_ongoing = True
+        self.channel = after.channel
+        self.event_start_time = session.started_at
+        # Checkpoints hold UTC times from before the restart; this is the one place they are mapped onto the monotonic clock
+        for member_id, action, at in session.records:
+            participant = self.participants.setdefault(member_id, EventParticipant(member_id))
+            if action == JOIN:
+                participant.join_event(clock_from_datetime(at))
+                self.present.add(member_id)
+            else:
+                participant.leave_event(clock_from_datetime(at))
+                self.present.discard(member_id)
+        present = {member.id for member in self.channel.members} if self.channel else set()
+        for member_id in self.present - present:
+            # Left while the bot was down; the last checkpoint is the latest time they are known to have been there
+            self.member_left(member_id, clock_from_datetime(session.checkpoint_at))
+        for member_id in present - self.present:
+            self.member_joined(member_id)
+
+    def member_joined(self, member_id, at: Optional[float] = None):
+        # at is a time.monotonic() reading, taken when the voice update arrived
+        participant = self.participants.get(member_id)
+        if participant is None:
+            participant = EventParticipant(member_id)
+            self.participants[member_id] = participant
+        participant.join_event(at)
+        self.present.add(member_id)
+        if self.attendance:
+            self.attendance.record(self.event_id, member_id, JOIN, participant.current_start_time)
+        return participant
+
+    def member_left(self, member_id, at: Optional[float] = None):
+        participant = self.participants.get(member_id)
+        if participant is None:
+            return None
+        at = time.monotonic() if at is None else at
+        participant.leave_event(at)
+        self.present.discard(member_id)
+        if self.attendance:
+            self.attendance.record(self.event_id, member_id, LEAVE, datetime_from_clock(at))
+        return participant
+
+    def reconcile(self) -> int:
+        """Diff the channel's members against the open sessions and fix any the voice updates missed. Returns the fixes made."""
+        if not self.is_ongoing or self.channel is None:
+            return 0
+        in_channel = {member.id for member in self.channel.members}
+        joined = in_channel - self.present
+        left = self.present - in_channel
+        for member_id in left:
+            self.member_left(member_id)
+        for member_id in joined:
+            self.member_joined(member_id)
+        self.corrections += len(joined) + len(left)
+        return len(joined) + len(left)
+
+    def token_message(self, token, event_name, balance) -> dict:
         embed = discord.Embed(
             title=f"**You just received a {token}!**",
             description=f"Congrats! You just received a {token} for taking part in {event_name}",
             color=discord.Color.green(),
-        ).add_field(name=f"Current {token} balance:", value=str(bank[company][member_id][token]))
-        embed.set_image(url="attachment://token.png")
-        try:
-            await member.send(file=file, embed=embed)
-        except discord.Forbidden:
-            logger.warning(f"Cannot send message to {member.display_name} due to privacy settings.")
-
-    async def create_event_file(self, event_data):
-        folder_path = "event_files"
-        os.makedirs(folder_path, exist_ok=True)
-        for event_name, event_info in event_data.items():
-            filename = os.path.join(folder_path, f"{event_name}_event.txt")
-            try:
-                with open(filename, "w") as file:
-                    # Write event general information
-                    file.write(
-                        f"Event Name: {event_name}\n"
-                        f"Event Duration: {event_info['event_duration']} seconds\n\n"
-                    )
-                    for member_id, member_data in event_info["members"].items():
-                        # Write member-specific information
-                        member_nick = self.channel.guild.get_member(int(member_id)).display_name
-                        file.write(
-                            f"Member ID: {member_id}\n"
-                            f"Member Nickname: {member_nick}\n"
-                            f"Token Earned: {member_data['Token Earned']}\n"
-                            f"Start Balance: {member_data['start_balance']}\n"
-                            f"End Balance: {member_data['end_balance']}\n"
-                            f"Time Spent in Event: {member_data['duration']} seconds\n\n"
-                        )
-                logging.info(f"Event file '{filename}' created successfully.")
-            except IOError as io_err:
-                logging.error(f"IOError when creating event file '{filename}': {io_err}")
-            except Exception as e:
-                logging.error(f"Error when creating event file '{filename}': {e}")
-
-    async def handle_vod_review(self, member_discord, token, event_name):
-        if token == "War Token":
-            file = discord.File(os.path.join(photos_folder, f"{token}.png"), filename=f"token.png")
-            embed = discord.Embed(
-                title="**You just received a Pending Token!**",
-                description=f"You just received a pending {token} for taking part in {event_name}, you must post a VOD review to receive the token!",
-                color=discord.Color.green(),
-            )
-            embed.set_image(url=f"attachment://token.png")
-            try: 
-                await member_discord.send(file=file, embed=embed)
-            except discord.Forbidden:
-                logger.warning(f"Cannot send message to {member_discord.display_name} due to privacy settings.")
+        ).add_field(name=f"Current {token} balance:", value=str(balance))
+        return token_assets.embed(embed, token)
+
+    async def create_event_file(self, event_data, names):
+        # names maps member ids to display names, resolved while the members were at hand
+        await report_writer.write(self.event_id, event_data, names, self.event_end_time)
+
+    def vod_review_message(self, token, event_name) -> dict:
+        embed = discord.Embed(
+            title="**You just received a Pending Token!**",
+            description=f"You just received a pending {token} for taking part in {event_name}, you must post a VOD review to receive the token!",
+            color=discord.Color.green(),
+        )
+        return token_assets.embed(embed, token)
 
     async def finalize(self, before):
         # Finalize the event and calculate the time spent by each member and update the bank send the token to each member 
@@ -165,143 +204,147 @@ class Event:
         if self.channel is None:
             self.channel = before.channel
         token = None 
-        for token_type in token_types:
+        for token_type in token_registry.names:
             if token_type in description:
                 token = token_type
                 logging.info(f"Token type found: {token_type}")
                 break
         if token is None:
-            token = "Event Token" # Default to Event Token if no token type is found
+            token = token_registry.names[0] # Default to the first token type (Event Token) if no token type is found
         self.event_end_time = datetime.datetime.utcnow()
-        bank = await openbank(self.pool)
         event_duration = (self.event_end_time - self.event_start_time).total_seconds()
         event_name = before.name
         event_data = {event_name: {"event_duration": event_duration, "members": {}}}
 
+        members_needing_vod_review = []
+        messages = []  # DMs are sent in the background once the tokens are committed
+        pending = []  # (member_id, company, token) waiting on a VOD review
         try:
+            earners = []  # (member_discord, company, participant) of everyone receiving the token
             for member in self.participants.values():
                 member_id = member.user_id
                 member_discord = self.channel.guild.get_member(member_id)
                 if not member_discord:
                     continue
                 member.event_ends()
-                members_needing_vod_review = []
                 needs_vod_review = True   # Set to True if the member needs a VOD review
-                precise_duration = member.get_total_time_spent()
                 company = next((role_name for role_name, role_id in company_roles.items() if discord.utils.get(member_discord.roles, id=role_id)), None)
                 for role_name, role_id in company_lead_roles.items():
                     if discord.utils.get(member_discord.roles, id=role_id):
                         needs_vod_review = False
                         break
-                if needs_vod_review and token == "War Token":
+                if needs_vod_review and token_registry.get(token).vod_review:
                     members_needing_vod_review.append(member_discord.display_name) # Add the member to the list of members needing a VOD review
-                    await self.handle_vod_review(member_discord, token, event_name)
+                    if company:
+                        pending.append((member_id, company, token))
+                    messages.append((member_discord, functools.partial(self.vod_review_message, token, event_name)))
                     continue  # Skip the rest of the code and go to the next member
                 if company:
-                    bank.setdefault(company, {}) # Create the company key if it doesn't exist
-                    member_id = str(member_id) # Convert to string to use as key in bank
-                    # Check if the company key exists in the bank dictionary
-                    start_balance, end_balance, bank = await event_token_add( member_id, company, bank, token)
-                    member_data = {
-                        "start_balance": start_balance,
-                        "join_time": self.joined_times.get(member_id, self.event_start_time),
-                        "Token Earned": token,
-                        "end_balance": end_balance,
-                        "duration": precise_duration,
-                    }
-                    event_data[event_name]["members"][member_id] = member_data
-                    await self.send_token_embed(member_discord, token, before.name, bank)
+                    earners.append((member_discord, company, member))
+            # Grant every token of the event in a single transaction
+            balances = await event_tokens_add([(member_discord.id, company) for member_discord, company, _ in earners], self.store, token, before.id)
+            await self.store.add_pending_tokens(pending, before.id)  # Granted later with /approvetokens
+            for member_discord, company, participant in earners:
+                start_balance, end_balance = balances[member_discord.id]
+                member_id = str(member_discord.id) # Convert to string to use as key in event_data
+                member_data = {
+                    "start_balance": start_balance,
+                    "join_time": self.joined_times.get(member_id, self.event_start_time),
+                    "Token Earned": token,
+                    "end_balance": end_balance,
+                    "duration": participant.get_total_time_spent(),
+                    "sessions": participant.sessions(),
+                }
+                event_data[event_name]["members"][member_id] = member_data
+                messages.append((member_discord, functools.partial(self.token_message, token, before.name, end_balance)))
         except Exception as e:
             traceback.print_exc() # Print the traceback to the console
             logging.error(f"Error in finalize: {e}")
+        self.delivery = dm_dispatcher.dispatch(event_name, messages)
         # Send vod reviews needed to VOD Channel
-        if token == "War Token":
+        if token_registry.get(token).vod_review:
             await self.bot.get_channel(VODS_CHANNEL).send(f"**{token} VOD Reviews Needed:**\n{', '.join(members_needing_vod_review)}")
-        await savebank(bank, self.pool)
-        await self.create_event_file(event_data)
+        await self.create_event_file(event_data, {member_discord.id: member_discord.display_name for member_discord, _ in messages})
+        if self.attendance:
+            try:
+                await self.attendance.end_event(self.event_id)
+            except Exception as e:
+                logging.error(f"Error clearing the attendance checkpoint of {event_name}: {e}")
         await self.reset()
 
 
+# Attendance is timed on the monotonic clock so wall-clock adjustments can't stretch or shrink it. These anchors
+# convert to UTC datetimes for checkpoints and reports, which have to mean the same thing across restarts, and
+# map checkpointed times back onto the monotonic clock when an event is rehydrated.
+_clock_anchor = time.monotonic()
+_datetime_anchor = datetime.datetime.utcnow()
+
+
+def clock_from_datetime(at: datetime.datetime) -> float:
+    return _clock_anchor + (at - _datetime_anchor).total_seconds()
+
+
+def datetime_from_clock(clock: float) -> datetime.datetime:
+    return _datetime_anchor + datetime.timedelta(seconds=clock - _clock_anchor)
+
+
 class EventParticipant:
     """
     Class to handle a participant in an event.
 
+    The sessions are kept as a flat array of monotonic-clock (join, leave, join,
+    leave, ...) timestamps; an odd length means the participant is in the event
+    right now. A join at or before the previous leave reopens that session
+    instead of starting a new one.
+
     Attributes:
     user_id (int): The user ID of the participant.
-    time_in_event (datetime.timedelta): The time spent by the participant in the event.
-    current_start_time (datetime.datetime): The start time of the current period.
+    time_in_event (datetime.timedelta): The time spent by the participant in the event's closed sessions.
+    current_start_time (datetime.datetime): The UTC start time of the current session, None when not in the event.
 
     Methods:
-    join_event: Update the current_start_time to the current time.
-    leave_event: Calculate the duration of the current period and update time_in_event.
-    event_ends: Calculate the time spent until now and update time_in_event.
+    join_event: Start a session at the given monotonic clock time, or now.
+    leave_event: Close the current session at the given monotonic clock time, or now.
+    event_ends: Close the current session now.
     get_total_time_spent: Get the total time spent by the participant
+    sessions: Get the (join, leave) UTC times of every session, leave being None for the current one.
     """
+    __slots__ = ("user_id", "_times")
+
     def __init__(self, user_id):
         self.user_id = user_id
-        self.time_in_event = datetime.timedelta(seconds=0) 
-        self.current_start_time = None  # Store the start time of the current period
-
-    def join_event(self):
-        self.current_start_time = datetime.datetime.utcnow()
-
-    def leave_event(self):
-        if self.current_start_time:
-            end_time = datetime.datetime.utcnow()
-            duration = (end_time - self.current_start_time).total_seconds()
-            duration = datetime.timedelta(seconds=duration)
-            self.time_in_event += duration
-            self.current_start_time = None
+        self._times = array("d")
+
+    @property
+    def current_start_time(self):
+        return datetime_from_clock(self._times[-1]) if len(self._times) % 2 else None
+
+    @property
+    def time_in_event(self):
+        return self.get_total_time_spent()
+
+    def join_event(self, at: Optional[float] = None):
+        if len(self._times) % 2:
+            return  # Already in the event: keep the session that is running
+        clock = time.monotonic() if at is None else at
+        if self._times and clock <= self._times[-1]:
+            self._times.pop()  # Merge with the session that just ended
+        else:
+            self._times.append(clock)
+
+    def leave_event(self, at: Optional[float] = None):
+        if len(self._times) % 2:
+            clock = time.monotonic() if at is None else at
+            self._times.append(max(clock, self._times[-1]))
 
     def event_ends(self):
-        # If the event ends, calculate time spent until now and update time_in_event
-        if self.current_start_time:
-            end_time = datetime.datetime.utcnow()
-            duration = (end_time - self.current_start_time).total_seconds()
-            duration = datetime.timedelta(seconds=duration)
-            self.time_in_event += duration
-            self.current_start_time = None
+        # If the event ends, close the current session
+        self.leave_event()
 
     def get_total_time_spent(self):
-        return self.time_in_event
-
-
-class GuildMemberEventParticipant:
-    def __init__(self, member_id: int, tokens: int = 0) -> None:
-        self.tokens = Decimal(tokens)
-        self.war_tokens = Decimal(0)
-        self.leadership_tokens = Decimal(0)
-        self.competitive_tokens = Decimal(0)
-        self.member_id = str(member_id)  # Store as string if it's used as a string
-        self.war_payout: Decimal = Decimal(0)
-        self.leadership_payout: Decimal = Decimal(0)
-        self.competitive_payout: Decimal = Decimal(0)
-
-    def war_token_payout(self, gold_per_wartoken: Decimal) -> Decimal:
-        war_token_payout = self.war_tokens * gold_per_wartoken
-        self.war_payout += war_token_payout
-        return war_token_payout
-
-    def leadership_token_payout(self, gold_per_leadershiptoken: Decimal) -> Decimal:
-        leadership_token_payout = self.leadership_tokens * gold_per_leadershiptoken
-        self.leadership_payout += leadership_token_payout
-        return leadership_token_payout
-
-    def competitive_token_payout(self, gold_per_competitivetoken: Decimal) -> Decimal:
-        competitive_token_payout = self.competitive_tokens * gold_per_competitivetoken
-        self.competitive_payout += competitive_token_payout
-        return competitive_token_payout
-
-    def weekly_payout(self) -> Decimal:
-        return self.war_payout + self.leadership_payout + self.competitive_payout
-
-    def reset_tokens(self) -> None:
-        """Reset the member's tokens to zero."""
-        self.tokens = Decimal(0)
-
-    def update_tokens_from_bank(self, bank, role_name) -> None:
-        member_bank_info = bank.get(role_name, {}).get(self.member_id, {})
-        self.war_tokens += Decimal(member_bank_info.get("War Token", 0))
-        self.leadership_tokens += Decimal(member_bank_info.get("Leadership Token", 0))
-        self.competitive_tokens += Decimal(member_bank_info.get("Competitive Token", 0))
-        self.tokens = self.war_tokens + self.leadership_tokens + self.competitive_tokens
+        times = self._times
+        return datetime.timedelta(seconds=sum(times[i + 1] - times[i] for i in range(0, len(times) - 1, 2)))
+
+    def sessions(self):
+        times = [datetime_from_clock(clock) for clock in self._times]
+        return [(times[i], times[i + 1] if i + 1 < len(times) else None) for i in range(0, len(times), 2)]